@@ -1,76 +1,97 @@
 import math
-from time import perf_counter
 from tetris import is_colliding
 from tetromino import Tetromino
 from random import random, randint
-from copy import deepcopy
+from features import FeatureSet, default_features
 
 class TetrisAI:
-    def __init__(self, grid_width, grid_height,
-        row_filled_weights=[], hole_height_weights=[], column_diff_weights=[]):
-        self.grid_width = grid_width
-        self.grid_height = grid_height
-        self.row_filled_weights = row_filled_weights
-        self.hole_height_weights = hole_height_weights
-        self.column_diff_weights = column_diff_weights
-        # number of weights to use for hole height and column diff heuristics
-        # note that row filled weights uses grid_width + 1 weights
-        self.hole_height_cap = 5
-        self.column_diff_cap = 5
+    def __init__(self, shapes, weights=None, feature_set=None):
+        # ShapeSet of the games this AI plays
+        self.shapes = shapes
+        self.grid_width = shapes.grid_width
+        self.grid_height = shapes.grid_height
+        # the heuristics used to score a grid, see features.py
+        # by default these are how filled the rows are, the heights of holes and
+        # the differences in column heights
+        if feature_set is None:
+            feature_set = FeatureSet.get(default_features, self.grid_width, self.grid_height)
+        self.feature_set = feature_set
+        # flat list of the weights of all features, in the order of the features
         # generate random weights if not provided
-        if len(row_filled_weights) == 0:
-            for i in range(grid_width + 1):
-                self.row_filled_weights.append(self.random_weight())
-        if len(hole_height_weights) == 0:
-            for i in range(self.hole_height_cap):
-                self.hole_height_weights.append(self.random_weight())
-        if len(column_diff_weights) == 0:
-            for i in range(self.column_diff_cap):
-                self.column_diff_weights.append(self.random_weight())
+        if weights is None or len(weights) == 0:
+            weights = [self.random_weight() for i in range(feature_set.num_weights)]
+        if len(weights) != feature_set.num_weights:
+            raise ValueError(f'Expected {feature_set.num_weights} weights, got {len(weights)}')
+        self.weights = weights
+        self.evaluate = feature_set.bind(self.weights)
+        # lines this AI is expected to clear, set when it is bred, None if unknown
+        # used to schedule its game before the longer and after the shorter ones
+        self.expected_fitness = None
+        # set when it is carried over unchanged into the next generation, its
+        # weights were already recorded by the surrogate screen when it was bred
+        self.survivor = False
+        # score each placement from the columns and rows it touches if all features
+        # support it, so the cost of a placement does not grow with the grid size
+        # the moves chosen are the same either way
+        self.incremental = feature_set.incremental
+        if self.incremental:
+            self.prepare, self.evaluate_delta = feature_set.bind_incremental(self.weights)
 
         # weights that have achieved 57580 line clears before (computer ran for a whole day training this!)
-        # uncomment to try them out
-        #self.row_filled_weights = [0.69, 0.55, 0.41, 0.40, 0.31, 0.09, 0.01, 0.23, 0.34, 0.82, 1.48]
-        #self.hole_height_weights = [1.34, 1.90, 1.72, 2.08, 2.65]
-        #self.column_diff_weights = [0.12, 0.29, 0.38, 0.62, 0.86]
+        # uncomment to try them out (default features on a 10 wide grid)
+        #self.weights[:] = [0.69, 0.55, 0.41, 0.40, 0.31, 0.09, 0.01, 0.23, 0.34, 0.82, 1.48,
+        #    1.34, 1.90, 1.72, 2.08, 2.65,
+        #    0.12, 0.29, 0.38, 0.62, 0.86]
+
+    # the compiled evaluation function can not be pickled, it is bound again instead
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['evaluate']
+        state.pop('prepare', None)
+        state.pop('evaluate_delta', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.evaluate = self.feature_set.bind(self.weights)
+        if self.incremental:
+            self.prepare, self.evaluate_delta = self.feature_set.bind_incremental(self.weights)
+
+    # weights of each feature, used for displaying the AI
+    def weights_by_feature(self):
+        return self.feature_set.split_weights(self.weights)
 
     # determine what move should be made given a Tetris instance
-    # the type of Tetromino used is the Tetris instance current tetromino
-    def compute_move(self, inst):
-        best_move = (float('-inf'), None)
+    # the type of Tetromino used is the Tetris instance current tetromino, unless
+    # a BoundedSearch is given (see search.py), which also considers the hold
+    # slot and the preview of the game
+    def compute_move(self, inst, search=None):
+        if search is not None:
+            return search.best_move(self, inst)
         grid = self.to_boolean_grid(inst.grid)
-        # compute moves available with the current tetromino
-        first_moves = self.compute_moves_available(grid, inst.current_tmino)
-        # for every move with the current tetromino,
-        # compute moves available with the next tetromino
-        for move1 in first_moves:
+        return self.best_placement(grid, inst.current_tmino.id)[1]
+
+    # finds the best placement of a tetromino on a boolean grid
+    # if next_id is given, each placement is instead scored by the best placement
+    # of the next tetromino after it; note that this runs exponentially slower
+    # returns a tuple of the score and the placed Tetromino (None if nothing fits)
+    def best_placement(self, grid, id, next_id=None):
+        if self.incremental:
+            return self.best_placement_incremental(grid, id, next_id)
+        best_move = (float('-inf'), None)
+        # compute moves available with the tetromino
+        for move in self.compute_moves_available(grid, Tetromino(self.shapes, id)):
             # determine a score for each move
-            tmino1 = Tetromino(inst.current_tmino.id, move1[0], move1[1], move1[2])
-            self.add_to_grid(grid, tmino1)
-            score = self.compute_score(grid)
+            tmino = Tetromino(self.shapes, id, move[0], move[1], move[2])
+            self.add_to_grid(grid, tmino)
+            if next_id is None:
+                score = self.compute_score(grid, tmino)
+            else:
+                score = self.best_placement(grid, next_id)[0]
+            self.remove_from_grid(grid, tmino)
             if score > best_move[0]:
-                best_move = (score, Tetromino(inst.current_tmino.id, move1[0], move1[1], move1[2]))
-            self.remove_from_grid(grid, tmino1)
-
-            # the code below is an experimental scoring function
-            # it returns the average of the scores of the next tetromino placement
-            # note that this however runs exponentially slower then the code above
-            """# compute possible moves for the next tetromino
-            tmino1 = Tetromino(inst.current_tmino.id, move1[0], move1[1], move1[2])
-            self.add_to_grid(grid, tmino1)
-            sum_score = 0
-            second_moves = self.compute_moves_available(grid, inst.next_tmino)
-            for move2 in second_moves:
-                tmino2 = Tetromino(inst.next_tmino.id, move2[0], move2[1], move2[2])
-                self.add_to_grid(grid, tmino2)
-                sum_score += self.compute_score(grid)
-                self.remove_from_grid(grid, tmino2)
-            self.remove_from_grid(grid, tmino1)
-
-            avg_score = float('-inf') if len(second_moves) == 0 else sum_score / len(second_moves)
-            if avg_score >= best_move[0]:
-                best_move = (avg_score, Tetromino(inst.current_tmino.id, move1[0], move1[1], move1[2]))"""
-        return best_move[1]
+                best_move = (score, tmino)
+        return best_move
 
     # computes all possible drop placements that can be made
     def compute_moves_available(self, grid, tetromino):
@@ -80,59 +101,126 @@ class TetrisAI:
         for rotation in tetromino.unique_rotations_list:
             # to compute each possible drop placement, first find the largest value
             # in the heightmap that contains the tetromino at each section of columns
-            current_tmino = Tetromino(tetromino.id, rotation)
+            current_tmino = Tetromino(self.shapes, tetromino.id, rotation)
             for i in range(current_tmino.min_x, current_tmino.max_x + 1):
                 current_tmino.x_pos = i
-                # find greatest height
-                greatest_height = 0
-                for j in range(i, i + current_tmino.size):
-                    # check for out of bounds
-                    if j >= 0 and j < len(grid):
-                        if heights[j] > greatest_height:
-                            greatest_height = heights[j]
-                # we are guaranteed that the tetromino will not have collided with
-                # anything before this greatest height value, all that is needed
-                # to do now is to find the correct point of contact
-                for j in range(max(len(grid[0]) - greatest_height - current_tmino.size, current_tmino.min_y), current_tmino.max_y + 1):
-                    current_tmino.y_pos = j
-                    if is_colliding(grid, current_tmino):
-                        current_tmino.y_pos = j - 1
-                        break
-                if not is_colliding(grid, current_tmino):
+                if self.drop(grid, heights, current_tmino):
                     # tetromino is now at a possible placement
                     possible_moves.append((rotation, current_tmino.x_pos, current_tmino.y_pos))
         return possible_moves
 
-    # computes a score for the given binary grid arrangement
-    # True should indicate an occupied cell, False should indicate empty cell
-    def compute_score(self, grid):
-        # add to score based on how filled the rows are
-        score = 0
-        for y in range(self.grid_height):
-            cells_filled = 0
-            for x in range(self.grid_width):
-                if grid[x][y]:
-                    cells_filled += 1
-            score += self.row_filled_weights[cells_filled]
+    # drops a tetromino down from above the stack at its x position
+    # sets its y position and returns whether it ended up at a valid placement
+    def drop(self, grid, heights, tmino):
+        # find greatest height
+        greatest_height = 0
+        for j in range(tmino.x_pos, tmino.x_pos + tmino.size):
+            # check for out of bounds
+            if j >= 0 and j < len(grid):
+                if heights[j] > greatest_height:
+                    greatest_height = heights[j]
+        # we are guaranteed that the tetromino will not have collided with
+        # anything before this greatest height value, all that is needed
+        # to do now is to find the correct point of contact
+        for j in range(max(len(grid[0]) - greatest_height - tmino.size, tmino.min_y), tmino.max_y + 1):
+            tmino.y_pos = j
+            if is_colliding(grid, tmino):
+                tmino.y_pos = j - 1
+                break
+        return not is_colliding(grid, tmino)
 
-        # subtract from score based on heights of holes
-        heights = self.compute_heightmap(grid)
-        for x in range(self.grid_width):
-            hole_height = 0
-            for y in range(self.grid_height - heights[x], self.grid_height):
-                if grid[x][y]:
-                    if hole_height > 0:
-                        score -= self.hole_height_weights[min(hole_height, self.hole_height_cap) - 1]
-                        hole_height = 0
+    # finds the best placement like best_placement, but scores each placement
+    # from the region it touches instead of evaluating the whole grid
+    # the placements and their order are the same as compute_moves_available
+    def best_placement_incremental(self, grid, id, next_id=None):
+        return self.pick_placement(grid, id, self.score_placements(grid, id, next_id))
+
+    # scores every placement of a tetromino on a boolean grid, like best_placement
+    # returns a list of (score, whether the score is exact, (rotation, x, y))
+    # tuples in search order, scores from deltas are only accurate up to rounding
+    def score_placements(self, grid, id, next_id=None):
+        scored = []
+        if not self.incremental:
+            for move in self.compute_moves_available(grid, Tetromino(self.shapes, id)):
+                tmino = Tetromino(self.shapes, id, *move)
+                self.add_to_grid(grid, tmino)
+                if next_id is None:
+                    score = self.compute_score(grid, tmino)
                 else:
-                    hole_height += 1
-            if hole_height > 0:
-                score -= self.hole_height_weights[min(hole_height, self.hole_height_cap - 1)]
+                    score = self.best_placement(grid, next_id)[0]
+                self.remove_from_grid(grid, tmino)
+                scored.append((score, True, move))
+            return scored
+        base = self.prepare(grid)
+        for rotation, x_pos, y_pos, stacked in self.compute_drops(grid, base[2], id):
+            if stacked and next_id is None:
+                tmino_type = self.shapes.get_tetromino_type(id, rotation)
+                scored.append((self.evaluate_delta(base, (tmino_type, x_pos, y_pos)), False, (rotation, x_pos, y_pos)))
+                continue
+            tmino = Tetromino(self.shapes, id, rotation, x_pos, y_pos)
+            self.add_to_grid(grid, tmino)
+            if next_id is None:
+                score = self.compute_score(grid, tmino)
+            else:
+                score = self.best_placement_incremental(grid, next_id)[0]
+            self.remove_from_grid(grid, tmino)
+            scored.append((score, True, (rotation, x_pos, y_pos)))
+        return scored
 
-        # subtract from score based on differences in column heights
-        for i in range(1, len(heights)):
-            score -= self.column_diff_weights[min(abs(heights[i] - heights[i - 1]), self.column_diff_cap - 1)]
-        return score
+    # picks the best of the placements scored by score_placements
+    # returns a tuple of the score and the placed Tetromino (None if nothing fits)
+    def pick_placement(self, grid, id, scored):
+        if len(scored) == 0:
+            return float('-inf'), None
+        # scores from deltas are only accurate up to rounding, so placements
+        # tied with the best are evaluated fully to break ties exactly like
+        # best_placement does
+        top_score = max([elem[0] for elem in scored])
+        tolerance = 1e-9 * (1 + abs(top_score))
+        best_move = (float('-inf'), None)
+        for score, exact, move in scored:
+            if score < top_score - tolerance:
+                continue
+            if not exact:
+                tmino = Tetromino(self.shapes, id, *move)
+                self.add_to_grid(grid, tmino)
+                score = self.compute_score(grid, tmino)
+                self.remove_from_grid(grid, tmino)
+            if score > best_move[0]:
+                best_move = (score, move)
+        return best_move[0], Tetromino(self.shapes, id, *best_move[1])
+
+    # computes all possible drop placements of a tetromino from the heightmap
+    # returns (rotation, x, y, stacked) tuples, stacked is True if every cell of
+    # the placement is above the top of its column
+    def compute_drops(self, grid, heights, id):
+        drops = []
+        for rotation in self.shapes.unique_tmino_list[id - 1]:
+            tmino_type = self.shapes.get_tetromino_type(id, rotation)
+            for x_pos in range(tmino_type.min_x, tmino_type.max_x + 1):
+                # the first column to stop the tetromino decides where it lands
+                y_pos = tmino_type.max_y
+                for x, bottom in enumerate(tmino_type.column_bottoms):
+                    if bottom != -1:
+                        y_pos = min(y_pos, self.grid_height - heights[x_pos + x] - 1 - bottom)
+                if y_pos >= tmino_type.min_y:
+                    drops.append((rotation, x_pos, y_pos, True))
+                else:
+                    # the stack reaches the top of the grid, the tetromino may
+                    # still fit under an overhang
+                    tmino = Tetromino(self.shapes, id, rotation, x_pos)
+                    if self.drop(grid, heights, tmino):
+                        drops.append((rotation, x_pos, tmino.y_pos, False))
+        return drops
+
+    # computes a score for the given binary grid arrangement
+    # True should indicate an occupied cell, False should indicate empty cell
+    # tmino is the tetromino that was just added to the grid, if any
+    def compute_score(self, grid, tmino=None):
+        placement = None
+        if tmino is not None:
+            placement = (self.shapes.get_tetromino_type(tmino.id, tmino.rotation), tmino.x_pos, tmino.y_pos)
+        return self.evaluate(grid, placement)
 
     # finds the heights of the highest occupied cell in each column of a Tetris grid
     def compute_heightmap(self, grid):
@@ -173,29 +261,20 @@ class TetrisAI:
                     grid[grid_x][grid_y] = False
 
     # combines this AI and another by mixing weights
+    # the weights of each feature are crossed over separately
     # returns a new AI with crossovered weights
     def crossover(self, ai):
-        crossover_idx = randint(0, len(ai.row_filled_weights))
-        new_row_filled_weights = deepcopy(self.row_filled_weights[:crossover_idx] + ai.row_filled_weights[crossover_idx:])
-        crossover_idx = randint(0, len(ai.hole_height_weights))
-        new_hole_height_weights = deepcopy(self.hole_height_weights[:crossover_idx] + ai.hole_height_weights[crossover_idx:])
-        crossover_idx = randint(0, len(ai.column_diff_weights))
-        new_column_diff_weights = deepcopy(self.column_diff_weights[:crossover_idx] + ai.column_diff_weights[crossover_idx:])
-
-        return TetrisAI(ai.grid_width, ai.grid_height,
-            new_row_filled_weights, new_hole_height_weights, new_column_diff_weights)
+        new_weights = []
+        for (name, weights1), (name, weights2) in zip(self.weights_by_feature(), ai.weights_by_feature()):
+            crossover_idx = randint(0, len(weights2))
+            new_weights += weights1[:crossover_idx] + weights2[crossover_idx:]
+        return TetrisAI(ai.shapes, new_weights, ai.feature_set)
 
     # randomly mutates weights given a mutation rate
     def mutate(self, mutate_rate):
-        for i in range(self.grid_width):
-            if random() <= mutate_rate:
-                self.row_filled_weights[i] = self.random_weight()
-        for i in range(self.hole_height_cap):
+        for i in range(len(self.weights)):
             if random() <= mutate_rate:
-                self.hole_height_weights[i] = self.random_weight()
-        for i in range(self.column_diff_cap):
-            if random() <= mutate_rate:
-                self.column_diff_weights[i] = self.random_weight()
+                self.weights[i] = self.random_weight()
 
     def random_weight(self):
         # produce along the abs of a standard normal distribution curve using the Box-Muller transform
@@ -204,11 +283,21 @@ class TetrisAI:
 
     # returns a deep copy of this AI
     def clone(self):
-        return TetrisAI(
-            self.grid_width, self.grid_height,
-            deepcopy(self.row_filled_weights),
-            deepcopy(self.hole_height_weights),
-            deepcopy(self.column_diff_weights))
+        return TetrisAI(self.shapes, list(self.weights), self.feature_set)
+
+    # returns the weights of this AI as a plain dictionary
+    # used to send AIs between processes and to save them to disk
+    def to_dict(self):
+        return {
+            'features': list(self.feature_set.spec),
+            'weights': list(self.weights),
+        }
+
+    # creates an AI from a dictionary produced by to_dict
+    @staticmethod
+    def from_dict(shapes, weights):
+        feature_set = FeatureSet.get(weights['features'], shapes.grid_width, shapes.grid_height)
+        return TetrisAI(shapes, list(weights['weights']), feature_set)
 
     # returns a boolean representation of the given grid
     # where False is an empty cell and True is a filled cell
@@ -0,0 +1,76 @@
+"""Benchmarks of move search across grid sizes.
+
+Times TetrisAI.best_placement on seeded random mid-game boards of each grid
+size, once with full evaluations of every placement and once with incremental
+evaluation, and prints the time per move and per placement considered.
+
+Usage:
+    python benchmark.py [--sizes 10x20,20x40,40x80] [--boards N] [--seed N]
+"""
+
+import sys
+import argparse
+from time import perf_counter
+from random import Random
+from ai import TetrisAI
+from features import FeatureSet, default_features
+import tetromino
+
+def random_board(rng, grid_width, grid_height):
+    """Returns a boolean grid with a jagged stack up to half the grid height,
+    with holes, as seen in the middle of a game."""
+
+    grid = [[False] * grid_height for x in range(grid_width)]
+    for x in range(grid_width):
+        height = rng.randint(0, grid_height // 2)
+        for y in range(grid_height - height, grid_height):
+            grid[x][y] = rng.random() < 0.8
+        if height:
+            grid[x][grid_height - height] = True
+    return grid
+
+def time_search(ai, boards, incremental):
+    """Returns the seconds taken and placements considered searching every
+    tetromino on every board."""
+
+    ai.incremental = incremental
+    if incremental:
+        ai.prepare, ai.evaluate_delta = ai.feature_set.bind_incremental(ai.weights)
+    placements = 0
+    start_time = perf_counter()
+    for grid in boards:
+        for id in range(1, ai.shapes.unique_types + 1):
+            ai.best_placement(grid, id)
+    seconds = perf_counter() - start_time
+    for grid in boards:
+        for id in range(1, ai.shapes.unique_types + 1):
+            placements += len(ai.compute_drops(grid, ai.compute_heightmap(grid), id))
+    return seconds, placements
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Move search benchmarks across grid sizes.')
+    parser.add_argument('--sizes', default='10x20,20x40,40x80', help='comma separated WIDTHxHEIGHT grid sizes')
+    parser.add_argument('--boards', type=int, default=20, help='random boards per grid size')
+    parser.add_argument('--features', default=','.join(default_features))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print(f'{"grid":>8} {"search":>12} {"ms/move":>10} {"us/placement":>13} {"placements/move":>16}')
+    for size in args.sizes.split(','):
+        grid_width, grid_height = [int(value) for value in size.split('x')]
+        shapes = tetromino.load('data/shapes.txt', grid_width, grid_height)
+        feature_set = FeatureSet.get(args.features.split(','), grid_width, grid_height)
+        rng = Random(args.seed)
+        ai = TetrisAI(shapes, [rng.random() for i in range(feature_set.num_weights)], feature_set)
+        boards = [random_board(rng, grid_width, grid_height) for i in range(args.boards)]
+        modes = [('full', False)]
+        if feature_set.incremental:
+            modes.append(('incremental', True))
+        for name, incremental in modes:
+            seconds, placements = time_search(ai, boards, incremental)
+            moves = len(boards) * shapes.unique_types
+            print(f'{size:>8} {name:>12} {seconds / moves * 1e3:>10.3f} '
+                f'{seconds / placements * 1e6:>13.2f} {placements / moves:>16.1f}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,201 @@
+"""Compact game state for very large populations.
+
+A Tetris instance keeps its grid as lists of ints, a Mersenne Twister of a few
+kilobytes, a generator for its tetromino sequence and a Tetromino object. A
+CompactGame keeps the same game in a handful of slots: the board is a single
+int with one bit per cell, the random number generator is one 64 bit int and
+the bag of remaining tetrominos is a bitmask. Everything only needed for
+drawing is created when the game is first rendered, and can be dropped again
+once it is no longer watched.
+
+CompactGame can stand in for Tetris wherever a game is driven by update and
+next_move, as Tetro does. It uses its own random number generator, so a seed
+gives a different sequence of tetrominos than the same seed in Tetris.
+"""
+
+import os
+from tetris import Tetris, lock_tetromino
+from tetromino import Tetromino
+
+mask64 = (1 << 64) - 1
+
+class CompactGame:
+    """A game of Tetris with a bit packed board.
+
+    Cell (x, y) is bit y * grid_width + x of board, so each row is grid_width
+    consecutive bits and clearing a line is a pair of shifts.
+    """
+
+    __slots__ = ('shapes', 'board', 'rng_state', 'bag', 'uniform', 'seed',
+        'current_id', 'current_rotation', 'current_x', 'current_y', 'next_id', 'move',
+        'lines_cleared', 'pieces_placed', 'lost', 'view', 'cell_width')
+
+    def __init__(self, shapes, cell_width, seed=None, distribution='bag'):
+        if distribution not in ('bag', 'uniform'):
+            raise ValueError('Compact games support the bag and uniform distributions only')
+        self.shapes = shapes
+        self.cell_width = cell_width
+        self.board = 0
+        self.seed = seed if seed is not None else int.from_bytes(os.urandom(4), 'big')
+        self.rng_state = self.seed
+        self.bag = 0
+        self.uniform = distribution == 'uniform'
+        self.lines_cleared = 0
+        self.pieces_placed = 0
+        self.lost = False
+        self.move = None
+        # Tetris instance used for rendering, only while the game is watched
+        self.view = None
+        self.next_id = self.draw()
+        self.spawn_tetromino()
+
+    # returns a random int in [0, n) using splitmix64
+    def random_below(self, n):
+        self.rng_state = (self.rng_state + 0x9E3779B97F4A7C15) & mask64
+        z = self.rng_state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & mask64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & mask64
+        return (z ^ (z >> 31)) % n
+
+    # draws the id of the next tetromino
+    def draw(self):
+        unique_types = self.shapes.unique_types
+        if self.uniform:
+            return 1 + self.random_below(unique_types)
+        # every type of tetromino once per bag, bit i is set while id i is left
+        if self.bag == 0:
+            self.bag = ((1 << unique_types) - 1) << 1
+        idx = self.random_below(bin(self.bag).count('1'))
+        for id in range(1, unique_types + 1):
+            if self.bag >> id & 1:
+                if idx == 0:
+                    self.bag &= ~(1 << id)
+                    return id
+                idx -= 1
+
+    def fits(self, id, rotation, x_pos, y_pos):
+        """Returns whether a tetromino is in bounds and clear of the stack."""
+
+        grid_width = self.shapes.grid_width
+        grid_height = self.shapes.grid_height
+        for cell_x, cell_y in self.shapes.get_tetromino_type(id, rotation).cells:
+            x = x_pos + cell_x
+            y = y_pos + cell_y
+            if x < 0 or y < 0 or x >= grid_width or y >= grid_height or self.board >> (y * grid_width + x) & 1:
+                return False
+        return True
+
+    def spawn_tetromino(self):
+        tmino_type = self.shapes.get_tetromino_type(self.next_id, 0)
+        self.current_id = self.next_id
+        self.current_rotation = 0
+        self.current_x = (tmino_type.max_x - tmino_type.min_x) // 2
+        self.current_y = tmino_type.min_y
+        self.next_id = self.draw()
+
+    # moves the current tetromino to the next move and places it, like Tetris.update
+    def update(self):
+        if self.lost:
+            return
+        if self.move is not None:
+            self.current_id, self.current_rotation, self.current_x, self.current_y = self.move
+        self.current_y += 1
+        if not self.fits(self.current_id, self.current_rotation, self.current_x, self.current_y):
+            self.current_y -= 1
+            self.place_tetromino()
+
+    def place_tetromino(self):
+        grid_width = self.shapes.grid_width
+        grid_height = self.shapes.grid_height
+        tmino_type = self.shapes.get_tetromino_type(self.current_id, self.current_rotation)
+        rows = set()
+        for cell_x, cell_y in tmino_type.cells:
+            x = self.current_x + cell_x
+            y = self.current_y + cell_y
+            if 0 <= x < grid_width and 0 <= y < grid_height:
+                self.board |= 1 << (y * grid_width + x)
+                rows.add(y)
+        # clear full rows from the top down, the rows below a cleared row keep their index
+        full_row = (1 << grid_width) - 1
+        for y in sorted(rows):
+            if self.board >> (y * grid_width) & full_row == full_row:
+                above = self.board & ((1 << (y * grid_width)) - 1)
+                below = self.board >> ((y + 1) * grid_width) << ((y + 1) * grid_width)
+                self.board = (above << grid_width) | below
+                self.lines_cleared += 1
+        if self.view is not None:
+            lock_tetromino(self.view.grid, self.current_tmino)
+        self.pieces_placed += 1
+
+        self.spawn_tetromino()
+        if not self.fits(self.current_id, self.current_rotation, self.current_x, self.current_y):
+            self.lost = True
+
+    # the current tetromino, created on demand
+    @property
+    def current_tmino(self):
+        if self.lost:
+            return None
+        return Tetromino(self.shapes, self.current_id, self.current_rotation, self.current_x, self.current_y)
+
+    @property
+    def next_tmino(self):
+        return Tetromino(self.shapes, self.next_id)
+
+    # the next move is only kept as (id, rotation, x, y)
+    @property
+    def next_move(self):
+        if self.move is None:
+            return None
+        return Tetromino(self.shapes, *self.move)
+
+    @next_move.setter
+    def next_move(self, tmino):
+        self.move = None if tmino is None else (tmino.id, tmino.rotation, tmino.x_pos, tmino.y_pos)
+
+    # the board as a grid indexed by grid[x][y], 1 for filled cells
+    @property
+    def grid(self):
+        grid_width = self.shapes.grid_width
+        board = self.board
+        return [[board >> (y * grid_width + x) & 1 for y in range(self.shapes.grid_height)]
+            for x in range(grid_width)]
+
+    # compact games have no hold slot and only preview the next tetromino
+    @property
+    def preview(self):
+        return [self.next_id]
+
+    @property
+    def hold_enabled(self):
+        return False
+
+    @property
+    def hold_id(self):
+        return None
+
+    @property
+    def can_hold(self):
+        return False
+
+    @property
+    def grid_width(self):
+        return self.shapes.grid_width
+
+    @property
+    def grid_height(self):
+        return self.shapes.grid_height
+
+    def render(self, surface, next_move_outline):
+        if self.view is None:
+            # the colors of cells placed before the game was watched are not
+            # known, they are drawn as filled cells of unknown type
+            self.view = Tetris(self.shapes, self.cell_width, self.seed)
+            self.view.grid = [[-col for col in column] for column in self.grid]
+        self.view.lines_cleared = self.lines_cleared
+        self.view.pieces_placed = self.pieces_placed
+        self.view.lost = self.lost
+        self.view.current_tmino = self.current_tmino
+        self.view.next_id = self.next_id
+        self.view.next_move = self.next_move
+        self.view.render(surface, next_move_outline)
@@ -0,0 +1,353 @@
+"""Coordinator/worker mode for evaluating a population across machines.
+
+The coordinator owns the genetic algorithm state and hands out evaluation jobs
+to any number of workers. A job is a set of weights, the seed of the game to
+play, a budget of how many tetrominos may be placed and the options of the
+game, such as hold and the search budget. Workers play the game headless and
+send back the number of lines cleared. Jobs are scheduled
+longest predicted first with work stealing, see scheduler.py: every connection
+draws from its own queue and steals from the others once it is empty. If a
+worker disconnects while it is playing a game, or answers with anything but
+the result of its job, its job is put back in front of its queue, where
+another worker steals it, and the connection is dropped. If no worker is left
+while jobs are outstanding, the coordinator gives up after worker_timeout
+seconds.
+
+Messages are JSON objects prefixed by their length as a 4 byte big endian
+integer, sent over TCP or a Unix socket.
+
+Usage:
+    python distributed.py coordinator [--host HOST] [--port PORT] [--unix PATH] [--worker-timeout SECONDS]
+    python distributed.py worker [--host HOST] [--port PORT] [--unix PATH] [--processes N]
+"""
+
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+import multiprocessing
+from random import Random
+from ai import TetrisAI
+from features import FeatureSet, default_features
+import tetromino
+import properties
+import evolution
+import evaluation
+import stats
+import surrogate
+import scheduler
+
+# header that precedes every message, holds the length of the message body
+header = struct.Struct('>I')
+
+# keys of a result message and the types of their values
+result_fields = {
+    'job_id': int,
+    'lines_cleared': int,
+    'pieces_placed': int,
+    'seconds': (int, float),
+}
+
+def send_message(sock, message):
+    """Sends a JSON serializable object over a socket."""
+
+    body = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    sock.sendall(header.pack(len(body)) + body)
+
+def recv_message(sock):
+    """Receives a single message from a socket.
+
+    Raises:
+        ConnectionError: The connection was closed before a full message was
+            received.
+    """
+
+    length, = header.unpack(recv_exactly(sock, header.size))
+    return json.loads(recv_exactly(sock, length).decode('utf-8'))
+
+def recv_exactly(sock, num_bytes):
+    data = bytearray()
+    while len(data) < num_bytes:
+        chunk = sock.recv(num_bytes - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return bytes(data)
+
+def check_result(result, job):
+    """Checks that a message received from a worker is the result of its job.
+
+    Raises:
+        ValueError: The message is not a well formed result of the job.
+    """
+
+    if not isinstance(result, dict) or result.get('type') != 'result':
+        raise ValueError('expected a result message')
+    for key, types in result_fields.items():
+        if isinstance(result.get(key), bool) or not isinstance(result.get(key), types):
+            raise ValueError(f'result without a valid {key}')
+    if result['job_id'] != job['job_id']:
+        raise ValueError(f'result of job {result["job_id"]} instead of job {job["job_id"]}')
+
+def create_socket(host, port, unix_path):
+    if unix_path is not None:
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM), unix_path
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # detect workers whose machine went away without closing the connection
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    return sock, (host, port)
+
+class Coordinator:
+    """Owns the population and distributes evaluation jobs to workers."""
+
+    def __init__(self, props, host='127.0.0.1', port=5130, unix_path=None,
+        max_pieces=None, seed=None, stats_prefix='data/stats', worker_timeout=60):
+        self.grid_width = props['grid_width']
+        self.grid_height = props['grid_height']
+        self.population_size = props['population_size']
+        self.selection_size = props['selection_size']
+        self.mutate_rate = props['mutate_rate']
+        self.piece_distribution = props.get('piece_distribution', 'bag')
+        # hold, preview and search, sent with every job so workers play the same game
+        self.game_options = evaluation.game_options(props)
+        self.max_pieces = max_pieces
+        # seconds to wait for a worker while jobs are outstanding and none is
+        # connected, None to wait forever
+        self.worker_timeout = worker_timeout
+        self.generation = 0
+        self.random = Random(seed)
+        self.stats_exporter = stats.StatsExporter(stats_prefix)
+        self.generation_start_time = 0
+
+        self.shapes = tetromino.load('data/shapes.txt', self.grid_width, self.grid_height)
+        feature_set = FeatureSet.get(props.get('features', default_features), self.grid_width, self.grid_height)
+        self.tetris_ais = [TetrisAI(self.shapes, feature_set=feature_set)
+            for i in range(self.population_size)]
+        # screens bred children before they are sent out, if enabled
+        self.screen = surrogate.create_screen(props, feature_set.num_weights)
+
+        # jobs waiting for a worker and results of the current generation, both
+        # guarded by results_cond
+        self.jobs = None
+        self.duration_model = scheduler.DurationModel()
+        # predicted seconds of each job, to requeue the job of a lost worker
+        self.predictions = {}
+        self.results = {}
+        self.results_cond = threading.Condition()
+        self.num_workers = 0
+        # connections so far, each connection draws from queue index % number of queues
+        self.num_connections = 0
+        # seconds each connection spent playing games in the current generation
+        self.busy_seconds = {}
+        self.running = True
+
+        self.server, self.address = create_socket(host, port, unix_path)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen()
+
+    def run(self, generations=None):
+        """Evolves the population, optionally stopping after some generations."""
+
+        threading.Thread(target=self.accept_workers, daemon=True).start()
+        print(f'Coordinator listening on {self.address}')
+        try:
+            while generations is None or self.generation < generations:
+                fitness_scores = self.evaluate_generation()
+                self.next_generation(fitness_scores)
+        finally:
+            self.running = False
+            self.server.close()
+
+    def accept_workers(self):
+        while self.running:
+            try:
+                conn, addr = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_worker, args=(conn, addr), daemon=True).start()
+
+    def serve_worker(self, conn, addr):
+        """Feeds jobs to a single worker connection until it disconnects."""
+
+        with self.results_cond:
+            self.num_workers += 1
+            connection = self.num_connections
+            self.num_connections += 1
+        print(f'Worker connected: {addr or "local"}')
+        job = None
+        try:
+            while self.running:
+                with self.results_cond:
+                    if self.jobs is not None:
+                        job = self.jobs.next_job(connection % len(self.jobs.queues))
+                    if job is None:
+                        self.results_cond.wait(timeout=1)
+                        continue
+                send_message(conn, job)
+                result = recv_message(conn)
+                check_result(result, job)
+                with self.results_cond:
+                    self.results[result['job_id']] = result
+                    # the time measured by the worker leaves out the network
+                    self.busy_seconds[connection] = self.busy_seconds.get(connection, 0.0) + result['seconds']
+                    self.results_cond.notify_all()
+                job = None
+            send_message(conn, {'type': 'stop'})
+        except (OSError, ConnectionError, ValueError) as e:
+            # the worker is gone or can not be trusted; give its job to someone else
+            if job is not None:
+                print(f'Lost worker {addr or "local"} ({e}), requeueing job {job["job_id"]}')
+                with self.results_cond:
+                    self.jobs.requeue(connection % len(self.jobs.queues), self.predictions[job['job_id']], job)
+                    self.results_cond.notify_all()
+        finally:
+            conn.close()
+            with self.results_cond:
+                self.num_workers -= 1
+
+    def evaluate_generation(self):
+        """Queues a job for every AI and waits for all of their results.
+
+        Returns:
+            A list of (lines cleared, AI index) tuples sorted from highest to
+            lowest score.
+
+        Raises:
+            RuntimeError: No worker was connected for worker_timeout seconds
+                while jobs were outstanding.
+        """
+
+        self.generation_start_time = time.perf_counter()
+        jobs = []
+        for i, ai in enumerate(self.tetris_ais):
+            jobs.append((self.duration_model.predict(ai.expected_fitness), {
+                'type': 'job',
+                'job_id': i,
+                'generation': self.generation,
+                'grid_width': self.grid_width,
+                'grid_height': self.grid_height,
+                'weights': ai.to_dict(),
+                'seed': self.random.getrandbits(32),
+                'max_pieces': self.max_pieces,
+                'distribution': self.piece_distribution,
+                'game_options': self.game_options,
+            }))
+        with self.results_cond:
+            self.results.clear()
+            self.busy_seconds = {}
+            self.predictions = {job['job_id']: predicted for predicted, job in jobs}
+            # one queue per connected worker, workers that connect later steal
+            self.jobs = scheduler.WorkStealingScheduler(max(self.num_workers, 1), self.duration_model.fitted())
+            self.jobs.assign(jobs)
+            self.results_cond.notify_all()
+            # when the last worker went away, None while any is connected
+            idle_since = None
+            while len(self.results) < len(self.tetris_ais):
+                if self.num_workers > 0:
+                    idle_since = None
+                elif idle_since is None:
+                    idle_since = time.perf_counter()
+                elif self.worker_timeout is not None and time.perf_counter() - idle_since > self.worker_timeout:
+                    raise RuntimeError(f'No workers for {self.worker_timeout} seconds, '
+                        f'{len(self.tetris_ais) - len(self.results)} jobs outstanding')
+                self.results_cond.wait(timeout=1)
+            fitness_scores = [(self.results[i]['lines_cleared'], i) for i in range(len(self.tetris_ais))]
+        list.sort(fitness_scores, key=lambda elem: elem[0])
+        fitness_scores.reverse()
+        return fitness_scores
+
+    def next_generation(self, fitness_scores):
+        generation_stats = stats.GenerationStats(self.generation, self.tetris_ais[0].feature_set.num_weights)
+        for i, ai in enumerate(self.tetris_ais):
+            generation_stats.add(self.results[i]['lines_cleared'], ai.weights, self.results[i]['pieces_placed'])
+            self.duration_model.record(self.results[i]['lines_cleared'], self.results[i]['seconds'])
+            # survivors were recorded in the generation they were bred
+            if self.screen is not None and not ai.survivor:
+                self.screen.record(ai.weights, self.results[i]['lines_cleared'])
+        summary = generation_stats.summary(time.perf_counter() - self.generation_start_time)
+        self.stats_exporter.write(summary)
+        print(f'\n----- Generation {self.generation} ({self.num_workers} workers) -----')
+        print(stats.format_summary(summary))
+        with self.results_cond:
+            utilization = [self.busy_seconds[connection] / summary['seconds'] for connection in sorted(self.busy_seconds)]
+        print('Worker utilization: ' + ' '.join([f'{busy:.0%}' for busy in utilization]) +
+            f' | {self.jobs.num_stolen} jobs stolen')
+        print('Most cleared weights: ', self.tetris_ais[fitness_scores[0][1]].to_dict())
+        self.tetris_ais = evolution.breed(self.tetris_ais, fitness_scores,
+            self.population_size, self.selection_size, self.mutate_rate, self.screen)
+        if self.screen is not None and self.screen.num_screened:
+            print(f'Surrogate screening rejected {self.screen.num_rejected}/{self.screen.num_screened} candidate children so far')
+        self.generation += 1
+
+def run_worker(host='127.0.0.1', port=5130, unix_path=None, connect_timeout=30):
+    """Connects to a coordinator and plays games until told to stop."""
+
+    sock, address = create_socket(host, port, unix_path)
+    # the coordinator may still be starting up
+    deadline = time.time() + connect_timeout
+    while True:
+        try:
+            sock.connect(address)
+            break
+        except OSError:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.5)
+
+    # shape sets by grid size, so a worker can serve jobs of any grid size
+    shape_sets = {}
+    with sock:
+        while True:
+            try:
+                job = recv_message(sock)
+            except ConnectionError:
+                return
+            if job['type'] == 'stop':
+                return
+            grid_size = (job['grid_width'], job['grid_height'])
+            if grid_size not in shape_sets:
+                shape_sets[grid_size] = tetromino.load('data/shapes.txt', *grid_size)
+            ai = TetrisAI.from_dict(shape_sets[grid_size], job['weights'])
+            start_time = time.perf_counter()
+            inst = evaluation.play_game(ai, job['seed'], job['max_pieces'],
+                distribution=job['distribution'], **evaluation.game_arguments(job['game_options']))
+            send_message(sock, {
+                'type': 'result',
+                'job_id': job['job_id'],
+                'lines_cleared': inst.lines_cleared,
+                'pieces_placed': inst.pieces_placed,
+                'seconds': time.perf_counter() - start_time,
+            })
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Distributed evaluation for Tetro.')
+    parser.add_argument('mode', choices=['coordinator', 'worker'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5130)
+    parser.add_argument('--unix', dest='unix_path', default=None, help='use a Unix socket at this path')
+    parser.add_argument('--processes', type=int, default=1, help='number of worker processes to start')
+    parser.add_argument('--generations', type=int, default=None)
+    parser.add_argument('--max-pieces', type=int, default=None, help='piece budget of each game')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--stats', default='data/stats', help='prefix of the statistics files written by the coordinator')
+    parser.add_argument('--worker-timeout', type=float, default=60,
+        help='seconds the coordinator waits without any worker before giving up, 0 to wait forever')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'coordinator':
+        coordinator = Coordinator(properties.load('data/properties.txt'),
+            args.host, args.port, args.unix_path, args.max_pieces, args.seed, args.stats,
+            args.worker_timeout or None)
+        coordinator.run(args.generations)
+    else:
+        workers = [multiprocessing.Process(target=run_worker, args=(args.host, args.port, args.unix_path))
+            for i in range(args.processes)]
+        [worker.start() for worker in workers]
+        [worker.join() for worker in workers]
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+from tetris import Tetris
+from recorder import GameRecorder
+from search import BoundedSearch
+
+# properties that change how the AIs play a game, and their defaults
+game_option_defaults = {
+    'hold': False,
+    'preview_size': 1,
+    'search_nodes': 0,
+    'search_ms': 0,
+    'search_beam_width': 8,
+}
+
+def game_options(props):
+    """Returns the properties that change how the AIs play a game.
+
+    Every trainer passes them to play_game through game_arguments, so the AIs
+    are evolved for the same game whichever trainer runs them. The values are
+    plain, so they can be sent to worker processes and other machines.
+    """
+
+    return {key: props.get(key, default) for key, default in game_option_defaults.items()}
+
+def game_arguments(options):
+    """Returns the hold, preview_size and search arguments of play_game for
+    the options given by game_options."""
+
+    search = None
+    if options['search_nodes'] > 0 or options['search_ms'] > 0:
+        search = BoundedSearch(options['search_nodes'] or None,
+            options['search_ms'] / 1000 if options['search_ms'] > 0 else None, options['search_beam_width'])
+    return {'hold': options['hold'], 'preview_size': options['preview_size'], 'search': search}
+
+def play_game(ai, seed=None, max_pieces=None, record_path=None, distribution='bag', start_grid=None,
+    hold=False, preview_size=1, search=None):
+    """Plays a headless game of Tetris with the given AI until it loses.
+
+    The game is driven exactly like Tetro drives its spectated games, just
+    without any delay or rendering in between moves.
+
+    Args:
+        ai: TetrisAI object that controls the game. The game is played with
+            the ShapeSet of the AI.
+        seed: Seed for the tetromino sequence, None for a random game.
+        max_pieces: Stop the game after this many tetrominos have been placed,
+            None to play until the game is lost.
+        record_path: If given, the game is recorded to this file, which
+            needs hold off and a preview_size of 1.
+        distribution: Name of the tetromino distribution, see sequence.py.
+        start_grid: Grid the game starts from, see positions.py. None for an
+            empty grid.
+        hold: Whether the game has a hold slot.
+        preview_size: Number of upcoming tetrominos shown.
+        search: BoundedSearch used to choose moves, see search.py. None to
+            only place the current tetromino.
+
+    Returns:
+        The finished Tetris instance.
+    """
+
+    inst = Tetris(ai.shapes, 0, seed, distribution, start_grid, hold, preview_size)
+    if record_path is not None:
+        inst.recorder = GameRecorder(record_path, inst)
+    while not inst.lost:
+        if max_pieces is not None and inst.pieces_placed >= max_pieces:
+            break
+        inst.update()
+        if inst.lost:
+            break
+        inst.next_move = ai.compute_move(inst, search)
+    if inst.recorder is not None:
+        inst.recorder.close()
+    return inst
@@ -0,0 +1,110 @@
+from random import randint
+from ai import TetrisAI
+
+def breed(ais, fitness_scores, population_size, selection_size, mutate_rate, screen=None):
+    """Produces the next generation of AIs from the current one.
+
+    The fitter half of the population continues on as is, and the rest of the
+    population is filled with mutated crossovers of the most fit AIs. If the
+    most fit AIs all performed terribly, a completely random population is
+    generated instead.
+
+    Args:
+        ais: List of TetrisAI objects in the current generation.
+        fitness_scores: List of (score, index into ais) tuples sorted from
+            highest to lowest score.
+        population_size: Number of AIs in the next generation.
+        selection_size: Number of most fit AIs to use as parents.
+        mutate_rate: Mutation chance, expressed as a decimal.
+        screen: Optional SurrogateScreen, if given more children than needed
+            are bred and only the most promising ones are kept.
+
+    Returns:
+        A list of TetrisAI objects for the next generation.
+    """
+
+    shapes = ais[0].shapes
+    feature_set = ais[0].feature_set
+    highest_scores = fitness_scores[:selection_size]
+    avg_most = sum([elem[0] for elem in highest_scores]) / len(highest_scores)
+
+    new_ais = []
+    # create completely new AIs if the average was too low
+    if avg_most <= 0.1:
+        [new_ais.append(TetrisAI(shapes, feature_set=feature_set)) for i in range(population_size)]
+    else:
+        # produce new generation
+        # let the upper half of the most fit of this generation continue on as is
+        for i in range(population_size // 2):
+            new_ais.append(ais[fitness_scores[i][1]].clone())
+            new_ais[-1].expected_fitness = fitness_scores[i][0]
+            new_ais[-1].survivor = True
+        # then crossover until the population size is reached
+        num_survivors = len(new_ais)
+        num_children = population_size - num_survivors
+        if screen is not None:
+            num_children = screen.num_candidates(num_children)
+        while len(new_ais) != num_survivors + num_children:
+            # randomly select two different parents
+            idx1 = randint(0, len(highest_scores) - 1)
+            idx2 = idx1
+            while idx2 == idx1:
+                idx2 = randint(0, len(highest_scores) - 1)
+            new_ais.append(ais[highest_scores[idx1][1]].crossover(
+                ais[highest_scores[idx2][1]]))
+            new_ais[-1].mutate(mutate_rate)
+            new_ais[-1].expected_fitness = (highest_scores[idx1][0] + highest_scores[idx2][0]) / 2
+        if screen is not None:
+            new_ais[num_survivors:] = screen.select(new_ais[num_survivors:], population_size - num_survivors)
+    return new_ais
+
+class Archive:
+    """The fittest AIs seen so far, for steady-state evolution.
+
+    Instead of breeding whole generations, each AI is added to the archive as
+    soon as its game is over, pushing out the least fit member once the archive
+    is full, and a single child bred from the archive takes its place.
+    """
+
+    def __init__(self, capacity, shapes, feature_set):
+        self.capacity = capacity
+        self.shapes = shapes
+        self.feature_set = feature_set
+        # (score, TetrisAI) tuples sorted from highest to lowest score
+        self.members = []
+
+    def add(self, ai, score):
+        """Adds an evaluated AI, returns whether it made it into the archive."""
+
+        # insert after members of equal score, so older members rank first
+        idx = len(self.members)
+        while idx > 0 and self.members[idx - 1][0] < score:
+            idx -= 1
+        self.members.insert(idx, (score, ai))
+        if len(self.members) > self.capacity:
+            self.members.pop()
+        return idx < self.capacity
+
+    def best(self):
+        """Returns the (score, TetrisAI) tuple of the fittest member."""
+
+        return self.members[0]
+
+    def breed(self, selection_size, mutate_rate):
+        """Returns a new child of two different members among the most fit.
+
+        Like breed, a random AI is returned instead if the most fit members all
+        performed terribly, or if there are not enough members yet.
+        """
+
+        highest_scores = self.members[:selection_size]
+        if len(highest_scores) < 2 or sum([elem[0] for elem in highest_scores]) / len(highest_scores) <= 0.1:
+            return TetrisAI(self.shapes, feature_set=self.feature_set)
+        idx1 = randint(0, len(highest_scores) - 1)
+        idx2 = idx1
+        while idx2 == idx1:
+            idx2 = randint(0, len(highest_scores) - 1)
+        child = highest_scores[idx1][1].crossover(highest_scores[idx2][1])
+        child.mutate(mutate_rate)
+        child.expected_fitness = (highest_scores[idx1][0] + highest_scores[idx2][0]) / 2
+        return child
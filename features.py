@@ -0,0 +1,510 @@
+"""Declarative registry of the heuristics used to score a grid.
+
+Each Feature describes its contribution to the score as small snippets of
+Python code that are run at fixed points of a single pass over the grid. A
+FeatureSet stitches the snippets of the chosen features together and compiles
+them into one evaluation function, so adding features adds work to the one
+pass instead of adding another scan of the grid.
+
+The pass visits the columns from left to right and each column from top to
+bottom. The following names are available to the snippets:
+
+    grid, placement   arguments of the evaluation function, placement is a
+                      (TetrominoType, x position, y position) tuple or None
+    w                 the flat list of weights, a feature's own weights start
+                      at index {o}
+    W, H              grid width and height
+    x, y, col         the current column index, row index and column
+    height            height of the current column, non zero once its top
+                      most filled cell has been passed
+    prev_col          the previous column, a full wall for the first column
+    row_counts        filled cells in each row, if the feature asks for it
+    heights           heights of the columns visited so far, if the feature
+                      asks for it
+    score             the score being computed
+
+Snippets are formatted with {o} for the offset of the feature's weights and
+{cap} for its cap. Contributions to score are only made in the final snippets,
+which run in the order the features are listed in, so the sum is always
+computed in the same order.
+
+Features may also give a delta snippet, which adds the change in the feature's
+contribution caused by dropping a tetromino onto a grid whose full score is
+already known. Every new cell must lie above the top of its column, which is
+always the case for vertical drops. The delta snippets only look at the
+columns and rows the tetromino touches, so their cost does not grow with the
+size of the grid. The following names are available to them:
+
+    grid, placement   the grid before the drop and the (TetrominoType,
+                      x position, y position) tuple of the drop
+    w, W, H, score    as above
+    heights           heights of all columns before the drop
+    row_counts        filled cells in each row before the drop
+    holes             empty cells below the top of each column before the drop
+    added_columns     grid rows of the new cells in each touched column, top
+                      to bottom, by column
+    added_rows        grid columns of the new cells in each touched row, left
+                      to right, by row
+    added_heights     heights of the touched columns after the drop
+    first_x, last_x   left and right most touched column
+
+Scores computed from deltas may differ from full evaluations by floating point
+rounding, since the terms are added in a different order.
+"""
+
+# registry of all features by name
+features = {}
+
+# the features used by TetrisAI unless specified otherwise
+default_features = ('row_filled', 'hole_height:5', 'column_diff:5')
+
+class Feature:
+    """A heuristic that contributes to the score of a grid."""
+
+    def __init__(self, name, num_weights, channels=(), init='', column_init='',
+        filled='', empty='', column_end='', final='', delta=None, default_cap=None):
+        """Describes a feature, see the module docstring for the snippets.
+
+        Args:
+            name: Name used to select the feature.
+            num_weights: Function of (grid width, grid height, cap) giving the
+                number of weights the feature uses.
+            channels: Shared intermediate values the feature reads, any of
+                'row_counts' and 'heights'.
+            init: Code run once before the pass.
+            column_init: Code run before each column.
+            filled: Code run for each filled cell.
+            empty: Code run for each empty cell.
+            column_end: Code run after each column.
+            final: Code run after the pass, adds the feature to score.
+            delta: Code adding the change caused by a drop to score, None if
+                the feature can only be evaluated with a full pass.
+            default_cap: Cap used when none is given.
+        """
+
+        self.name = name
+        self.num_weights = num_weights
+        self.channels = channels
+        self.init = init
+        self.column_init = column_init
+        self.filled = filled
+        self.empty = empty
+        self.column_end = column_end
+        self.final = final
+        self.delta = delta
+        self.default_cap = default_cap
+
+def register_feature(feature):
+    features[feature.name] = feature
+
+# how filled each row is, one weight per possible number of filled cells
+register_feature(Feature('row_filled',
+    lambda grid_width, grid_height, cap: grid_width + 1,
+    channels=('row_counts',),
+    final='''
+for count in row_counts:
+    score += w[{o} + count]
+''',
+    delta='''
+for y, xs in added_rows.items():
+    score += w[{o} + row_counts[y] + len(xs)] - w[{o} + row_counts[y]]
+'''))
+
+# heights of runs of empty cells under the top of each column
+# a run that reaches the floor uses the weight after its own
+register_feature(Feature('hole_height',
+    lambda grid_width, grid_height, cap: cap,
+    init='hole_terms = []',
+    column_init='hole_run = 0',
+    filled='''
+if hole_run:
+    hole_terms.append(w[{o} + min(hole_run, {cap}) - 1])
+    hole_run = 0
+''',
+    empty='''
+if height:
+    hole_run += 1
+''',
+    column_end='''
+if hole_run:
+    hole_terms.append(w[{o} + min(hole_run, {cap} - 1)])
+''',
+    final='''
+for term in hole_terms:
+    score -= term
+''',
+    delta='''
+for x, ys in added_columns.items():
+    for i in range(1, len(ys)):
+        if ys[i] - ys[i - 1] > 1:
+            score -= w[{o} + min(ys[i] - ys[i - 1] - 1, {cap}) - 1]
+    gap = H - heights[x] - ys[-1] - 1
+    if gap:
+        if heights[x]:
+            score -= w[{o} + min(gap, {cap}) - 1]
+        else:
+            score -= w[{o} + min(gap, {cap} - 1)]
+''',
+    default_cap=5))
+
+# differences in height between neighbouring columns
+register_feature(Feature('column_diff',
+    lambda grid_width, grid_height, cap: cap,
+    channels=('heights',),
+    final='''
+for i in range(1, W):
+    score -= w[{o} + min(abs(heights[i] - heights[i - 1]), {cap} - 1)]
+''',
+    delta='''
+for i in range(max(first_x, 1), min(last_x + 2, W)):
+    diff = added_heights.get(i, heights[i]) - added_heights.get(i - 1, heights[i - 1])
+    score -= (w[{o} + min(abs(diff), {cap} - 1)]
+        - w[{o} + min(abs(heights[i] - heights[i - 1]), {cap} - 1)])
+''',
+    default_cap=5))
+
+# height of the center of the last placed tetromino
+landing_height = '''
+if placement is not None:
+    tmino_type, pos_x, pos_y = placement
+    piece_rows = [row for row in range(tmino_type.size) if tmino_type.row_masks[row]]
+    score -= w[{o}] * (H - pos_y - (piece_rows[0] + piece_rows[-1]) / 2)
+'''
+register_feature(Feature('landing_height',
+    lambda grid_width, grid_height, cap: 1,
+    final=landing_height,
+    delta=landing_height))
+
+# lines completed by the last placed tetromino times its cells in those lines
+register_feature(Feature('eroded_cells',
+    lambda grid_width, grid_height, cap: 1,
+    channels=('row_counts',),
+    final='''
+if placement is not None:
+    tmino_type, pos_x, pos_y = placement
+    eroded_lines, eroded_cells = 0, 0
+    for row, mask in enumerate(tmino_type.row_masks):
+        if mask and 0 <= pos_y + row < H and row_counts[pos_y + row] == W:
+            eroded_lines += 1
+            eroded_cells += bin(mask).count('1')
+    score += w[{o}] * eroded_lines * eroded_cells
+''',
+    delta='''
+eroded_lines, eroded_cells = 0, 0
+for y, xs in added_rows.items():
+    if row_counts[y] + len(xs) == W:
+        eroded_lines += 1
+        eroded_cells += len(xs)
+score += w[{o}] * eroded_lines * eroded_cells
+'''))
+
+# changes between filled and empty cells along each row, walls count as filled
+register_feature(Feature('row_transitions',
+    lambda grid_width, grid_height, cap: 1,
+    init='row_trans = 0',
+    filled='''
+if not prev_col[y]:
+    row_trans += 1
+''',
+    empty='''
+if prev_col[y]:
+    row_trans += 1
+''',
+    final='''
+for cell in grid[W - 1]:
+    if not cell:
+        row_trans += 1
+score -= w[{o}] * row_trans
+''',
+    delta='''
+row_trans = 0
+for y, xs in added_rows.items():
+    for x in xs:
+        for nx in (x - 1, x + 1):
+            if nx not in xs:
+                # the new cell removes a transition to a filled neighbour and adds one to an empty one
+                row_trans += -1 if nx < 0 or nx >= W or grid[nx][y] else 1
+score -= w[{o}] * row_trans
+'''))
+
+# changes between filled and empty cells down each column, the floor counts as filled
+register_feature(Feature('column_transitions',
+    lambda grid_width, grid_height, cap: 1,
+    init='col_trans = 0',
+    column_init='col_prev = False',
+    filled='''
+if not col_prev:
+    col_trans += 1
+    col_prev = True
+''',
+    empty='''
+if col_prev:
+    col_trans += 1
+    col_prev = False
+''',
+    column_end='''
+if not col_prev:
+    col_trans += 1
+''',
+    final='score -= w[{o}] * col_trans',
+    delta='''
+col_trans = 0
+for x, ys in added_columns.items():
+    col = grid[x]
+    for y in ys:
+        for ny in (y - 1, y + 1):
+            if ny not in ys:
+                col_trans += -1 if ny >= H or (ny >= 0 and col[ny]) else 1
+score -= w[{o}] * col_trans
+'''))
+
+# columns lower than both neighbours, a well of depth d counts 1 + 2 + ... + d
+register_feature(Feature('wells',
+    lambda grid_width, grid_height, cap: 1,
+    channels=('heights',),
+    final='''
+wells = 0
+for i in range(W):
+    depth = min(heights[i - 1] if i > 0 else H, heights[i + 1] if i < W - 1 else H) - heights[i]
+    if depth > 0:
+        wells += depth * (depth + 1) // 2
+score -= w[{o}] * wells
+''',
+    delta='''
+wells = 0
+for i in range(max(first_x - 1, 0), min(last_x + 2, W)):
+    depth = min(heights[i - 1] if i > 0 else H, heights[i + 1] if i < W - 1 else H) - heights[i]
+    if depth > 0:
+        wells -= depth * (depth + 1) // 2
+    depth = (min(added_heights.get(i - 1, heights[i - 1]) if i > 0 else H,
+        added_heights.get(i + 1, heights[i + 1]) if i < W - 1 else H)
+        - added_heights.get(i, heights[i]))
+    if depth > 0:
+        wells += depth * (depth + 1) // 2
+score -= w[{o}] * wells
+'''))
+
+# filled cells above each hole in the same column
+register_feature(Feature('hole_depth',
+    lambda grid_width, grid_height, cap: 1,
+    init='hole_depth = 0',
+    column_init='filled_above = 0',
+    filled='filled_above += 1',
+    empty='hole_depth += filled_above',
+    final='score -= w[{o}] * hole_depth',
+    delta='''
+hole_depth = 0
+for x, ys in added_columns.items():
+    # the new cells are above every existing hole of the column and above the
+    # new holes below them
+    hole_depth += len(ys) * (holes[x] + H - heights[x] - ys[-1] - 1)
+    for i in range(1, len(ys)):
+        hole_depth += i * (ys[i] - ys[i - 1] - 1)
+score -= w[{o}] * hole_depth
+'''))
+
+# compiled feature sets by (spec, grid width, grid height)
+compiled_sets = {}
+
+class FeatureSet:
+    """A chosen list of features compiled into a single evaluation pass.
+
+    The weights of all features are laid out one after another in a flat list,
+    in the order of the features. Use FeatureSet.get to share compiled sets.
+    """
+
+    def __init__(self, spec, grid_width, grid_height):
+        """Compiles a feature set.
+
+        Args:
+            spec: Sequence of feature names, each optionally followed by a cap
+                as in 'hole_height:5'.
+            grid_width: Number of columns in Tetris grid.
+            grid_height: Number of rows in Tetris grid.
+        """
+
+        self.spec = tuple(spec)
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+
+        # (feature, cap, offset, number of weights) of each feature in order
+        self.layout = []
+        offset = 0
+        for entry in self.spec:
+            name, _, cap = entry.partition(':')
+            if name not in features:
+                raise ValueError(f'Unknown feature: {name}')
+            feature = features[name]
+            cap = int(cap) if cap else feature.default_cap
+            num_weights = feature.num_weights(grid_width, grid_height, cap)
+            self.layout.append((feature, cap, offset, num_weights))
+            offset += num_weights
+        self.num_weights = offset
+        # whether drops can be scored from the touched region alone
+        self.incremental = all([feature.delta is not None for feature, cap, offset, num_weights in self.layout])
+
+        self.source = self.generate_source()
+        if self.incremental:
+            self.source += self.generate_delta_source()
+        namespace = {'W': grid_width, 'H': grid_height, 'wall': [True] * grid_height}
+        exec(compile(self.source, f'<features {",".join(self.spec)}>', 'exec'), namespace)
+        self.make_evaluator = namespace['make_evaluator']
+        self.make_incremental = namespace.get('make_incremental')
+
+    @staticmethod
+    def get(spec, grid_width, grid_height):
+        """Returns the compiled FeatureSet for a spec, compiling it only once."""
+
+        key = (tuple(spec), grid_width, grid_height)
+        if key not in compiled_sets:
+            compiled_sets[key] = FeatureSet(*key)
+        return compiled_sets[key]
+
+    def __reduce__(self):
+        # the compiled function can not be pickled, compile again instead
+        return (FeatureSet.get, (self.spec, self.grid_width, self.grid_height))
+
+    def bind(self, weights):
+        """Returns a function evaluate(grid, placement=None) scoring a boolean
+        grid with the given weights.
+
+        The weights list is read on every call, so changing it in place changes
+        the evaluation.
+        """
+
+        return self.make_evaluator(weights)
+
+    def bind_incremental(self, weights):
+        """Returns functions prepare(grid) and evaluate_delta(base, placement).
+
+        prepare does a full pass over a boolean grid and returns the base state
+        of it. evaluate_delta then scores the grid after dropping a tetromino
+        at a placement, given as a (TetrominoType, x position, y position)
+        tuple, without the tetromino being added to the grid and in time that
+        does not depend on the size of the grid. Only available if every
+        feature of the set is incremental.
+        """
+
+        return self.make_incremental(weights)
+
+    def split_weights(self, weights):
+        """Returns a list of (feature name, weights of that feature) tuples."""
+
+        return [(feature.name, weights[offset:offset + num_weights])
+            for feature, cap, offset, num_weights in self.layout]
+
+    def generate_source(self):
+        channels = set()
+        for feature, cap, offset, num_weights in self.layout:
+            channels.update(feature.channels)
+
+        def parts(attr, depth):
+            lines = []
+            for feature, cap, offset, num_weights in self.layout:
+                code = getattr(feature, attr).strip('\n')
+                if code:
+                    code = code.format(o=offset, cap=cap)
+                    lines.extend(['    ' * depth + line for line in code.split('\n')])
+            return lines
+
+        filled = parts('filled', 5)
+        empty = parts('empty', 5)
+        if 'row_counts' in channels:
+            filled.insert(0, '                    row_counts[y] += 1')
+        src = [
+            'def make_evaluator(w):',
+            '    def evaluate(grid, placement=None):',
+            '        score = 0',
+        ]
+        if 'row_counts' in channels:
+            src.append('        row_counts = [0] * H')
+        if 'heights' in channels:
+            src.append('        heights = []')
+        src += parts('init', 2)
+        src += [
+            '        prev_col = wall',
+            '        for x in range(W):',
+            '            col = grid[x]',
+            '            height = 0',
+        ]
+        src += parts('column_init', 3)
+        if len(filled) == 0 and len(empty) == 0:
+            # only the height of each column is needed, stop at the top cell
+            src += [
+                '            for y in range(H):',
+                '                if col[y]:',
+                '                    height = H - y',
+                '                    break',
+            ]
+        else:
+            src += [
+                '            for y in range(H):',
+                '                if col[y]:',
+                '                    if height == 0:',
+                '                        height = H - y',
+            ]
+            src += filled
+            if len(empty) > 0:
+                src.append('                else:')
+                src += empty
+        if 'heights' in channels:
+            src.append('            heights.append(height)')
+        src += parts('column_end', 3)
+        src.append('            prev_col = col')
+        src += parts('final', 2)
+        src += [
+            '        return score',
+            '    return evaluate',
+        ]
+        return '\n'.join(src) + '\n'
+
+    def generate_delta_source(self):
+        src = [
+            'def make_incremental(w):',
+            '    evaluate = make_evaluator(w)',
+            '    def prepare(grid):',
+            '        heights = []',
+            '        row_counts = [0] * H',
+            '        holes = []',
+            '        for x in range(W):',
+            '            col = grid[x]',
+            '            height = 0',
+            '            empty = 0',
+            '            for y in range(H):',
+            '                if col[y]:',
+            '                    row_counts[y] += 1',
+            '                    if height == 0:',
+            '                        height = H - y',
+            '                elif height:',
+            '                    empty += 1',
+            '            heights.append(height)',
+            '            holes.append(empty)',
+            '        return grid, evaluate(grid), heights, row_counts, holes',
+            '    def evaluate_delta(base, placement):',
+            '        grid, score, heights, row_counts, holes = base',
+            '        tmino_type, pos_x, pos_y = placement',
+            '        added_columns = {}',
+            '        added_rows = {}',
+            '        for cell_x, cell_y in tmino_type.cells:',
+            '            x = pos_x + cell_x',
+            '            y = pos_y + cell_y',
+            '            if x in added_columns:',
+            '                added_columns[x].append(y)',
+            '            else:',
+            '                added_columns[x] = [y]',
+            '            if y in added_rows:',
+            '                added_rows[y].append(x)',
+            '            else:',
+            '                added_rows[y] = [x]',
+            '        added_heights = {x: H - ys[0] for x, ys in added_columns.items()}',
+            '        first_x = min(added_columns)',
+            '        last_x = max(added_columns)',
+        ]
+        for feature, cap, offset, num_weights in self.layout:
+            code = feature.delta.strip('\n').format(o=offset, cap=cap)
+            src.extend(['        ' + line for line in code.split('\n')])
+        src += [
+            '        return score',
+            '    return prepare, evaluate_delta',
+        ]
+        return '\n'.join(src) + '\n'
@@ -0,0 +1,190 @@
+"""Island model: several populations evolving in parallel with migration.
+
+Each island is a separate process with its own population, evolved exactly
+like the population of Tetro. Every few generations an island sends copies of
+its best AIs to its neighbours, as given by the topology, and takes in any AIs
+that have arrived from its own neighbours in place of its newest children.
+Islands never wait for each other; migrants that have not arrived yet are
+simply taken in at a later migration.
+
+Usage:
+    python islands.py [--islands N] [--generations N] [--interval K] [--migrants M]
+        [--topology ring|full|random] [--max-pieces N] [--seed N] [--stats PREFIX] [--weights-out PATH]
+
+The weights of the best AI of the run are saved to data/best_weights-<run>.json
+by default, named after the run like the statistics files, so island runs
+never overwrite the weights saved by Tetro or by each other.
+"""
+
+import sys
+import json
+import time
+import queue
+import argparse
+import multiprocessing
+from random import Random
+from ai import TetrisAI
+from features import FeatureSet, default_features
+import tetromino
+import properties
+import evolution
+import evaluation
+import stats
+import surrogate
+
+def ring(index, num_islands, rng):
+    """Each island sends to the next one."""
+
+    return [(index + 1) % num_islands]
+
+def full(index, num_islands, rng):
+    """Each island sends to every other island."""
+
+    return [i for i in range(num_islands) if i != index]
+
+def random_neighbour(index, num_islands, rng):
+    """Each island sends to another island chosen anew at every migration."""
+
+    neighbour = rng.randint(0, num_islands - 2)
+    return [neighbour if neighbour < index else neighbour + 1]
+
+# topologies by the name used on the command line, each gives the islands an
+# island sends its migrants to
+topologies = {
+    'ring': ring,
+    'full': full,
+    'random': random_neighbour,
+}
+
+class Island:
+    """A population that evolves on its own and exchanges AIs with neighbours."""
+
+    def __init__(self, index, props, inboxes, reports, topology='ring', interval=5,
+        num_migrants=2, max_pieces=None, seed=None):
+        """
+        Args:
+            index: Index of this island.
+            props: Properties as loaded from data/properties.txt.
+            inboxes: Queue of incoming migrants of every island.
+            reports: Queue the summary of every generation is put on.
+            topology: Name of the topology in topologies.
+            interval: Number of generations between migrations.
+            num_migrants: Number of AIs sent to each neighbour.
+            max_pieces: Piece budget of each game, None for no limit.
+            seed: Seed of the games and migrations of this island.
+        """
+
+        self.index = index
+        self.inboxes = inboxes
+        self.reports = reports
+        self.topology = topologies[topology]
+        self.interval = interval
+        self.num_migrants = num_migrants
+        self.max_pieces = max_pieces
+        self.population_size = props['population_size']
+        self.selection_size = props['selection_size']
+        self.mutate_rate = props['mutate_rate']
+        self.piece_distribution = props.get('piece_distribution', 'bag')
+        # hold, preview and search, as in every other trainer
+        self.game_arguments = evaluation.game_arguments(evaluation.game_options(props))
+        self.random = Random(seed)
+        self.generation = 0
+
+        self.shapes = tetromino.load('data/shapes.txt', props['grid_width'], props['grid_height'])
+        self.feature_set = FeatureSet.get(props.get('features', default_features),
+            props['grid_width'], props['grid_height'])
+        self.tetris_ais = [TetrisAI(self.shapes, feature_set=self.feature_set)
+            for i in range(self.population_size)]
+        # each island screens its own children, if enabled
+        self.screen = surrogate.create_screen(props, self.feature_set.num_weights)
+
+    def run(self, generations=None):
+        while generations is None or self.generation < generations:
+            start_time = time.perf_counter()
+            generation_stats = stats.GenerationStats(self.generation, self.feature_set.num_weights)
+            fitness_scores = []
+            for i, ai in enumerate(self.tetris_ais):
+                inst = evaluation.play_game(ai, self.random.getrandbits(32), self.max_pieces,
+                    distribution=self.piece_distribution, **self.game_arguments)
+                fitness_scores.append((inst.lines_cleared, i))
+                generation_stats.add(inst.lines_cleared, ai.weights, inst.pieces_placed)
+                # survivors were recorded in the generation they were bred
+                if self.screen is not None and not ai.survivor:
+                    self.screen.record(ai.weights, inst.lines_cleared)
+            list.sort(fitness_scores, key=lambda elem: elem[0])
+            fitness_scores.reverse()
+            self.reports.put((self.index, generation_stats.summary(time.perf_counter() - start_time),
+                self.tetris_ais[fitness_scores[0][1]].to_dict()))
+            self.next_generation(fitness_scores)
+
+    def next_generation(self, fitness_scores):
+        new_ais = evolution.breed(self.tetris_ais, fitness_scores,
+            self.population_size, self.selection_size, self.mutate_rate, self.screen)
+        self.generation += 1
+        if self.generation % self.interval == 0:
+            # the fittest AIs are at the front of the fitness scores
+            migrants = [self.tetris_ais[idx].to_dict() for score, idx in fitness_scores[:self.num_migrants]]
+            for neighbour in self.topology(self.index, len(self.inboxes), self.random):
+                self.inboxes[neighbour].put(migrants)
+            # the children of the new generation are at its end, replace them
+            immigrants = []
+            while True:
+                try:
+                    immigrants += self.inboxes[self.index].get_nowait()
+                except queue.Empty:
+                    break
+            immigrants = immigrants[:self.population_size // 2]
+            for i, weights in enumerate(immigrants):
+                new_ais[-1 - i] = TetrisAI.from_dict(self.shapes, weights)
+        self.tetris_ais = new_ais
+
+def run_island(index, props, inboxes, reports, topology, interval, num_migrants, max_pieces, seed, generations):
+    # migrants still waiting for an island that has finished must not keep this one from exiting
+    [inbox.cancel_join_thread() for inbox in inboxes]
+    island = Island(index, props, inboxes, reports, topology, interval, num_migrants, max_pieces, seed)
+    island.run(generations)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Island model training for Tetro.')
+    parser.add_argument('--islands', type=int, default=multiprocessing.cpu_count(), help='number of islands, one process each')
+    parser.add_argument('--generations', type=int, default=None, help='generations evolved by each island')
+    parser.add_argument('--interval', type=int, default=5, help='generations between migrations')
+    parser.add_argument('--migrants', type=int, default=2, help='AIs sent to each neighbour per migration')
+    parser.add_argument('--topology', choices=list(topologies), default='ring')
+    parser.add_argument('--max-pieces', type=int, default=None, help='piece budget of each game')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--stats', default='data/stats', help='prefix of the statistics files, one set per island')
+    parser.add_argument('--weights-out', default=None,
+        help='file the weights of the best AI are saved to, data/best_weights-<run>.json by default')
+    args = parser.parse_args(argv)
+    if args.islands < 2:
+        parser.error('at least 2 islands are needed')
+
+    props = properties.load('data/properties.txt')
+    seeds = Random(args.seed)
+    inboxes = [multiprocessing.Queue() for i in range(args.islands)]
+    reports = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_island, daemon=True, args=(i, props, inboxes, reports,
+        args.topology, args.interval, args.migrants, args.max_pieces, seeds.getrandbits(32), args.generations))
+        for i in range(args.islands)]
+    [process.start() for process in processes]
+
+    run = stats.run_name()
+    weights_path = args.weights_out or f'data/best_weights-{run}.json'
+    exporters = [stats.StatsExporter(args.stats, f'{run}.island{i}') for i in range(args.islands)]
+    highest_score = -1
+    while any([process.is_alive() for process in processes]) or not reports.empty():
+        try:
+            index, summary, best_weights = reports.get(timeout=1)
+        except queue.Empty:
+            continue
+        exporters[index].write(summary)
+        print(f'Island {index} generation {summary["generation"]}: {stats.format_summary(summary)}')
+        if summary['best'] > highest_score:
+            highest_score = summary['best']
+            print(f'New best of {highest_score} lines cleared on island {index}, saved to {weights_path}')
+            with open(weights_path, 'w') as f:
+                json.dump(best_weights, f)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,264 @@
+"""Corpus of mid-game start positions for short fitness evaluations.
+
+A game from the empty grid spends most of its time on low, easy stacks, where
+strong AIs hardly differ, so telling them apart takes very long games. A
+corpus instead holds hard boards: garbage rows, jagged skylines and stacks
+with holes, either generated from a seed or harvested from recorded games. An
+AI is scored by playing a short game with a fixed piece budget from every
+position of the corpus, counting either the lines it clears or the pieces it
+survives. Lines are the default: a trained AI survives nearly every piece of a
+short game, so the pieces survived stop telling good AIs apart.
+
+A corpus is stored as JSON. Each position is a bit packed board, cell (x, y)
+being bit y * grid_width + x as in compact.py, written as a hex string.
+
+Usage:
+    python positions.py generate [--count N] [--seed N] [--output PATH]
+    python positions.py harvest RECORDING... [--every N] [--min-height N] [--output PATH]
+    python positions.py evaluate [--corpus PATH] [--weights PATH] [--budget N] [--metric lines|pieces]
+"""
+
+import sys
+import json
+import argparse
+from random import Random
+from recorder import Replay
+from ai import TetrisAI
+import tetromino
+import properties
+import evaluation
+
+def garbage_rows(rng, grid_width, grid_height):
+    """Rows filled except for a single gap, stacked from the bottom.
+
+    The gap usually stays in the same column as in the row below, like the
+    garbage sent in multiplayer games.
+    """
+
+    grid = [[0] * grid_height for x in range(grid_width)]
+    gap = rng.randrange(grid_width)
+    for y in range(grid_height - 1, grid_height - 1 - rng.randint(grid_height // 4, grid_height // 2), -1):
+        if rng.random() < 0.3:
+            gap = rng.randrange(grid_width)
+        for x in range(grid_width):
+            grid[x][y] = 0 if x == gap else 1
+    return grid
+
+def jagged_skyline(rng, grid_width, grid_height):
+    """Solid columns whose heights change sharply from one column to the next."""
+
+    grid = [[0] * grid_height for x in range(grid_width)]
+    height = rng.randint(0, grid_height // 2)
+    for x in range(grid_width):
+        height = min(max(height + rng.randint(-grid_height // 4, grid_height // 4), 0), grid_height // 2)
+        for y in range(grid_height - height, grid_height):
+            grid[x][y] = 1
+    return grid
+
+def buried_holes(rng, grid_width, grid_height):
+    """A fairly even stack with holes punched in below its surface."""
+
+    grid = [[0] * grid_height for x in range(grid_width)]
+    base = rng.randint(grid_height // 6, grid_height // 3)
+    heights = [max(base + rng.randint(-2, 2), 1) for x in range(grid_width)]
+    for x in range(grid_width):
+        for y in range(grid_height - heights[x], grid_height):
+            grid[x][y] = 1
+    for i in range(rng.randint(grid_width // 2, 2 * grid_width)):
+        x = rng.randrange(grid_width)
+        # never the top cell of a column, a hole has to be covered
+        if heights[x] > 1:
+            grid[x][grid_height - rng.randint(1, heights[x] - 1)] = 0
+    return grid
+
+# generators by the kind of position they make, each returns a grid of 1s and 0s
+generators = {
+    'garbage': garbage_rows,
+    'jagged': jagged_skyline,
+    'holes': buried_holes,
+}
+
+# scores of a game played from a position
+metrics = {
+    'pieces': lambda inst: inst.pieces_placed,
+    'lines': lambda inst: inst.lines_cleared,
+}
+
+def clear_full_rows(rng, grid):
+    """Empties a random cell of every full row, a start position never has one."""
+
+    for y in range(len(grid[0])):
+        if all([col[y] for col in grid]):
+            grid[rng.randrange(len(grid))][y] = 0
+
+def stack_height(grid):
+    grid_height = len(grid[0])
+    for y in range(grid_height):
+        if any([col[y] for col in grid]):
+            return grid_height - y
+    return 0
+
+class Corpus:
+    """A list of start positions for boards of one size.
+
+    Attributes:
+        positions: List of (kind, board) tuples, where kind tells where the
+            position came from and board is the bit packed board.
+    """
+
+    def __init__(self, grid_width, grid_height, positions=None):
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.positions = positions if positions is not None else []
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, kind, grid):
+        """Adds a position given as a grid indexed by grid[x][y]."""
+
+        board = 0
+        for x in range(self.grid_width):
+            for y in range(self.grid_height):
+                if grid[x][y] != 0:
+                    board |= 1 << (y * self.grid_width + x)
+        self.positions.append((kind, board))
+
+    def grid(self, idx):
+        """Returns a position as a grid to start a game from.
+
+        Filled cells are -1, cells of unknown type that are drawn gray.
+        """
+
+        board = self.positions[idx][1]
+        return [[-(board >> (y * self.grid_width + x) & 1) for y in range(self.grid_height)]
+            for x in range(self.grid_width)]
+
+    def generate(self, count, seed=0, kinds=None):
+        """Adds count seeded positions, cycling through the kinds of generators."""
+
+        rng = Random(seed)
+        kinds = kinds or list(generators)
+        for i in range(count):
+            kind = kinds[i % len(kinds)]
+            grid = generators[kind](rng, self.grid_width, self.grid_height)
+            clear_full_rows(rng, grid)
+            self.add(kind, grid)
+
+    def harvest(self, replay, every=50, min_height=None):
+        """Adds boards of a recorded game, one every few placements.
+
+        Args:
+            replay: Replay of a game with the same grid size as the corpus.
+            every: Number of placements between harvested boards.
+            min_height: Only boards with a stack at least this high are
+                added, half the grid height by default.
+        """
+
+        if (replay.grid_width, replay.grid_height) != (self.grid_width, self.grid_height):
+            raise ValueError(f'Recording is {replay.grid_width}x{replay.grid_height}, '
+                f'corpus is {self.grid_width}x{self.grid_height}')
+        if min_height is None:
+            min_height = self.grid_height // 2
+        for idx in range(every, replay.num_moves, every):
+            grid = replay.board_at(idx)[0]
+            if stack_height(grid) >= min_height:
+                self.add(f'game {replay.seed} move {idx}', grid)
+
+    def save(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump({
+                'grid_width': self.grid_width,
+                'grid_height': self.grid_height,
+                'positions': [{'kind': kind, 'board': hex(board)} for kind, board in self.positions],
+            }, f, indent=1)
+
+    @staticmethod
+    def load(file_path):
+        with open(file_path) as f:
+            data = json.load(f)
+        return Corpus(data['grid_width'], data['grid_height'],
+            [(position['kind'], int(position['board'], 16)) for position in data['positions']])
+
+def evaluate(ai, corpus, budget=200, metric='lines', seed=0, distribution='bag',
+    hold=False, preview_size=1, search=None):
+    """Scores an AI over every position of a corpus.
+
+    The game from position i uses seed + i, so every AI evaluated with the same
+    seed sees the same tetrominos.
+
+    Args:
+        ai: TetrisAI to evaluate, its grid size must match the corpus.
+        corpus: Corpus of start positions.
+        budget: Number of tetrominos each game is stopped after.
+        metric: Name of the score of each game in metrics.
+        seed: Seed of the game from the first position.
+        distribution: Name of the tetromino distribution, see sequence.py.
+        hold, preview_size, search: How the games are played, see
+            evaluation.play_game.
+
+    Returns:
+        A tuple of the total score and the total number of tetrominos placed.
+    """
+
+    if (ai.shapes.grid_width, ai.shapes.grid_height) != (corpus.grid_width, corpus.grid_height):
+        raise ValueError('The grid size of the AI does not match the corpus')
+    score = 0
+    pieces_placed = 0
+    for i in range(len(corpus)):
+        inst = evaluation.play_game(ai, seed + i, budget, distribution=distribution, start_grid=corpus.grid(i),
+            hold=hold, preview_size=preview_size, search=search)
+        score += metrics[metric](inst)
+        pieces_placed += inst.pieces_placed
+    return score, pieces_placed
+
+def main(argv):
+    props = properties.load('data/properties.txt')
+    parser = argparse.ArgumentParser(description='Build start position corpora and evaluate AIs on them.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    generate_parser = subparsers.add_parser('generate', help='generate seeded positions')
+    generate_parser.add_argument('--count', type=int, default=60)
+    generate_parser.add_argument('--seed', type=int, default=0)
+    generate_parser.add_argument('--kinds', default=','.join(generators), help='comma separated kinds of positions')
+    generate_parser.add_argument('--output', default='data/positions.json')
+    harvest_parser = subparsers.add_parser('harvest', help='harvest positions from recorded games')
+    harvest_parser.add_argument('recordings', nargs='+')
+    harvest_parser.add_argument('--every', type=int, default=50, help='placements between harvested boards')
+    harvest_parser.add_argument('--min-height', type=int, default=None, help='lowest stack harvested')
+    harvest_parser.add_argument('--output', default='data/positions.json')
+    harvest_parser.add_argument('--append', action='store_true', help='add to the existing corpus')
+    evaluate_parser = subparsers.add_parser('evaluate', help='score weights on a corpus')
+    evaluate_parser.add_argument('--corpus', default='data/positions.json')
+    evaluate_parser.add_argument('--weights', default='data/best_weights.json')
+    evaluate_parser.add_argument('--budget', type=int, default=200, help='tetrominos placed from each position')
+    evaluate_parser.add_argument('--metric', choices=list(metrics), default='lines')
+    evaluate_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        corpus = Corpus(props['grid_width'], props['grid_height'])
+        corpus.generate(args.count, args.seed, args.kinds.split(','))
+        corpus.save(args.output)
+        print(f'Generated {len(corpus)} positions to {args.output}')
+    elif args.command == 'harvest':
+        if args.append:
+            corpus = Corpus.load(args.output)
+        else:
+            corpus = Corpus(props['grid_width'], props['grid_height'])
+        for recording in args.recordings:
+            corpus.harvest(Replay(recording), args.every, args.min_height)
+        corpus.save(args.output)
+        print(f'Saved {len(corpus)} positions to {args.output}')
+    else:
+        corpus = Corpus.load(args.corpus)
+        shapes = tetromino.load('data/shapes.txt', corpus.grid_width, corpus.grid_height)
+        with open(args.weights) as f:
+            weights = json.load(f)
+        ai = TetrisAI.from_dict(shapes, weights)
+        score, pieces_placed = evaluate(ai, corpus, args.budget, args.metric, args.seed,
+            props.get('piece_distribution', 'bag'), **evaluation.game_arguments(evaluation.game_options(props)))
+        print(f'{args.metric.capitalize()}: {score} over {len(corpus)} positions '
+            f'({score / len(corpus):.2f} per position, {pieces_placed} pieces placed)')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,46 @@
+# types of the known properties, used to convert values read from the file
+# unknown keys are kept as strings
+property_types = {
+    'grid_width': int,
+    'grid_height': int,
+    'population_size': int,
+    'selection_size': int,
+    'mutate_rate': float,
+    'piece_distribution': str,
+    'compact_games': lambda value: value.strip().lower() == 'true',
+    'hold': lambda value: value.strip().lower() == 'true',
+    'preview_size': int,
+    'search_nodes': int,
+    'search_ms': int,
+    'search_beam_width': int,
+    'surrogate_candidates': int,
+    'surrogate_probe_pieces': int,
+    'features': lambda value: tuple([token.strip() for token in value.split(',')]),
+}
+
+def load(file_path='data/properties.txt'):
+    """Loads game options from the provided properties file.
+
+    Args:
+        file_path: Location to properties.txt file.
+
+    Returns:
+        A dictionary mapping each property key to its value.
+    """
+
+    props = {}
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            # ignore blank lines and comments
+            if len(line) == 0 or line[0] == '#':
+                continue
+            # parse key=value
+            idx_equals = line.find('=')
+            if idx_equals == -1:
+                print(f'Line corrupt: {line}')
+                continue
+            key = line[:idx_equals]
+            value = line[idx_equals + 1:]
+            props[key] = property_types.get(key, str)(value)
+    return props
@@ -0,0 +1,173 @@
+"""Compact binary recording and replay of Tetris games.
+
+A recording starts with a header describing the game, followed by a sequence
+of chunks. Each chunk begins with a keyframe, a full copy of the grid and the
+number of lines cleared before the chunk's first placement, followed by up to
+keyframe_interval placement records. A placement record packs the tetromino
+id, its rotation and its x position into 2 bytes. Since every chunk except the
+last has the same size, seeking to any placement only requires jumping to the
+nearest keyframe and replaying at most keyframe_interval - 1 placements.
+
+Only the placements are stored, the next tetromino shown at each placement is
+read from the placement after it. That is only right without a hold slot and
+with a preview of one tetromino, so games with either are not recorded, and
+the tetromino shown after the last placement is unknown. The x position
+offset limits recordings to grids at most max_grid_width cells wide.
+"""
+
+import struct
+import tetromino
+from tetris import is_colliding, lock_tetromino
+from tetromino import Tetromino
+
+# magic bytes, version, grid width, grid height, seed, keyframe interval
+header = struct.Struct('>4sBHHQH')
+magic = b'TTRO'
+version = 1
+
+# lines cleared at the start of a chunk, followed by one byte per grid cell
+keyframe_lines = struct.Struct('>I')
+
+# a placement is stored as: id (6 bits) | rotation (2 bits) | x + x_offset (8 bits)
+move_record = struct.Struct('>H')
+x_offset = 128
+# widest grid whose x positions fit in the 8 bits of a placement, leaving room
+# for tetrominos sticking out on the left
+max_grid_width = 255 - x_offset
+
+def pack_move(id, rotation, x_pos):
+    return (id << 10) | ((rotation % 4) << 8) | (x_pos + x_offset)
+
+def unpack_move(packed):
+    return (packed >> 10, (packed >> 8) & 3, (packed & 0xff) - x_offset)
+
+class GameRecorder:
+    """Streams the placements of a Tetris game to a file.
+
+    Attach to a game with inst.recorder = GameRecorder(path, inst); every call
+    to Tetris.place_tetromino will then be logged. The recorder is closed
+    automatically when the game is lost.
+
+    Raises:
+        ValueError: If the game has a hold slot, a preview of more than one
+            tetromino or a grid wider than max_grid_width.
+    """
+
+    def __init__(self, file_path, inst, keyframe_interval=256, buffer_size=1 << 16):
+        if inst.hold_enabled or len(inst.preview) > 1:
+            raise ValueError('Games with a hold slot or a longer preview cannot be recorded')
+        if inst.grid_width > max_grid_width:
+            raise ValueError(f'Grids wider than {max_grid_width} cells cannot be recorded')
+        self.grid_width = inst.grid_width
+        self.grid_height = inst.grid_height
+        self.keyframe_interval = keyframe_interval
+        self.num_moves = 0
+        self.file = open(file_path, 'wb', buffering=buffer_size)
+        self.file.write(header.pack(magic, version,
+            self.grid_width, self.grid_height, inst.seed, keyframe_interval))
+
+    def record(self, inst):
+        """Logs the current tetromino of the game, which is about to be placed."""
+
+        if self.num_moves % self.keyframe_interval == 0:
+            self.write_keyframe(inst)
+        tmino = inst.current_tmino
+        self.file.write(move_record.pack(pack_move(tmino.id, tmino.rotation, tmino.x_pos)))
+        self.num_moves += 1
+
+    def write_keyframe(self, inst):
+        self.file.write(keyframe_lines.pack(inst.lines_cleared))
+        # cells of unknown type, as in games started from a position, are stored as 255
+        self.file.write(bytes([inst.grid[x][y] & 0xff for x in range(self.grid_width) for y in range(self.grid_height)]))
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+class Replay:
+    """Random access to the placements and boards of a recorded game."""
+
+    def __init__(self, file_path, shapes_path='data/shapes.txt'):
+        # the whole recording is read at once, even 100k+ placements only take
+        # a few hundred kilobytes
+        with open(file_path, 'rb') as f:
+            self.data = f.read()
+        file_magic, file_version, self.grid_width, self.grid_height, self.seed, \
+            self.keyframe_interval = header.unpack_from(self.data, 0)
+        if file_magic != magic or file_version != version:
+            raise ValueError(f'{file_path} is not a version {version} Tetro recording')
+
+        self.shapes = tetromino.load(shapes_path, self.grid_width, self.grid_height)
+
+        self.keyframe_size = keyframe_lines.size + self.grid_width * self.grid_height
+        self.chunk_size = self.keyframe_size + self.keyframe_interval * move_record.size
+        body_size = len(self.data) - header.size
+        full_chunks, remainder = divmod(body_size, self.chunk_size)
+        self.num_moves = full_chunks * self.keyframe_interval
+        if remainder > 0:
+            self.num_moves += (remainder - self.keyframe_size) // move_record.size
+
+    def move(self, idx):
+        """Returns the (id, rotation, x position) of the placement at an index."""
+
+        chunk, offset = divmod(idx, self.keyframe_interval)
+        pos = header.size + chunk * self.chunk_size + self.keyframe_size + offset * move_record.size
+        return unpack_move(move_record.unpack_from(self.data, pos)[0])
+
+    def board_at(self, idx):
+        """Rebuilds the board as it was right before the placement at an index.
+
+        An index equal to num_moves gives the final board of the game.
+
+        Returns:
+            A tuple of the grid, indexed by grid[x][y], and the number of lines
+            cleared up to that point.
+        """
+
+        if idx < 0 or idx > self.num_moves:
+            raise IndexError(f'move index {idx} out of range 0..{self.num_moves}')
+        if self.num_moves == 0:
+            return [[0] * self.grid_height for x in range(self.grid_width)], 0
+        # the final board lies past the last keyframe when the last chunk is full
+        chunk = min(idx, self.num_moves - 1) // self.keyframe_interval
+        pos = header.size + chunk * self.chunk_size
+        lines_cleared = keyframe_lines.unpack_from(self.data, pos)[0]
+        cells = pos + keyframe_lines.size
+        grid = [[-1 if cell == 0xff else cell for cell in self.data[cells + x * self.grid_height:cells + (x + 1) * self.grid_height]]
+            for x in range(self.grid_width)]
+        for i in range(chunk * self.keyframe_interval, idx):
+            lines_cleared += lock_tetromino(grid, self.dropped_tetromino(grid, i))
+        return grid, lines_cleared
+
+    def dropped_tetromino(self, grid, idx):
+        """Returns the tetromino of a placement at its resting position in the grid."""
+
+        id, rotation, x_pos = self.move(idx)
+        tmino = Tetromino(self.shapes, id, rotation, x_pos)
+        tmino.y_pos = tmino.min_y
+        while not is_colliding(grid, tmino):
+            tmino.y_pos += 1
+        tmino.y_pos -= 1
+        return tmino
+
+    def load_into(self, inst, idx):
+        """Sets up a Tetris instance to show the game right before a placement.
+
+        The current tetromino is shown at the top of the grid and the next move
+        at the position it was placed at, so the instance can be rendered as is.
+        The next tetromino is None from the last placement on, it was never
+        placed so the recording does not know it.
+        """
+
+        grid, inst.lines_cleared = self.board_at(idx)
+        inst.grid = grid
+        inst.pieces_placed = idx
+        inst.lost = idx >= self.num_moves
+        if not inst.lost:
+            inst.next_move = self.dropped_tetromino(grid, idx)
+            inst.current_tmino = Tetromino(self.shapes, inst.next_move.id, inst.next_move.rotation,
+                inst.next_move.x_pos, inst.next_move.min_y)
+        else:
+            inst.current_tmino = None
+            inst.next_move = None
+        inst.next_id = self.move(idx + 1)[0] if idx + 1 < self.num_moves else None
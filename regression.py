@@ -0,0 +1,202 @@
+"""Differential testing of search engines against the reference engine.
+
+The reference engine is the plain search of TetrisAI: every placement from
+compute_moves_available is added to the grid and scored with a full pass.
+Faster engines must produce the same placements in the same order, the same
+scores up to a tolerance and, above all, the same chosen moves, or the fitness
+of trained weights silently changes.
+
+The harness runs an alternate engine side by side with the reference on
+seeded random boards and on seeded games, where each engine drives its own
+game and the boards must stay identical after every placement. The first
+divergence is reported with a dump of the board.
+
+Usage:
+    python regression.py [--engine incremental] [--boards N] [--games N]
+        [--max-pieces N] [--seed N] [--grid-width W] [--grid-height H] [--features SPEC]
+
+Exits with status 1 if the engines diverge.
+"""
+
+import sys
+import argparse
+from random import Random
+from tetris import Tetris
+from tetromino import Tetromino
+from ai import TetrisAI
+from features import FeatureSet, default_features
+from benchmark import random_board
+import tetromino
+import properties
+
+class ReferenceEngine:
+    """Search of TetrisAI with full evaluation of every placement."""
+
+    def __init__(self, ai):
+        self.ai = TetrisAI(ai.shapes, ai.weights, ai.feature_set)
+        self.ai.incremental = False
+
+    def moves(self, grid, id):
+        """Returns the (rotation, x, y) placements considered, in search order."""
+
+        return self.ai.compute_moves_available(grid, Tetromino(self.ai.shapes, id))
+
+    def scores(self, grid, id, moves):
+        scores = []
+        for move in moves:
+            tmino = Tetromino(self.ai.shapes, id, *move)
+            self.ai.add_to_grid(grid, tmino)
+            scores.append(self.ai.compute_score(grid, tmino))
+            self.ai.remove_from_grid(grid, tmino)
+        return scores
+
+    def best_move(self, grid, id):
+        """Returns the chosen (rotation, x, y) placement, None if nothing fits."""
+
+        tmino = self.ai.best_placement(grid, id)[1]
+        return None if tmino is None else (tmino.rotation, tmino.x_pos, tmino.y_pos)
+
+class IncrementalEngine(ReferenceEngine):
+    """Search of TetrisAI scoring placements from the region they touch."""
+
+    def __init__(self, ai):
+        if not ai.feature_set.incremental:
+            raise ValueError('Every feature must support incremental evaluation')
+        self.ai = TetrisAI(ai.shapes, ai.weights, ai.feature_set)
+        self.ai.incremental = True
+
+    def moves(self, grid, id):
+        return [drop[:3] for drop in self.ai.compute_drops(grid, self.ai.compute_heightmap(grid), id)]
+
+    def scores(self, grid, id, moves):
+        base = self.ai.prepare(grid)
+        scores = []
+        for rotation, x_pos, y_pos, stacked in self.ai.compute_drops(grid, base[2], id):
+            if stacked:
+                tmino_type = self.ai.shapes.get_tetromino_type(id, rotation)
+                scores.append(self.ai.evaluate_delta(base, (tmino_type, x_pos, y_pos)))
+            else:
+                scores += ReferenceEngine.scores(self, grid, id, [(rotation, x_pos, y_pos)])
+        return scores
+
+# engines by the name used on the command line
+engines = {
+    'reference': ReferenceEngine,
+    'incremental': IncrementalEngine,
+}
+
+class Divergence:
+    """The first difference found between two engines."""
+
+    def __init__(self, description, grid, id, expected, actual):
+        self.description = description
+        self.grid = grid
+        self.id = id
+        self.expected = expected
+        self.actual = actual
+
+    def report(self, ai):
+        print(f'Divergence: {self.description}')
+        print(f'Tetromino: {self.id}')
+        print(f'Reference: {self.expected}')
+        print(f'Alternate: {self.actual}')
+        ai.print_grid(self.grid)
+
+def compare_position(reference, alternate, grid, id, tolerance=1e-9):
+    """Compares two engines on a single boolean grid and tetromino.
+
+    Returns:
+        A Divergence, or None if the engines agree.
+    """
+
+    expected_moves = reference.moves(grid, id)
+    actual_moves = alternate.moves(grid, id)
+    if expected_moves != actual_moves:
+        return Divergence('placements differ', grid, id, expected_moves, actual_moves)
+    expected_scores = reference.scores(grid, id, expected_moves)
+    actual_scores = alternate.scores(grid, id, actual_moves)
+    for move, expected, actual in zip(expected_moves, expected_scores, actual_scores):
+        if abs(expected - actual) > tolerance * (1 + abs(expected)):
+            return Divergence(f'scores of placement {move} differ', grid, id, expected, actual)
+    expected_move = reference.best_move(grid, id)
+    actual_move = alternate.best_move(grid, id)
+    if expected_move != actual_move:
+        return Divergence('chosen placements differ', grid, id, expected_move, actual_move)
+    return None
+
+def compare_boards(reference, alternate, num_boards, seed=0, tolerance=1e-9):
+    """Compares two engines on seeded random boards with every tetromino."""
+
+    shapes = reference.ai.shapes
+    rng = Random(seed)
+    for i in range(num_boards):
+        grid = random_board(rng, shapes.grid_width, shapes.grid_height)
+        for id in range(1, shapes.unique_types + 1):
+            divergence = compare_position(reference, alternate, grid, id, tolerance)
+            if divergence is not None:
+                divergence.description += f' on random board {i}'
+                return divergence
+    return None
+
+def compare_game(reference, alternate, seed, max_pieces=None, distribution='bag', tolerance=1e-9):
+    """Plays a seeded game with each engine and compares them after every move."""
+
+    shapes = reference.ai.shapes
+    games = [Tetris(shapes, 0, seed, distribution), Tetris(shapes, 0, seed, distribution)]
+    while not games[0].lost:
+        if max_pieces is not None and games[0].pieces_placed >= max_pieces:
+            break
+        [game.update() for game in games]
+        if games[0].grid != games[1].grid or games[0].lost != games[1].lost:
+            return Divergence(f'boards differ after {games[0].pieces_placed} pieces of game {seed}',
+                reference.ai.to_boolean_grid(games[1].grid), games[1].current_tmino and games[1].current_tmino.id,
+                f'{games[0].lines_cleared} lines cleared', f'{games[1].lines_cleared} lines cleared')
+        if games[0].lost:
+            break
+        grid = reference.ai.to_boolean_grid(games[0].grid)
+        id = games[0].current_tmino.id
+        divergence = compare_position(reference, alternate, grid, id, tolerance)
+        if divergence is not None:
+            divergence.description += f' after {games[0].pieces_placed} pieces of game {seed}'
+            return divergence
+        for game, engine in zip(games, (reference, alternate)):
+            move = engine.best_move(grid, id)
+            game.next_move = None if move is None else Tetromino(shapes, id, *move)
+    return None
+
+def main(argv):
+    props = properties.load('data/properties.txt')
+    parser = argparse.ArgumentParser(description='Compare a search engine to the reference engine.')
+    parser.add_argument('--engine', choices=list(engines), default='incremental')
+    parser.add_argument('--boards', type=int, default=200, help='random boards to compare on')
+    parser.add_argument('--games', type=int, default=5, help='seeded games to compare on')
+    parser.add_argument('--max-pieces', type=int, default=2000, help='piece budget of each game')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--grid-width', type=int, default=props['grid_width'])
+    parser.add_argument('--grid-height', type=int, default=props['grid_height'])
+    parser.add_argument('--features', default=','.join(props.get('features', default_features)))
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='relative tolerance of scores')
+    args = parser.parse_args(argv)
+
+    shapes = tetromino.load('data/shapes.txt', args.grid_width, args.grid_height)
+    feature_set = FeatureSet.get(args.features.split(','), args.grid_width, args.grid_height)
+    rng = Random(args.seed)
+    ai = TetrisAI(shapes, [rng.random() for i in range(feature_set.num_weights)], feature_set)
+    reference = ReferenceEngine(ai)
+    alternate = engines[args.engine](ai)
+
+    divergence = compare_boards(reference, alternate, args.boards, args.seed, args.tolerance)
+    print(f'Compared {args.boards} random boards')
+    for i in range(args.games):
+        if divergence is not None:
+            break
+        divergence = compare_game(reference, alternate, args.seed + i, args.max_pieces,
+            props.get('piece_distribution', 'bag'), args.tolerance)
+        print(f'Compared game {args.seed + i}')
+    if divergence is not None:
+        divergence.report(ai)
+        sys.exit(1)
+    print(f'No divergence between {args.engine} and reference')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
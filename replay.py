@@ -0,0 +1,88 @@
+import sys
+import pygame
+from tetris import Tetris
+from recorder import Replay
+
+class ReplayViewer:
+    """Pygame viewer that steps through a recorded game.
+
+    Usage: python replay.py <recording> [move index]
+    """
+
+    def __init__(self, file_path, move_idx=0):
+        self.replay = Replay(file_path)
+
+        # size of cell in pixels (for rendering)
+        self.cell_width = 30
+        self.inst = Tetris(self.replay.shapes, self.cell_width, self.replay.seed)
+        self.move_idx = min(move_idx, self.replay.num_moves)
+        self.playing = False
+        self.play_delay = 50
+
+        pygame.init()
+        tetris_width = self.replay.grid_width * self.cell_width
+        tetris_height = self.replay.grid_height * self.cell_width
+        extra_width = (self.replay.shapes.get_largest_tetromino_size() + 4) * self.cell_width
+        self.pygame_surface = pygame.display.set_mode((tetris_width + extra_width, tetris_height))
+
+    def start(self):
+        print(
+            '\nReplay controls:\n'
+            '(left/right) step one move, (down/up) step 100 moves,\n'
+            '(page down/page up) step 10000 moves, (home/end) jump to start/end,\n'
+            '(space) play/pause, (q) quit\n')
+        self.seek(self.move_idx)
+        game_clock = pygame.time.Clock()
+        play_clock = 0
+        while True:
+            if not self.handle_input():
+                return
+            if self.playing:
+                play_clock += game_clock.get_time()
+                if play_clock >= self.play_delay:
+                    play_clock = 0
+                    self.seek(self.move_idx + 1)
+            self.render()
+            game_clock.tick(60)
+
+    def seek(self, move_idx):
+        self.move_idx = max(0, min(move_idx, self.replay.num_moves))
+        self.replay.load_into(self.inst, self.move_idx)
+        pygame.display.set_caption(
+            f'Tetro Replay | Move: {self.move_idx}/{self.replay.num_moves} | Seed: {self.replay.seed}')
+
+    def render(self):
+        self.pygame_surface.fill((0, 0, 0))
+        self.inst.render(self.pygame_surface, True)
+        pygame.display.flip()
+
+    def handle_input(self):
+        """Handles keyboard input, returns False if the viewer should close."""
+
+        steps = {
+            pygame.K_RIGHT: 1, pygame.K_LEFT: -1,
+            pygame.K_UP: 100, pygame.K_DOWN: -100,
+            pygame.K_PAGEUP: 10000, pygame.K_PAGEDOWN: -10000,
+        }
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_q:
+                    return False
+                elif event.key in steps:
+                    self.seek(self.move_idx + steps[event.key])
+                elif event.key == pygame.K_HOME:
+                    self.seek(0)
+                elif event.key == pygame.K_END:
+                    self.seek(self.replay.num_moves)
+                elif event.key == pygame.K_SPACE:
+                    self.playing = not self.playing
+        return True
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python replay.py <recording> [move index]')
+        sys.exit(1)
+    viewer = ReplayViewer(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    viewer.start()
@@ -0,0 +1,124 @@
+"""Scheduling of evaluation jobs across worker processes.
+
+The wall time of a generation is set by its slowest worker, and games range
+from a few pieces to hundreds of thousands, so handing jobs out in population
+order often starts the longest game last. Instead the duration of every job
+is predicted from the fitness expected of its AI, which breeding sets to the
+fitness of its parents, using a linear model of game time against fitness
+fitted on every job run so far. Fitness is whatever score the AIs are bred
+by, lines cleared or the score over a corpus of start positions, and the
+model is only ever fitted and queried with one kind of score. Jobs are dealt
+out longest first, each to the worker with the least predicted work, and a
+worker that runs out of jobs steals the longest job still waiting on the
+worker with the most predicted work left, so a bad prediction only costs as
+much as the job itself. Until the model has been fitted, in the first
+generation every job is predicted alike, so taking a job from another worker
+is just how the jobs get spread and is not counted as a steal.
+"""
+
+import heapq
+from collections import deque
+
+class DurationModel:
+    """Least squares fit of the seconds a game takes to the fitness it scores."""
+
+    def __init__(self):
+        # running sums of the fit, so memory does not grow with the jobs recorded
+        self.count = 0
+        self.sum_fitness = 0.0
+        self.sum_seconds = 0.0
+        self.sum_fitness_squared = 0.0
+        self.sum_fitness_seconds = 0.0
+
+    def record(self, fitness, seconds):
+        self.count += 1
+        self.sum_fitness += fitness
+        self.sum_seconds += seconds
+        self.sum_fitness_squared += fitness * fitness
+        self.sum_fitness_seconds += fitness * seconds
+
+    def fitted(self):
+        """Returns whether enough games were recorded for predictions to mean anything."""
+
+        return self.count >= 2
+
+    def predict(self, expected_fitness=None):
+        """Returns the predicted seconds of a game.
+
+        Args:
+            expected_fitness: Fitness the AI is expected to score, None if
+                unknown, in which case the average of all recorded games is
+                used.
+        """
+
+        if expected_fitness is None:
+            expected_fitness = self.sum_fitness / self.count if self.count else 0.0
+        # until there is anything to fit, only the order of the jobs matters
+        if not self.fitted():
+            return expected_fitness
+        denominator = self.count * self.sum_fitness_squared - self.sum_fitness * self.sum_fitness
+        if denominator <= 0:
+            return self.sum_seconds / self.count
+        slope = (self.count * self.sum_fitness_seconds - self.sum_fitness * self.sum_seconds) / denominator
+        intercept = (self.sum_seconds - slope * self.sum_fitness) / self.count
+        return max(intercept + slope * expected_fitness, 0.0)
+
+class WorkStealingScheduler:
+    """Deals jobs to workers longest first and rebalances them by stealing.
+
+    Attributes:
+        loads: Predicted seconds of the jobs still waiting on each worker.
+        num_stolen: Number of jobs taken from another worker's queue, always
+            0 unless steals are counted.
+    """
+
+    def __init__(self, num_workers, count_steals=True):
+        """Creates an empty queue for every worker.
+
+        Args:
+            num_workers: Number of queues.
+            count_steals: Whether to count the jobs taken from another worker,
+                False while the predictions are not fitted to anything.
+        """
+
+        self.queues = [deque() for i in range(num_workers)]
+        self.loads = [0.0] * num_workers
+        self.count_steals = count_steals
+        self.num_stolen = 0
+
+    def assign(self, jobs):
+        """Deals (predicted seconds, job) tuples to the workers.
+
+        Each job, longest first, goes to the worker with the least predicted
+        work so far.
+        """
+
+        least_loaded = [(load, worker) for worker, load in enumerate(self.loads)]
+        heapq.heapify(least_loaded)
+        for predicted, job in sorted(jobs, key=lambda elem: elem[0], reverse=True):
+            load, worker = heapq.heappop(least_loaded)
+            self.queues[worker].append((predicted, job))
+            self.loads[worker] += predicted
+            heapq.heappush(least_loaded, (self.loads[worker], worker))
+
+    def requeue(self, worker, predicted, job):
+        """Puts a job that was taken but not finished back in front of a worker's queue."""
+
+        self.queues[worker].appendleft((predicted, job))
+        self.loads[worker] += predicted
+
+    def next_job(self, worker):
+        """Returns the next job of a worker, None once every queue is empty."""
+
+        owner = worker
+        if not self.queues[owner]:
+            victims = [victim for victim in range(len(self.queues)) if self.queues[victim]]
+            if not victims:
+                return None
+            owner = max(victims, key=lambda victim: self.loads[victim])
+            if self.count_steals:
+                self.num_stolen += 1
+        # queues are longest first, so the front is also the job worth stealing
+        predicted, job = self.queues[owner].popleft()
+        self.loads[owner] -= predicted
+        return job
@@ -0,0 +1,143 @@
+"""Cost-bounded search over the hold slot and the preview of a game.
+
+The greedy search of TetrisAI only places the current tetromino. A
+BoundedSearch also considers holding it, and looks ahead through the
+tetrominos in the preview with a beam search: every ply places one more
+tetromino, the placements of each ply are ordered by their score and only the
+best beam_width of them are searched further. The search deepens one ply at a
+time and stops before a ply that would exceed its budget of placements scored
+or of time, so the cost of a move stays bounded however long the preview is.
+Within a ply, a line of play is only searched further while every placement
+it could have still fits in the node budget, so past the first ply the budget
+is never exceeded.
+A line of play is judged by the score of the grid after its last placement,
+like the lookahead of TetrisAI.best_placement. As there, rows filled along the
+way are not cleared, so features rewarding full rows credit a line clear at
+any depth the same; clearing them would hide early clears from the score and
+make the search put them off.
+
+A node budget gives the same moves on every machine, a time budget does not.
+"""
+
+from time import perf_counter
+from tetromino import Tetromino
+
+class BoundedSearch:
+    """Beam search over hold and preview within a budget per move.
+
+    Attributes:
+        nodes: Number of placements scored by the last search.
+        depth: Number of tetrominos placed by the line chosen by the last search.
+    """
+
+    def __init__(self, max_nodes=2000, max_seconds=None, beam_width=8):
+        """
+        Args:
+            max_nodes: Most placements scored per move, None for no limit.
+            max_seconds: Most time taken per move, None for no limit.
+            beam_width: Number of lines of play searched further at each ply.
+        """
+
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.beam_width = beam_width
+        self.nodes = 0
+        self.depth = 0
+
+    # the tetrominos that can be placed from a state, as tuples of the id
+    # placed, the id held afterwards and the index of the next tetromino
+    # holding only shows in a move as a different id, so it is never used to
+    # place a tetromino of the same type as the current one
+    def options(self, pieces, index, hold_id, can_hold):
+        options = [(pieces[index], hold_id, index + 1)]
+        if can_hold:
+            if hold_id is None and index + 1 < len(pieces):
+                options.append((pieces[index + 1], pieces[index], index + 2))
+            elif hold_id is not None:
+                options.append((hold_id, pieces[index], index + 1))
+        if len(options) > 1 and options[1][0] == pieces[index]:
+            options.pop()
+        return options
+
+    # most placements a tetromino can have, one per column of each rotation
+    def max_placements(self, shapes, id):
+        return sum([shapes.get_tetromino_type(id, rotation).max_x - shapes.get_tetromino_type(id, rotation).min_x + 1
+            for rotation in shapes.unique_tmino_list[id - 1]])
+
+    def best_move(self, ai, inst):
+        """Returns the Tetromino to place next in a game, None if nothing fits.
+
+        If its id differs from the current tetromino, the current one is to be
+        held first, which Tetris.update does.
+        """
+
+        start_time = perf_counter()
+        grid = ai.to_boolean_grid(inst.grid)
+        pieces = [inst.current_tmino.id] + list(inst.preview)
+        self.nodes = 0
+        self.depth = 1
+
+        # first ply, always searched whatever the budget: the placement the
+        # greedy search would choose for each option, holding only when it is
+        # strictly better
+        best_move = (float('-inf'), None)
+        # (score, grid, id, move, index of the next tetromino, held id, first move)
+        # of every placement of the last ply
+        children = []
+        for id, hold_id, index in self.options(pieces, 0, inst.hold_id, inst.can_hold):
+            scored = ai.score_placements(grid, id)
+            self.nodes += len(scored)
+            score, tmino = ai.pick_placement(grid, id, scored)
+            if score > best_move[0]:
+                best_move = (score, tmino)
+            children += [(score, grid, id, move, index, hold_id, Tetromino(ai.shapes, id, *move))
+                for score, exact, move in scored]
+        # placements scored by the last ply and the number of states it expanded
+        ply_nodes = self.nodes
+        num_expanded = 1
+
+        while True:
+            # searching the best placements first is what makes a narrow beam work
+            list.sort(children, key=lambda elem: elem[0])
+            children.reverse()
+            beam = []
+            for score, parent, id, move, index, hold_id, first_move in children[:self.beam_width]:
+                if index < len(pieces):
+                    child_grid = [list(col) for col in parent]
+                    ai.add_to_grid(child_grid, Tetromino(ai.shapes, id, *move))
+                    beam.append((child_grid, index, hold_id, first_move))
+            if len(beam) == 0:
+                break
+            # stop before a ply that is expected to cost more than the budget left
+            expected_nodes = len(beam) * ply_nodes / num_expanded
+            if self.max_nodes is not None and self.nodes + expected_nodes > self.max_nodes:
+                break
+            if self.max_seconds is not None:
+                seconds_per_node = (perf_counter() - start_time) / max(self.nodes, 1)
+                if perf_counter() - start_time + expected_nodes * seconds_per_node > self.max_seconds:
+                    break
+
+            next_children = []
+            ply_start_nodes = self.nodes
+            num_expanded = 0
+            for child_grid, index, hold_id, first_move in beam:
+                options = self.options(pieces, index, hold_id, inst.hold_enabled)
+                # the beam is best first, so cutting the ply short only narrows it
+                if self.max_nodes is not None and self.nodes + sum([self.max_placements(ai.shapes, option[0])
+                        for option in options]) > self.max_nodes:
+                    break
+                for id, next_hold_id, next_index in options:
+                    scored = ai.score_placements(child_grid, id)
+                    self.nodes += len(scored)
+                    next_children += [(score, child_grid, id, move, next_index, next_hold_id, first_move)
+                        for score, exact, move in scored]
+                num_expanded += 1
+            ply_nodes = self.nodes - ply_start_nodes
+            # every line of play tops out, keep the move of the shallower search
+            if len(next_children) == 0:
+                break
+            children = next_children
+            self.depth += 1
+            best_child = max(children, key=lambda elem: elem[0])
+            best_move = (best_child[0], best_child[6])
+        return best_move[1]
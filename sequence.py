@@ -0,0 +1,125 @@
+"""Tetromino sequences.
+
+Each distribution is a generator function taking the random number generator
+of a game, its ShapeSet and the game itself, and yielding tetromino ids
+forever. Only ids are produced; the game creates the piece object of the
+active tetromino itself, so even very long games allocate no piece objects for
+the sequence.
+"""
+
+def seven_bag(rng, shapes, game=None):
+    """Yields every type of tetromino once in a random order, then repeats.
+
+    This guarantees a fair distribution of tetrominos. The draws are the same as
+    the original list based sequence, so games with the same seed see the same
+    tetrominos.
+    """
+
+    while True:
+        seq = []
+        id_list = [i for i in range(1, shapes.unique_types + 1)]
+        # randomly pull ids from the list and put it into the sequence
+        while len(id_list) != 0:
+            seq.append(id_list.pop(rng.randint(0, len(id_list) - 1)))
+        # the sequence was always consumed from its end
+        yield from reversed(seq)
+
+def uniform(rng, shapes, game=None):
+    """Yields independently chosen tetrominos, like ShapeSet.random_tetromino."""
+
+    while True:
+        yield rng.randint(1, shapes.unique_types)
+
+def sz_flood(rng, shapes, game=None, flood_rate=0.75):
+    """Yields mostly S and Z tetrominos, which are the hardest to place cleanly.
+
+    Args:
+        flood_rate: Chance of each tetromino being an S or a Z, the rest are
+            chosen uniformly.
+    """
+
+    flood_ids = [shapes.get_tetromino_id(name) for name in ('S', 'Z')]
+    flood_ids = [id for id in flood_ids if id is not None]
+    if len(flood_ids) == 0:
+        raise ValueError('sz_flood requires tetrominos named S and Z in the shapes file')
+    while True:
+        if rng.random() < flood_rate:
+            yield flood_ids[rng.randint(0, len(flood_ids) - 1)]
+        else:
+            yield rng.randint(1, shapes.unique_types)
+
+def adversarial(rng, shapes, game, randomness=0.1):
+    """Yields the tetromino whose best placement on the current grid is worst.
+
+    Each placement is judged by the height of the stack after the placement and
+    the number of holes it leaves under the tetromino; only the best placement
+    of each tetromino counts. Since the game draws one tetromino ahead for its
+    preview, the tetromino is chosen against the grid before the current
+    tetromino is placed.
+
+    Args:
+        randomness: Chance of choosing a tetromino uniformly instead, which
+            keeps the sequence from getting stuck in a repeating pattern.
+    """
+
+    while True:
+        if rng.random() < randomness:
+            yield rng.randint(1, shapes.unique_types)
+            continue
+        heights = compute_heightmap(game.grid)
+        worst_ids, worst_cost = [], None
+        for id in range(1, shapes.unique_types + 1):
+            cost = best_placement_cost(shapes, id, heights, game.grid_height)
+            if worst_cost is None or cost > worst_cost:
+                worst_ids, worst_cost = [id], cost
+            elif cost == worst_cost:
+                worst_ids.append(id)
+        yield worst_ids[rng.randint(0, len(worst_ids) - 1)]
+
+def best_placement_cost(shapes, id, heights, grid_height):
+    """Returns the lowest cost among all vertical drops of a tetromino.
+
+    The cost of a placement is the resulting stack height plus 4 for every
+    empty cell left directly under the tetromino.
+    """
+
+    best_cost = None
+    for rotation in shapes.unique_tmino_list[id - 1]:
+        tmino_type = shapes.get_tetromino_type(id, rotation)
+        for x_pos in range(tmino_type.min_x, tmino_type.max_x + 1):
+            # lowest position where every column of the tetromino is above the stack
+            y_pos = tmino_type.max_y
+            for x, bottom in enumerate(tmino_type.column_bottoms):
+                if bottom != -1:
+                    y_pos = min(y_pos, grid_height - heights[x_pos + x] - 1 - bottom)
+            holes = 0
+            top = grid_height
+            for x, bottom in enumerate(tmino_type.column_bottoms):
+                if bottom != -1:
+                    holes += grid_height - heights[x_pos + x] - 1 - bottom - y_pos
+                    top = min(top, y_pos + tmino_type.column_tops[x])
+            cost = (grid_height - top) + holes * 4
+            if best_cost is None or cost < best_cost:
+                best_cost = cost
+    return best_cost
+
+def compute_heightmap(grid):
+    """Finds the height of the highest occupied cell in each column of a grid."""
+
+    heights = []
+    for col in grid:
+        height = 0
+        for y in range(len(col)):
+            if col[y]:
+                height = len(col) - y
+                break
+        heights.append(height)
+    return heights
+
+# piece distributions by the name used in data/properties.txt
+distributions = {
+    'bag': seven_bag,
+    'uniform': uniform,
+    'sz_flood': sz_flood,
+    'adversarial': adversarial,
+}
@@ -0,0 +1,252 @@
+"""Asyncio service answering best move queries with a trained AI.
+
+Other tools can ask for the best placement of a tetromino on a board without
+embedding pygame or the training loop. Requests and responses use a compact
+binary format and may be pipelined on a connection; responses carry the id of
+their request and are not necessarily returned in order.
+
+Request: a header followed by the board.
+    uint32  request id
+    uint8   flags, bit 0 set to score placements by the best placement of
+            the next tetromino after them
+    uint8   grid width
+    uint8   grid height
+    uint8   current tetromino id
+    uint8   next tetromino id, 0 if unknown
+    bytes   ceil(width * height / 8) bytes holding one bit per cell; cell
+            (x, y) is bit y * width + x counting from the least significant
+            bit of the first byte, set if the cell is filled
+
+Response:
+    uint32  request id
+    uint8   status, see the status_* constants
+    int8    rotation of the placement
+    int16   x position of the placement
+    int16   y position of the placement
+    float64 score of the placement
+
+Usage:
+    python server.py --weights FILE [--host HOST] [--port PORT] [--unix PATH]
+
+The weights file is a JSON object as produced by TetrisAI.to_dict.
+"""
+
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+from collections import deque
+from ai import TetrisAI
+import tetromino
+import properties
+
+request_header = struct.Struct('>IBBBBB')
+response_format = struct.Struct('>IBbhhd')
+
+flag_lookahead = 1
+
+status_ok = 0
+# the tetromino does not fit anywhere on the board
+status_no_move = 1
+# the grid size or tetromino ids do not match the loaded AI, or the request
+# could not be evaluated
+status_bad_request = 2
+
+def board_size(grid_width, grid_height):
+    return (grid_width * grid_height + 7) // 8
+
+def encode_board(grid):
+    """Packs a grid indexed by grid[x][y] into the request board format."""
+
+    grid_width = len(grid)
+    bits = 0
+    for x in range(grid_width):
+        for y in range(len(grid[0])):
+            if grid[x][y]:
+                bits |= 1 << (y * grid_width + x)
+    return bits.to_bytes(board_size(grid_width, len(grid[0])), 'little')
+
+def decode_board(data, grid_width, grid_height):
+    """Unpacks a board into a boolean grid indexed by grid[x][y]."""
+
+    bits = int.from_bytes(data, 'little')
+    return [[(bits >> (y * grid_width + x)) & 1 == 1 for y in range(grid_height)]
+        for x in range(grid_width)]
+
+def encode_request(request_id, grid, current_id, next_id=0, lookahead=False):
+    return request_header.pack(request_id, flag_lookahead if lookahead else 0,
+        len(grid), len(grid[0]), current_id, next_id) + encode_board(grid)
+
+def decode_response(data):
+    """Returns a (request id, status, rotation, x, y, score) tuple."""
+
+    return response_format.unpack(data)
+
+def query(sock, grid, current_id, next_id=0, lookahead=False, request_id=0):
+    """Sends a single request over a blocking socket and waits for its response."""
+
+    sock.sendall(encode_request(request_id, grid, current_id, next_id, lookahead))
+    data = b''
+    while len(data) < response_format.size:
+        chunk = sock.recv(response_format.size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return decode_response(data)
+
+class EvaluationServer:
+    """Serves best move queries for a single AI.
+
+    Requests from all connections are collected in a queue. Whenever the
+    evaluator is free, every queued request (up to max_batch) is evaluated in one
+    go on a worker thread, so the event loop keeps reading requests while a
+    batch is being evaluated.
+    """
+
+    def __init__(self, ai, max_batch=64, latency_window=10000):
+        self.ai = ai
+        self.max_batch = max_batch
+        self.requests = None
+        # latencies in seconds of the most recent requests
+        self.latencies = deque(maxlen=latency_window)
+        self.num_requests = 0
+        self.num_batches = 0
+
+    async def serve(self, host='127.0.0.1', port=5131, unix_path=None, stats_interval=10):
+        self.requests = asyncio.Queue()
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        print(f'Evaluation server listening on {unix_path or (host, port)}')
+        tasks = [asyncio.create_task(self.batch_loop())]
+        if stats_interval:
+            tasks.append(asyncio.create_task(self.report_loop(stats_interval)))
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # a future for every request of this connection that has not been answered yet
+        pending = set()
+        try:
+            while True:
+                header = await reader.readexactly(request_header.size)
+                start_time = time.perf_counter()
+                request = request_header.unpack(header)
+                board = await reader.readexactly(board_size(request[2], request[3]))
+                answered = asyncio.get_running_loop().create_future()
+                pending.add(answered)
+                answered.add_done_callback(pending.discard)
+                await self.requests.put((request, board, writer, start_time, answered))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # a client that half-closes after pipelining still gets every response
+            if pending:
+                await asyncio.wait(set(pending))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.requests.get()]
+            while len(batch) < self.max_batch and not self.requests.empty():
+                batch.append(self.requests.get_nowait())
+            responses = await loop.run_in_executor(None, self.evaluate_batch, batch)
+            writers = set()
+            for (request, board, writer, start_time, answered), response in zip(batch, responses):
+                if writer.is_closing():
+                    continue
+                writer.write(response)
+                writers.add(writer)
+                self.latencies.append(time.perf_counter() - start_time)
+            for writer in writers:
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+            for request, board, writer, start_time, answered in batch:
+                if not answered.done():
+                    answered.set_result(None)
+            self.num_requests += len(batch)
+            self.num_batches += 1
+
+    def evaluate_batch(self, batch):
+        responses = []
+        for request, board, writer, start_time, answered in batch:
+            # a request that fails is answered as a bad request, the others of
+            # the batch and the batch loop itself carry on
+            try:
+                responses.append(self.evaluate(request, board))
+            except Exception as e:
+                print(f'Request {request[0]} failed: {e!r}')
+                responses.append(response_format.pack(request[0], status_bad_request, 0, 0, 0, 0.0))
+        return responses
+
+    def evaluate(self, request, board):
+        """Computes the response to a single request."""
+
+        request_id, flags, grid_width, grid_height, current_id, next_id = request
+        shapes = self.ai.shapes
+        if (grid_width != shapes.grid_width or grid_height != shapes.grid_height
+            or not 1 <= current_id <= shapes.unique_types
+            or not 0 <= next_id <= shapes.unique_types):
+            return response_format.pack(request_id, status_bad_request, 0, 0, 0, 0.0)
+        grid = decode_board(board, grid_width, grid_height)
+        lookahead = flags & flag_lookahead and next_id != 0
+        score, tmino = self.ai.best_placement(grid, current_id, next_id if lookahead else None)
+        if tmino is None:
+            return response_format.pack(request_id, status_no_move, 0, 0, 0, 0.0)
+        return response_format.pack(request_id, status_ok, tmino.rotation, tmino.x_pos, tmino.y_pos, score)
+
+    def latency_stats(self):
+        """Returns the p50 and p99 latency in milliseconds of recent requests."""
+
+        if len(self.latencies) == 0:
+            return {'requests': self.num_requests, 'p50_ms': 0.0, 'p99_ms': 0.0, 'mean_batch': 0.0}
+        latencies = sorted(self.latencies)
+        return {
+            'requests': self.num_requests,
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'p99_ms': latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000,
+            'mean_batch': self.num_requests / max(self.num_batches, 1),
+        }
+
+    async def report_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.latency_stats()
+            print('Requests: {requests} | p50: {p50_ms:.2f}ms | p99: {p99_ms:.2f}ms | '
+                'mean batch: {mean_batch:.1f}'.format(**stats))
+
+def main(argv):
+    props = properties.load('data/properties.txt')
+    parser = argparse.ArgumentParser(description='Best move queries for a trained Tetro AI.')
+    parser.add_argument('--weights', required=True, help='JSON file as produced by TetrisAI.to_dict')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5131)
+    parser.add_argument('--unix', dest='unix_path', default=None, help='use a Unix socket at this path')
+    parser.add_argument('--grid-width', type=int, default=props['grid_width'])
+    parser.add_argument('--grid-height', type=int, default=props['grid_height'])
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--stats-interval', type=float, default=10, help='seconds between latency reports, 0 to disable')
+    args = parser.parse_args(argv)
+
+    shapes = tetromino.load('data/shapes.txt', args.grid_width, args.grid_height)
+    with open(args.weights, 'r') as f:
+        ai = TetrisAI.from_dict(shapes, json.load(f))
+    server = EvaluationServer(ai, args.max_batch)
+    asyncio.run(server.serve(args.host, args.port, args.unix_path, args.stats_interval))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,303 @@
+"""Process pool evaluation backed by shared memory.
+
+The weights of the whole population, the fitness of each member and the final
+board of each game live in a single multiprocessing.shared_memory block. Worker
+processes attach to the block once when they start; after that a job is only
+the index of a population member and the seed of its game. Workers read the
+weights straight out of shared memory and write their results back into it, so
+no AI, game or result is ever pickled.
+
+Usage:
+    python sharedpool.py [--processes N] [--generations N] [--max-pieces N] [--seed N] [--stats PREFIX]
+        [--positions CORPUS] [--metric lines|pieces]
+
+With --positions every AI plays a short game from each position of a corpus,
+see positions.py, instead of a full game from the empty grid.
+"""
+
+import os
+import sys
+import time
+import queue
+import argparse
+import multiprocessing
+from array import array
+from random import Random
+from multiprocessing import shared_memory
+from ai import TetrisAI
+from features import FeatureSet, default_features
+import tetromino
+import properties
+import evolution
+import evaluation
+import stats
+import surrogate
+import positions
+import scheduler
+
+class SharedPopulation:
+    """Compact arrays of population weights and game results in shared memory.
+
+    Attributes:
+        weights: Flat array of doubles, the weights of member i are at
+            [i * num_weights, (i + 1) * num_weights).
+        lines_cleared: Lines cleared by the game of each member.
+        pieces_placed: Tetrominos placed in the game of each member.
+        boards: Final board of each member's game, grid_width * grid_height
+            bytes per member holding the tetromino id of each cell, column by
+            column.
+    """
+
+    def __init__(self, population_size, num_weights, grid_width, grid_height, name=None):
+        """Creates a new block, or attaches to an existing one if name is given."""
+
+        self.population_size = population_size
+        self.num_weights = num_weights
+        self.board_size = grid_width * grid_height
+        weights_size = population_size * num_weights * 8
+        results_size = population_size * 8
+        boards_size = population_size * self.board_size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True,
+                size=weights_size + 2 * results_size + boards_size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+
+        buf = self.shm.buf
+        offset = 0
+        self.weights = buf[offset:offset + weights_size].cast('d')
+        offset += weights_size
+        self.lines_cleared = buf[offset:offset + results_size].cast('q')
+        offset += results_size
+        self.pieces_placed = buf[offset:offset + results_size].cast('q')
+        offset += results_size
+        self.boards = buf[offset:offset + boards_size]
+
+    def member_weights(self, idx):
+        """Returns a view of the weights of a member, without copying them."""
+
+        return self.weights[idx * self.num_weights:(idx + 1) * self.num_weights]
+
+    def set_member_weights(self, idx, weights):
+        self.weights[idx * self.num_weights:(idx + 1) * self.num_weights] = array('d', weights)
+
+    def set_board(self, idx, grid):
+        start = idx * self.board_size
+        self.boards[start:start + self.board_size] = bytes([cell for col in grid for cell in col])
+
+    def close(self):
+        # views into the block must be released before it can be closed
+        for view in (self.weights, self.lines_cleared, self.pieces_placed, self.boards):
+            view.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+# state of each worker process, set up once by attach_worker
+worker_state = {}
+
+def attach_worker(name, population_size, shapes, feature_spec, distribution, max_pieces,
+    corpus=None, metric='lines', game_options=None):
+    feature_set = FeatureSet.get(feature_spec, shapes.grid_width, shapes.grid_height)
+    worker_state['population'] = SharedPopulation(population_size, feature_set.num_weights,
+        shapes.grid_width, shapes.grid_height, name)
+    worker_state['shapes'] = shapes
+    worker_state['feature_set'] = feature_set
+    worker_state['distribution'] = distribution
+    worker_state['max_pieces'] = max_pieces
+    worker_state['corpus'] = corpus
+    worker_state['metric'] = metric
+    worker_state['game_arguments'] = evaluation.game_arguments(game_options or evaluation.game_options({}))
+
+def evaluate_member(job):
+    idx, seed = job
+    population = worker_state['population']
+    # the AI reads its weights directly from shared memory
+    ai = TetrisAI(worker_state['shapes'], population.member_weights(idx), worker_state['feature_set'])
+    if worker_state['corpus'] is not None:
+        # the score over the corpus takes the place of the lines cleared
+        population.lines_cleared[idx], population.pieces_placed[idx] = positions.evaluate(ai,
+            worker_state['corpus'], worker_state['max_pieces'], worker_state['metric'], seed,
+            worker_state['distribution'], **worker_state['game_arguments'])
+        return
+    inst = evaluation.play_game(ai, seed, worker_state['max_pieces'],
+        distribution=worker_state['distribution'], **worker_state['game_arguments'])
+    population.lines_cleared[idx] = inst.lines_cleared
+    population.pieces_placed[idx] = inst.pieces_placed
+    population.set_board(idx, inst.grid)
+
+def run_worker(index, tasks, results, attach_args):
+    """Runs the jobs sent to one worker process until it is sent None."""
+
+    attach_worker(*attach_args)
+    while True:
+        job = tasks.get()
+        if job is None:
+            break
+        start_time = time.perf_counter()
+        evaluate_member(job)
+        results.put((index, job[0], time.perf_counter() - start_time))
+    worker_state['population'].close()
+
+class ParallelEvaluator:
+    """Evaluates a population on a pool of worker processes.
+
+    Jobs are scheduled longest predicted first with work stealing, see
+    scheduler.py. Each worker has a single job at a time, so a job is only
+    bound to a worker when it starts.
+
+    Attributes:
+        utilization: Fraction of the last evaluation each worker spent
+            playing games.
+        num_stolen: Number of jobs of the last evaluation that were stolen
+            from another worker, 0 until the durations can be predicted.
+    """
+
+    def __init__(self, shapes, feature_set, population_size, processes=None,
+        distribution='bag', max_pieces=None, corpus=None, metric='lines', game_options=None):
+        """
+        Args:
+            shapes: ShapeSet the games are played with.
+            feature_set: FeatureSet of the AIs.
+            population_size: Largest number of AIs evaluated at once.
+            processes: Number of worker processes, all cores if None.
+            distribution: Name of the tetromino distribution, see sequence.py.
+            max_pieces: Piece budget of each game, None for no limit.
+            corpus: Corpus of start positions to evaluate on instead of full
+                games, see positions.py. max_pieces is then the budget of the
+                game from each position.
+            metric: Name of the score of a game from a position in
+                positions.metrics.
+            game_options: How the games are played, see
+                evaluation.game_options. None for the defaults.
+        """
+
+        self.population = SharedPopulation(population_size, feature_set.num_weights,
+            shapes.grid_width, shapes.grid_height)
+        attach_args = (self.population.name, population_size, shapes, feature_set.spec,
+            distribution, max_pieces, corpus, metric, game_options)
+        self.tasks = [multiprocessing.Queue() for i in range(processes or os.cpu_count())]
+        self.results = multiprocessing.Queue()
+        self.workers = [multiprocessing.Process(target=run_worker, daemon=True,
+            args=(i, tasks, self.results, attach_args)) for i, tasks in enumerate(self.tasks)]
+        [worker.start() for worker in self.workers]
+        self.duration_model = scheduler.DurationModel()
+        self.utilization = [0.0] * len(self.workers)
+        self.num_stolen = 0
+
+    def evaluate(self, ais, seeds):
+        """Plays a game for every AI, the i-th AI plays with the i-th seed.
+
+        Returns:
+            A list of (lines cleared, AI index) tuples sorted from highest to
+            lowest score.
+        """
+
+        for i, ai in enumerate(ais):
+            self.population.set_member_weights(i, ai.weights)
+        jobs = scheduler.WorkStealingScheduler(len(self.workers), self.duration_model.fitted())
+        jobs.assign([(self.duration_model.predict(ai.expected_fitness), (i, seed))
+            for i, (ai, seed) in enumerate(zip(ais, seeds))])
+
+        start_time = time.perf_counter()
+        busy_seconds = [0.0] * len(self.workers)
+        num_running = 0
+        for worker in range(len(self.workers)):
+            job = jobs.next_job(worker)
+            if job is not None:
+                self.tasks[worker].put(job)
+                num_running += 1
+        while num_running > 0:
+            try:
+                worker, idx, seconds = self.results.get(timeout=1)
+            except queue.Empty:
+                if not all([process.is_alive() for process in self.workers]):
+                    raise RuntimeError('A worker process exited during evaluation')
+                continue
+            num_running -= 1
+            busy_seconds[worker] += seconds
+            # the fitness of the member, the score over the corpus in corpus mode
+            self.duration_model.record(self.population.lines_cleared[idx], seconds)
+            job = jobs.next_job(worker)
+            if job is not None:
+                self.tasks[worker].put(job)
+                num_running += 1
+        wall_seconds = time.perf_counter() - start_time
+        self.utilization = [busy / wall_seconds for busy in busy_seconds]
+        self.num_stolen = jobs.num_stolen
+
+        fitness_scores = [(self.population.lines_cleared[i], i) for i in range(len(ais))]
+        list.sort(fitness_scores, key=lambda elem: elem[0])
+        fitness_scores.reverse()
+        return fitness_scores
+
+    def close(self):
+        [tasks.put(None) for tasks in self.tasks]
+        [worker.join() for worker in self.workers]
+        self.population.close()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Headless training on a local process pool.')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes, all cores by default')
+    parser.add_argument('--generations', type=int, default=None)
+    parser.add_argument('--max-pieces', type=int, default=None, help='piece budget of each game')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--stats', default='data/stats', help='prefix of the statistics files')
+    parser.add_argument('--positions', default=None, help='corpus of start positions to evaluate on')
+    parser.add_argument('--metric', choices=list(positions.metrics), default='lines',
+        help='score of a game from a start position')
+    args = parser.parse_args(argv)
+    corpus = None
+    if args.positions is not None:
+        corpus = positions.Corpus.load(args.positions)
+        if args.max_pieces is None:
+            args.max_pieces = 200
+
+    props = properties.load('data/properties.txt')
+    shapes = tetromino.load('data/shapes.txt', props['grid_width'], props['grid_height'])
+    feature_set = FeatureSet.get(props.get('features', default_features), shapes.grid_width, shapes.grid_height)
+    population_size = props['population_size']
+    tetris_ais = [TetrisAI(shapes, feature_set=feature_set) for i in range(population_size)]
+    rng = Random(args.seed)
+    screen = surrogate.create_screen(props, feature_set.num_weights)
+    stats_exporter = stats.StatsExporter(args.stats)
+
+    evaluator = ParallelEvaluator(shapes, feature_set, population_size, args.processes,
+        props.get('piece_distribution', 'bag'), args.max_pieces, corpus, args.metric,
+        evaluation.game_options(props))
+    try:
+        generation = 0
+        while args.generations is None or generation < args.generations:
+            start_time = time.perf_counter()
+            seeds = [rng.getrandbits(32) for i in range(population_size)]
+            if corpus is not None:
+                # every AI sees the same tetrominos from each position
+                seeds = [seeds[0]] * population_size
+            fitness_scores = evaluator.evaluate(tetris_ais, seeds)
+            # with a corpus, the score of each AI is its metric summed over the positions
+            generation_stats = stats.GenerationStats(generation, feature_set.num_weights,
+                args.metric if corpus is not None else 'lines')
+            population = evaluator.population
+            for i, ai in enumerate(tetris_ais):
+                generation_stats.add(population.lines_cleared[i], ai.weights, population.pieces_placed[i])
+                # survivors were recorded in the generation they were bred
+                if screen is not None and not ai.survivor:
+                    screen.record(ai.weights, population.lines_cleared[i])
+            summary = generation_stats.summary(time.perf_counter() - start_time)
+            stats_exporter.write(summary)
+            print(f'\n----- Generation {generation} ({summary["seconds"]:.2f}s) -----')
+            print(stats.format_summary(summary))
+            print('Worker utilization: ' + ' '.join([f'{busy:.0%}' for busy in evaluator.utilization]) +
+                f' | {evaluator.num_stolen} jobs stolen')
+            print('Most cleared weights: ', tetris_ais[fitness_scores[0][1]].to_dict())
+            tetris_ais = evolution.breed(tetris_ais, fitness_scores, population_size,
+                props['selection_size'], props['mutate_rate'], screen)
+            generation += 1
+    finally:
+        evaluator.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
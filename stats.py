@@ -0,0 +1,265 @@
+"""Streaming statistics of training runs.
+
+GenerationStats aggregates the games of one generation as they finish, in
+memory that does not grow with the population size. StatsExporter appends the
+summary of every generation to a CSV file and a JSON lines file and rewrites a
+self-contained HTML report with charts of the run, so long runs can be
+followed without reading the console. Every run writes its own files, named
+after the time it started, so tools running side by side do not overwrite
+each other's statistics.
+"""
+
+import os
+import csv
+import json
+import math
+from collections import deque
+from datetime import datetime
+
+# summary fields in the order they are exported
+fields = ('generation', 'time', 'games', 'best', 'mean', 'median', 'p10', 'p90', 'p99',
+    'worst', 'weight_diversity', 'pieces', 'seconds', 'games_per_second', 'pieces_per_second', 'metric')
+
+# what the scores of a generation count, by the name of the metric, see
+# positions.metrics for games played from start positions
+metric_labels = {
+    'lines': 'Lines cleared',
+    'pieces': 'Pieces placed',
+}
+
+class Histogram:
+    """Approximate distribution of non-negative values in bounded memory.
+
+    Values below exact_limit are counted exactly after rounding down to an
+    integer, which covers small line counts. Larger values are counted in
+    buckets that are 1/buckets_per_octave of a power of two wide, so quantiles
+    are accurate to about 2%.
+    """
+
+    exact_limit = 64
+    buckets_per_octave = 32
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+
+    def add(self, value):
+        bucket = self.bucket(max(value, 0))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+
+    def bucket(self, value):
+        if value < self.exact_limit:
+            return int(value)
+        octaves = math.log2(value / self.exact_limit)
+        return self.exact_limit + int(octaves * self.buckets_per_octave)
+
+    def bucket_value(self, bucket):
+        if bucket < self.exact_limit:
+            return bucket
+        octaves = (bucket - self.exact_limit + 0.5) / self.buckets_per_octave
+        return self.exact_limit * 2 ** octaves
+
+    def quantile(self, q):
+        """Returns the value below which a fraction q of the values lie."""
+
+        if self.total == 0:
+            return 0
+        rank = q * (self.total - 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen > rank:
+                return self.bucket_value(bucket)
+        return self.bucket_value(max(self.counts))
+
+class GenerationStats:
+    """Rolling aggregates of the games of a single generation."""
+
+    def __init__(self, generation, num_weights=0, metric='lines'):
+        """
+        Args:
+            generation: Index of the generation.
+            num_weights: Number of weights of the AIs.
+            metric: Name of what the scores count, a key of metric_labels.
+        """
+
+        self.generation = generation
+        self.metric = metric
+        self.games = 0
+        self.total = 0
+        self.best = None
+        self.worst = None
+        self.pieces = 0
+        self.histogram = Histogram()
+        # running mean and sum of squared differences of each weight
+        self.weight_means = [0.0] * num_weights
+        self.weight_m2 = [0.0] * num_weights
+
+    def add(self, score, weights=None, pieces_placed=0):
+        """Adds the score of a finished game and the weights of its AI."""
+
+        self.games += 1
+        self.total += score
+        self.pieces += pieces_placed
+        if self.best is None or score > self.best:
+            self.best = score
+        if self.worst is None or score < self.worst:
+            self.worst = score
+        self.histogram.add(score)
+        if weights is not None:
+            for i, weight in enumerate(weights):
+                delta = weight - self.weight_means[i]
+                self.weight_means[i] += delta / self.games
+                self.weight_m2[i] += delta * (weight - self.weight_means[i])
+
+    def weight_diversity(self):
+        """Returns the standard deviation of each weight averaged over all weights."""
+
+        if self.games < 2 or len(self.weight_m2) == 0:
+            return 0.0
+        return sum([math.sqrt(m2 / (self.games - 1)) for m2 in self.weight_m2]) / len(self.weight_m2)
+
+    def summary(self, seconds=None):
+        """Returns the aggregates as a dictionary with the keys in fields.
+
+        Args:
+            seconds: Wall time taken by the generation, for throughput.
+        """
+
+        return {
+            'generation': self.generation,
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'games': self.games,
+            'best': self.best or 0,
+            'mean': self.total / self.games if self.games else 0.0,
+            'median': self.histogram.quantile(0.5),
+            'p10': self.histogram.quantile(0.1),
+            'p90': self.histogram.quantile(0.9),
+            'p99': self.histogram.quantile(0.99),
+            'worst': self.worst or 0,
+            'weight_diversity': self.weight_diversity(),
+            'pieces': self.pieces,
+            'seconds': seconds,
+            'games_per_second': self.games / seconds if seconds else None,
+            'pieces_per_second': self.pieces / seconds if seconds else None,
+            'metric': self.metric,
+        }
+
+def format_summary(summary):
+    """Returns a one line description of a generation summary."""
+
+    line = metric_labels[summary.get('metric', 'lines')] + (': best {best} | mean {mean:.2f} | median {median:.0f} | '
+        'p10 {p10:.0f} | p90 {p90:.0f} | worst {worst} | weight diversity {weight_diversity:.3f}').format(**summary)
+    if summary['seconds']:
+        line += ' | {pieces_per_second:.0f} pieces/s'.format(**summary)
+    return line
+
+def run_name():
+    """Returns a name for the files of a run started now by this process."""
+
+    return datetime.now().strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+
+class StatsExporter:
+    """Exports generation summaries to CSV, JSON lines and an HTML report.
+
+    Files are named after path_prefix and the run, such as
+    data/stats-20240101-120000-4242.csv.
+
+    The report is rebuilt after every generation, so it only keeps a bounded
+    series of summaries: every generation until max_chart_points are kept,
+    then every other one is dropped and only every second generation is kept
+    from then on, and so on. Writing a generation takes the same time however
+    long the run is.
+    """
+
+    # most points drawn per chart, longer runs are thinned out
+    max_chart_points = 1000
+    # generations listed in the table of the report
+    max_table_rows = 50
+
+    def __init__(self, path_prefix='data/stats', run=None):
+        """
+        Args:
+            path_prefix: Path of the files without the run and extension.
+            run: Name of the run in the file names, see run_name by default.
+        """
+
+        path_prefix += '-' + (run or run_name())
+        self.csv_path = path_prefix + '.csv'
+        self.jsonl_path = path_prefix + '.jsonl'
+        self.html_path = path_prefix + '.html'
+        self.num_generations = 0
+        # summaries of every stride-th generation, for the charts
+        self.chart_points = []
+        self.stride = 1
+        self.recent = deque(maxlen=self.max_table_rows)
+        with open(self.csv_path, 'w', newline='') as f:
+            csv.writer(f).writerow(fields)
+        open(self.jsonl_path, 'w').close()
+
+    def write(self, summary):
+        with open(self.csv_path, 'a', newline='') as f:
+            csv.writer(f).writerow([summary[field] for field in fields])
+        with open(self.jsonl_path, 'a') as f:
+            f.write(json.dumps(summary) + '\n')
+        if self.num_generations % self.stride == 0:
+            self.chart_points.append(summary)
+            if len(self.chart_points) > self.max_chart_points:
+                self.chart_points = self.chart_points[::2]
+                self.stride *= 2
+        self.num_generations += 1
+        self.recent.append(summary)
+        # write the report next to the old one and swap, so it is never seen half written
+        with open(self.html_path + '.tmp', 'w') as f:
+            f.write(render_report(self.chart_points, list(self.recent), self.num_generations))
+        os.replace(self.html_path + '.tmp', self.html_path)
+
+def render_chart(title, summaries, series, width=720, height=220):
+    """Returns an inline SVG line chart of some summary fields over generations."""
+
+    colors = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728')
+    values = [summary[name] or 0 for summary in summaries for name in series]
+    top = max(values + [1e-9])
+    count = max(len(summaries) - 1, 1)
+    svg = [f'<h2>{title}</h2>',
+        f'<svg width="{width}" height="{height + 20}" xmlns="http://www.w3.org/2000/svg">',
+        f'<rect width="{width}" height="{height}" fill="#fafafa" stroke="#ccc"/>',
+        f'<text x="4" y="12" font-size="11">{top:.4g}</text>']
+    for i, name in enumerate(series):
+        points = ' '.join([f'{j * width / count:.1f},{height - (summary[name] or 0) / top * height:.1f}'
+            for j, summary in enumerate(summaries)])
+        svg.append(f'<polyline fill="none" stroke="{colors[i % len(colors)]}" points="{points}"/>')
+        svg.append(f'<text x="{4 + i * 120}" y="{height + 15}" font-size="12" '
+            f'fill="{colors[i % len(colors)]}">{name}</text>')
+    svg.append('</svg>')
+    return '\n'.join(svg)
+
+def render_report(chart_points, recent, num_generations):
+    """Returns a self-contained HTML page of charts and a table of recent generations.
+
+    Args:
+        chart_points: Summaries drawn in the charts, oldest first.
+        recent: Summaries of the last generations, oldest first.
+        num_generations: Number of generations in the run.
+    """
+
+    points = list(chart_points)
+    if points[-1] is not recent[-1]:
+        points.append(recent[-1])
+    html = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>Tetro training run</title>',
+        '<style>body{font-family:sans-serif;margin:20px}table{border-collapse:collapse}'
+        'td,th{border:1px solid #ccc;padding:2px 6px;text-align:right}</style></head><body>',
+        f'<h1>Tetro training run</h1><p>{num_generations} generations, updated {recent[-1]["time"]}</p>',
+        render_chart(metric_labels[recent[-1].get('metric', 'lines')], points, ('best', 'p90', 'mean', 'median')),
+        render_chart('Weight diversity', points, ('weight_diversity',)),
+        render_chart('Throughput (pieces per second)', points, ('pieces_per_second',)),
+        '<h2>Recent generations</h2><table><tr>' + ''.join([f'<th>{field}</th>' for field in fields]) + '</tr>']
+    for summary in reversed(recent):
+        cells = []
+        for field in fields:
+            value = summary[field]
+            cells.append(f'<td>{value:.2f}</td>' if isinstance(value, float) else f'<td>{value}</td>')
+        html.append('<tr>' + ''.join(cells) + '</tr>')
+    html.append('</table></body></html>')
+    return '\n'.join(html) + '\n'
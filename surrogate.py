@@ -0,0 +1,148 @@
+"""Surrogate screening of children before they are evaluated.
+
+Breeding with a SurrogateScreen produces several candidate children for every
+child slot of the next generation. Each candidate is scored by a ridge
+regression model fitted on the weights and fitness of every AI evaluated so
+far, plus a short probe game with a fixed seed, and only the most promising
+candidates go on to play full games. The model is kept as running sums, so its
+memory does not grow with the number of AIs recorded. The probe game is played
+with the same hold, preview and search as the games fitness is measured with,
+otherwise it would rank children by how well they play a different game.
+"""
+
+import math
+import evaluation
+
+def solve(matrix, vector):
+    """Solves matrix * x = vector by Gaussian elimination with partial pivoting.
+
+    The arguments are left unchanged.
+    """
+
+    size = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(size)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda row: abs(rows[row][col]))
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        if rows[col][col] == 0:
+            continue
+        for row in range(col + 1, size):
+            factor = rows[row][col] / rows[col][col]
+            if factor != 0:
+                for i in range(col, size + 1):
+                    rows[row][i] -= factor * rows[col][i]
+    solution = [0.0] * size
+    for row in reversed(range(size)):
+        if rows[row][row] == 0:
+            continue
+        total = rows[row][size] - sum([rows[row][i] * solution[i] for i in range(row + 1, size)])
+        solution[row] = total / rows[row][row]
+    return solution
+
+class RidgeModel:
+    """Ridge regression on the weights of an AI and their squares."""
+
+    def __init__(self, num_weights, ridge=1.0):
+        self.ridge = ridge
+        self.num_inputs = 2 * num_weights + 1
+        # running sums of inputs times inputs and inputs times targets
+        self.xtx = [[0.0] * self.num_inputs for i in range(self.num_inputs)]
+        self.xty = [0.0] * self.num_inputs
+        self.num_records = 0
+        self.coefficients = None
+
+    def inputs(self, weights):
+        return [1.0] + list(weights) + [weight * weight for weight in weights]
+
+    def add(self, weights, target):
+        x = self.inputs(weights)
+        for i in range(self.num_inputs):
+            row = self.xtx[i]
+            for j in range(self.num_inputs):
+                row[j] += x[i] * x[j]
+            self.xty[i] += x[i] * target
+        self.num_records += 1
+        self.coefficients = None
+
+    def predict(self, weights):
+        if self.coefficients is None:
+            matrix = [list(row) for row in self.xtx]
+            # the intercept is not penalized
+            for i in range(1, self.num_inputs):
+                matrix[i][i] += self.ridge
+            self.coefficients = solve(matrix, self.xty)
+        return sum([c * x for c, x in zip(self.coefficients, self.inputs(weights))])
+
+class SurrogateScreen:
+    """Picks the most promising children out of a larger set of candidates."""
+
+    def __init__(self, num_weights, candidates_per_child=3, probe_pieces=100, probe_seed=0,
+        min_records=100, ridge=1.0, distribution='bag', game_options=None):
+        """
+        Args:
+            num_weights: Number of weights of the AIs.
+            candidates_per_child: Candidates bred for every child slot.
+            probe_pieces: Piece budget of the probe game, 0 for no probe.
+            probe_seed: Seed of the probe game, the same for every candidate.
+            min_records: AIs that must have been recorded before screening
+                starts, until then every candidate is kept.
+            ridge: Regularization strength of the model.
+            distribution: Tetromino distribution of the probe game.
+            game_options: How the probe game is played, see
+                evaluation.game_options. None for the defaults.
+        """
+
+        self.model = RidgeModel(num_weights, ridge)
+        self.candidates_per_child = candidates_per_child
+        self.probe_pieces = probe_pieces
+        self.probe_seed = probe_seed
+        self.min_records = min_records
+        self.distribution = distribution
+        self.game_arguments = evaluation.game_arguments(game_options or evaluation.game_options({}))
+        # totals for reporting
+        self.num_screened = 0
+        self.num_rejected = 0
+
+    def ready(self):
+        return self.model.num_records >= self.min_records
+
+    def record(self, weights, lines_cleared):
+        """Records the fitness of a fully evaluated AI."""
+
+        # fitness spans orders of magnitude, fit its logarithm instead
+        self.model.add(weights, math.log1p(lines_cleared))
+
+    def num_candidates(self, num_children):
+        return num_children * self.candidates_per_child if self.ready() else num_children
+
+    def score(self, ai):
+        """Returns the predicted log fitness of an AI plus the log of the lines
+        it clears in the probe game."""
+
+        score = self.model.predict(ai.weights)
+        if self.probe_pieces > 0:
+            inst = evaluation.play_game(ai, self.probe_seed, self.probe_pieces, distribution=self.distribution,
+                **self.game_arguments)
+            score += math.log1p(inst.lines_cleared)
+        return score
+
+    def select(self, candidates, num_children):
+        """Returns the num_children most promising candidates."""
+
+        if not self.ready() or len(candidates) <= num_children:
+            return candidates[:num_children]
+        scores = [(self.score(ai), i) for i, ai in enumerate(candidates)]
+        list.sort(scores, key=lambda elem: elem[0])
+        scores.reverse()
+        self.num_screened += len(candidates)
+        self.num_rejected += len(candidates) - num_children
+        return [candidates[i] for score, i in scores[:num_children]]
+
+def create_screen(props, num_weights):
+    """Returns the SurrogateScreen set up by the properties of a training run,
+    None if screening is disabled."""
+
+    if props.get('surrogate_candidates', 1) <= 1:
+        return None
+    return SurrogateScreen(num_weights, props['surrogate_candidates'], props.get('surrogate_probe_pieces', 100),
+        distribution=props.get('piece_distribution', 'bag'), game_options=evaluation.game_options(props))
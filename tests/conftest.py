@@ -0,0 +1,18 @@
+import os
+import sys
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+import tetromino
+
+shapes_path = os.path.join(repo_dir, 'data', 'shapes.txt')
+
+# weights of the default features that survive long games on a 10 wide grid
+good_weights = [0.69, 0.55, 0.41, 0.40, 0.31, 0.09, 0.01, 0.23, 0.34, 0.82, 1.48,
+    1.34, 1.90, 1.72, 2.08, 2.65, 0.12, 0.29, 0.38, 0.62, 0.86]
+
+@pytest.fixture(scope='session')
+def shapes():
+    return tetromino.load(shapes_path, 10, 20)
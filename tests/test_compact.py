@@ -0,0 +1,64 @@
+from collections import Counter
+from ai import TetrisAI
+from tetris import Tetris, lock_tetromino
+from compact import CompactGame
+from conftest import good_weights
+
+def test_placements_match_tetris(shapes):
+    """A compact game ends up with the same board as a Tetris grid given the same placements."""
+
+    ai = TetrisAI(shapes, list(good_weights))
+    game = CompactGame(shapes, 0, seed=9)
+    grid = [[0] * shapes.grid_height for x in range(shapes.grid_width)]
+    lines_cleared = 0
+    while not game.lost and game.pieces_placed < 400:
+        game.next_move = ai.compute_move(game)
+        move = game.next_move
+        placed = game.pieces_placed
+        while game.pieces_placed == placed and not game.lost:
+            game.update()
+        lines_cleared += lock_tetromino(grid, move)
+        assert [[cell != 0 for cell in col] for col in game.grid] == [[cell != 0 for cell in col] for col in grid]
+        assert game.lines_cleared == lines_cleared
+    assert game.pieces_placed == 400
+    assert lines_cleared > 0
+
+def test_moves_match_tetris(shapes):
+    """An AI chooses the same moves for a compact game as for a Tetris game in the same state."""
+
+    ai = TetrisAI(shapes, list(good_weights))
+    game = CompactGame(shapes, 0, seed=4)
+    inst = Tetris(shapes, 0)
+    for i in range(200):
+        inst.grid = game.grid
+        inst.current_tmino = game.current_tmino
+        inst.next_id = game.next_id
+        move = ai.compute_move(game)
+        expected = ai.compute_move(inst)
+        assert (move.id, move.rotation, move.x_pos, move.y_pos) == \
+            (expected.id, expected.rotation, expected.x_pos, expected.y_pos)
+        game.next_move = move
+        placed = game.pieces_placed
+        while game.pieces_placed == placed:
+            game.update()
+
+def test_bag_deals_every_tetromino_once(shapes):
+    game = CompactGame(shapes, 0, seed=1)
+    ids = [game.current_id, game.next_id] + [game.draw() for i in range(7 * shapes.unique_types - 2)]
+    for start in range(0, len(ids), shapes.unique_types):
+        assert sorted(ids[start:start + shapes.unique_types]) == list(range(1, shapes.unique_types + 1))
+
+def test_uniform_draws_every_tetromino(shapes):
+    game = CompactGame(shapes, 0, seed=2, distribution='uniform')
+    counts = Counter([game.draw() for i in range(7000)])
+    assert sorted(counts) == list(range(1, shapes.unique_types + 1))
+
+def test_seed_reproduces_the_game(shapes):
+    ai = TetrisAI(shapes, list(good_weights))
+    games = [CompactGame(shapes, 0, seed=3) for i in range(2)]
+    for game in games:
+        while not game.lost and game.pieces_placed < 100:
+            game.next_move = ai.compute_move(game)
+            game.update()
+    assert games[0].board == games[1].board
+    assert games[0].lines_cleared == games[1].lines_cleared
@@ -0,0 +1,92 @@
+import threading
+import pytest
+from conftest import repo_dir
+import distributed
+
+props = {
+    'grid_width': 10,
+    'grid_height': 20,
+    'population_size': 6,
+    'selection_size': 3,
+    'mutate_rate': 0.04,
+}
+
+@pytest.fixture
+def coordinator(tmp_path, monkeypatch):
+    # the coordinator and its workers load data/shapes.txt relative to the repository
+    monkeypatch.chdir(repo_dir)
+    coordinator = distributed.Coordinator(props, unix_path=str(tmp_path / 'coordinator.sock'), max_pieces=20,
+        seed=1, stats_prefix=str(tmp_path / 'stats'), worker_timeout=5)
+    yield coordinator
+    coordinator.running = False
+    coordinator.server.close()
+
+def start(target, *args):
+    """Runs a function on a thread, keeping the exception it raised."""
+
+    outcome = {}
+
+    def run():
+        try:
+            target(*args)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, outcome
+
+def connect(coordinator):
+    sock, address = distributed.create_socket(None, None, coordinator.address)
+    sock.settimeout(10)
+    sock.connect(address)
+    return sock
+
+def finish_with_worker(coordinator, thread, outcome):
+    worker, worker_outcome = start(distributed.run_worker, None, None, coordinator.address)
+    thread.join(timeout=60)
+    worker.join(timeout=10)
+    assert not thread.is_alive()
+    assert 'error' not in outcome and 'error' not in worker_outcome
+    assert coordinator.generation == 1
+    assert sorted(coordinator.results) == list(range(props['population_size']))
+
+def test_job_of_a_disconnected_worker_is_requeued(coordinator):
+    thread, outcome = start(coordinator.run, 1)
+    with connect(coordinator) as sock:
+        job = distributed.recv_message(sock)
+        assert job['type'] == 'job'
+    # the job was taken and never answered, another worker has to play it
+    finish_with_worker(coordinator, thread, outcome)
+    assert coordinator.results[job['job_id']]['pieces_placed'] > 0
+
+# messages a worker could send instead of the result of a job
+malformed_results = {
+    'missing key': lambda job: {'type': 'result', 'job_id': job['job_id'], 'lines_cleared': 0, 'seconds': 0.1},
+    'other job': lambda job: {'type': 'result', 'job_id': job['job_id'] + 1, 'lines_cleared': 0,
+        'pieces_placed': 1, 'seconds': 0.1},
+    'wrong type': lambda job: {'type': 'result', 'job_id': job['job_id'], 'lines_cleared': '0',
+        'pieces_placed': 1, 'seconds': 0.1},
+    'not an object': lambda job: ['result', job['job_id']],
+}
+
+@pytest.mark.parametrize('kind', list(malformed_results))
+def test_malformed_result_drops_the_worker(coordinator, kind):
+    thread, outcome = start(coordinator.run, 1)
+    with connect(coordinator) as sock:
+        job = distributed.recv_message(sock)
+        distributed.send_message(sock, malformed_results[kind](job))
+        # the coordinator closes the connection instead of crashing its handler
+        with pytest.raises(ConnectionError):
+            distributed.recv_message(sock)
+    assert job['job_id'] not in coordinator.results
+    finish_with_worker(coordinator, thread, outcome)
+
+def test_coordinator_gives_up_without_workers(coordinator):
+    coordinator.worker_timeout = 0.5
+    thread, outcome = start(coordinator.run, 1)
+    with connect(coordinator) as sock:
+        distributed.recv_message(sock)
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert isinstance(outcome.get('error'), RuntimeError)
@@ -0,0 +1,56 @@
+from random import Random
+import pytest
+from ai import TetrisAI
+from tetromino import Tetromino
+from features import FeatureSet, features, default_features
+from positions import generators
+
+def boolean_grids(seed, count):
+    rng = Random(seed)
+    grids = [[[False] * 20 for x in range(10)]]
+    for i in range(count):
+        kind = list(generators)[i % len(generators)]
+        grids.append([[cell != 0 for cell in col] for col in generators[kind](rng, 10, 20)])
+    # a stack reaching the top, where drops may end up under an overhang
+    tall = [[y > 1 for y in range(20)] for x in range(10)]
+    tall[4] = [False] * 20
+    tall[5][0] = True
+    grids.append(tall)
+    return grids
+
+def random_ai(shapes, spec, seed):
+    feature_set = FeatureSet.get(spec, shapes.grid_width, shapes.grid_height)
+    rng = Random(seed)
+    return TetrisAI(shapes, [rng.uniform(-1, 1) for i in range(feature_set.num_weights)], feature_set)
+
+@pytest.mark.parametrize('spec', [(name,) for name in features] + [default_features])
+def test_delta_scores_match_full_evaluation(shapes, spec):
+    ai = random_ai(shapes, spec, 1)
+    assert ai.incremental
+    for grid in boolean_grids(2, 12):
+        for id in range(1, shapes.unique_types + 1):
+            for score, exact, move in ai.score_placements(grid, id):
+                tmino = Tetromino(shapes, id, *move)
+                ai.add_to_grid(grid, tmino)
+                full_score = ai.compute_score(grid, tmino)
+                ai.remove_from_grid(grid, tmino)
+                assert score == pytest.approx(full_score, rel=1e-9, abs=1e-9)
+
+@pytest.mark.parametrize('spec', [(name,) for name in features] + [default_features])
+def test_incremental_search_picks_the_same_move(shapes, spec):
+    ai = random_ai(shapes, spec, 3)
+    full = random_ai(shapes, spec, 3)
+    full.incremental = False
+    for grid in boolean_grids(4, 12):
+        for id in range(1, shapes.unique_types + 1):
+            score, tmino = ai.best_placement(grid, id)
+            full_score, full_tmino = full.best_placement(grid, id)
+            assert score == full_score
+            assert (tmino.rotation, tmino.x_pos, tmino.y_pos) == (full_tmino.rotation, full_tmino.x_pos, full_tmino.y_pos)
+
+def test_placements_are_the_same_as_the_full_search(shapes):
+    ai = random_ai(shapes, default_features, 5)
+    for grid in boolean_grids(6, 6):
+        for id in range(1, shapes.unique_types + 1):
+            moves = [move for score, exact, move in ai.score_placements(grid, id)]
+            assert moves == ai.compute_moves_available(grid, Tetromino(shapes, id))
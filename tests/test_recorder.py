@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+import pytest
+from ai import TetrisAI
+from tetris import Tetris
+from recorder import GameRecorder, Replay, max_grid_width
+from positions import Corpus
+from conftest import shapes_path, good_weights
+
+def play_recorded(shapes, file_path, seed, max_pieces, keyframe_interval, start_grid=None):
+    """Plays a recorded game like evaluation.play_game, returning the grid,
+    lines cleared and next id before every placement, and after the last."""
+
+    ai = TetrisAI(shapes, list(good_weights))
+    inst = Tetris(shapes, 0, seed, start_grid=start_grid)
+    inst.recorder = GameRecorder(file_path, inst, keyframe_interval)
+    states = [([list(col) for col in inst.grid], inst.lines_cleared, inst.next_id)]
+    while not inst.lost and inst.pieces_placed < max_pieces:
+        placed = inst.pieces_placed
+        inst.update()
+        if inst.pieces_placed != placed:
+            states.append(([list(col) for col in inst.grid], inst.lines_cleared, inst.next_id))
+        if inst.lost:
+            break
+        inst.next_move = ai.compute_move(inst)
+    inst.recorder.close()
+    return states
+
+def test_boards_round_trip(shapes, tmp_path):
+    file_path = str(tmp_path / 'game.ttro')
+    states = play_recorded(shapes, file_path, 7, 300, 16)
+    replay = Replay(file_path, shapes_path)
+    assert replay.num_moves == len(states) - 1
+    assert replay.seed == 7
+    for idx, (grid, lines_cleared, next_id) in enumerate(states):
+        assert replay.board_at(idx) == (grid, lines_cleared)
+
+def test_load_into_shows_the_next_tetromino(shapes, tmp_path):
+    file_path = str(tmp_path / 'game.ttro')
+    states = play_recorded(shapes, file_path, 11, 100, 16)
+    replay = Replay(file_path, shapes_path)
+    inst = Tetris(replay.shapes, 0, replay.seed)
+    for idx in range(replay.num_moves - 1):
+        replay.load_into(inst, idx)
+        # the next tetromino at a placement is the one placed after it
+        assert inst.next_id == states[idx][2]
+        assert inst.next_id == replay.move(idx + 1)[0]
+    replay.load_into(inst, replay.num_moves - 1)
+    assert inst.next_id is None
+    replay.load_into(inst, replay.num_moves)
+    assert inst.lost and inst.next_id is None
+
+def test_unknown_cells_round_trip(shapes, tmp_path):
+    corpus = Corpus(10, 20)
+    corpus.generate(1, seed=3, kinds=['garbage'])
+    file_path = str(tmp_path / 'position.ttro')
+    states = play_recorded(shapes, file_path, 5, 40, 8, corpus.grid(0))
+    replay = Replay(file_path, shapes_path)
+    assert replay.board_at(0)[0] == corpus.grid(0)
+    assert replay.board_at(replay.num_moves) == states[-1][:2]
+
+def test_games_with_hold_or_preview_are_refused(shapes, tmp_path):
+    for hold, preview_size in ((True, 1), (False, 3)):
+        inst = Tetris(shapes, 0, 1, hold=hold, preview_size=preview_size)
+        with pytest.raises(ValueError):
+            GameRecorder(str(tmp_path / 'game.ttro'), inst)
+    assert not (tmp_path / 'game.ttro').exists()
+
+def test_wide_grids_are_refused(tmp_path):
+    inst = SimpleNamespace(hold_enabled=False, preview=[1], grid_width=max_grid_width + 1, grid_height=20, seed=0)
+    with pytest.raises(ValueError):
+        GameRecorder(str(tmp_path / 'game.ttro'), inst)
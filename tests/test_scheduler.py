@@ -0,0 +1,72 @@
+import pytest
+from scheduler import DurationModel, WorkStealingScheduler
+
+def drain(jobs, worker):
+    taken = []
+    job = jobs.next_job(worker)
+    while job is not None:
+        taken.append(job)
+        job = jobs.next_job(worker)
+    return taken
+
+def test_jobs_are_dealt_longest_first():
+    jobs = WorkStealingScheduler(2)
+    jobs.assign([(1.0, 'a'), (5.0, 'b'), (3.0, 'c'), (4.0, 'd'), (2.0, 'e')])
+    # each job goes to the worker with the least predicted work so far
+    assert [job for predicted, job in jobs.queues[0]] == ['b', 'e', 'a']
+    assert [job for predicted, job in jobs.queues[1]] == ['d', 'c']
+    assert jobs.loads == [8.0, 7.0]
+    # queues stay longest first, and so are stolen longest first
+    assert drain(jobs, 0) == ['b', 'e', 'a', 'd', 'c']
+
+def test_idle_worker_steals_from_the_most_loaded():
+    jobs = WorkStealingScheduler(3)
+    jobs.assign([(10.0, 'long'), (3.0, 'a'), (3.0, 'b'), (2.0, 'c'), (1.0, 'd')])
+    assert jobs.next_job(1) == 'a'
+    assert jobs.next_job(1) == 'c'
+    assert jobs.num_stolen == 0
+    # worker 2 still has 4 seconds queued, worker 0 has 10
+    assert jobs.next_job(1) == 'long'
+    assert jobs.num_stolen == 1
+    assert jobs.loads == [0.0, 0.0, 4.0]
+    assert drain(jobs, 0) == ['b', 'd']
+    assert jobs.num_stolen == 3
+
+def test_requeued_job_is_next():
+    jobs = WorkStealingScheduler(1)
+    jobs.assign([(2.0, 'a'), (1.0, 'b')])
+    assert jobs.next_job(0) == 'a'
+    jobs.requeue(0, 2.0, 'a')
+    assert jobs.loads == [3.0]
+    assert drain(jobs, 0) == ['a', 'b']
+
+def test_steals_are_not_counted_before_the_model_is_fitted():
+    model = DurationModel()
+    jobs = WorkStealingScheduler(4, model.fitted())
+    jobs.assign([(model.predict(), i) for i in range(20)])
+    assert sorted(drain(jobs, 0)) == list(range(20))
+    assert jobs.num_stolen == 0
+
+def test_model_predicts_by_expected_fitness_until_fitted():
+    model = DurationModel()
+    assert not model.fitted()
+    assert model.predict(30) > model.predict(20)
+    model.record(100, 2.0)
+    assert not model.fitted()
+    assert model.predict(300) > model.predict(200)
+
+def test_model_fits_seconds_to_fitness():
+    model = DurationModel()
+    for fitness in range(0, 1000, 100):
+        model.record(fitness, 0.5 + fitness * 0.01)
+    assert model.fitted()
+    assert model.predict(2000) == pytest.approx(20.5)
+    # an AI without parents is predicted to take an average game
+    assert model.predict() == pytest.approx(5.0)
+    assert model.predict(-1000) == 0.0
+
+def test_model_without_spread_predicts_the_mean():
+    model = DurationModel()
+    model.record(50, 1.0)
+    model.record(50, 3.0)
+    assert model.predict(500) == pytest.approx(2.0)
@@ -0,0 +1,51 @@
+from ai import TetrisAI
+from tetris import Tetris
+from search import BoundedSearch
+from conftest import good_weights
+
+def play(shapes, search, max_pieces, hold=False, preview_size=1, seed=6):
+    """Plays a game with a search, yielding the game before every move."""
+
+    ai = TetrisAI(shapes, list(good_weights))
+    inst = Tetris(shapes, 0, seed, hold=hold, preview_size=preview_size)
+    while not inst.lost and inst.pieces_placed < max_pieces:
+        inst.update()
+        if inst.lost:
+            break
+        yield ai, inst
+        inst.next_move = ai.compute_move(inst, search)
+
+def test_search_stays_within_its_node_budget(shapes):
+    search = BoundedSearch(max_nodes=400, beam_width=4)
+    depths = set()
+    for ai, inst in play(shapes, search, 150, hold=True, preview_size=5):
+        search.best_move(ai, inst)
+        # the first ply is always searched, whatever the budget
+        assert search.nodes <= 400 or search.depth == 1
+        depths.add(search.depth)
+    assert max(depths) > 1
+
+def test_larger_budgets_search_deeper(shapes):
+    small = BoundedSearch(max_nodes=200, beam_width=4)
+    large = BoundedSearch(max_nodes=5000, beam_width=4)
+    for ai, inst in play(shapes, small, 40, hold=True, preview_size=5):
+        small.best_move(ai, inst)
+        large.best_move(ai, inst)
+        assert large.depth >= small.depth
+        assert large.nodes >= small.nodes
+
+def test_first_ply_only_is_the_greedy_move(shapes):
+    search = BoundedSearch(max_nodes=1, beam_width=4)
+    for ai, inst in play(shapes, search, 100, preview_size=3):
+        move = search.best_move(ai, inst)
+        assert search.depth == 1
+        expected = ai.compute_move(inst)
+        assert (move.id, move.rotation, move.x_pos, move.y_pos) == \
+            (expected.id, expected.rotation, expected.x_pos, expected.y_pos)
+
+def test_hold_game_survives(shapes):
+    search = BoundedSearch(max_nodes=2000)
+    for ai, inst in play(shapes, search, 300, hold=True, preview_size=3):
+        pass
+    assert not inst.lost
+    assert inst.pieces_placed == 300
@@ -0,0 +1,147 @@
+import os
+import time
+import socket
+import asyncio
+import threading
+from random import Random
+import pytest
+from ai import TetrisAI
+from positions import generators, clear_full_rows
+from conftest import good_weights
+import server
+
+@pytest.fixture
+def evaluation_server(shapes):
+    return server.EvaluationServer(TetrisAI(shapes, list(good_weights)), max_batch=4)
+
+@pytest.fixture
+def server_path(evaluation_server, tmp_path):
+    """Runs the server on a Unix socket on its own event loop thread."""
+
+    path = str(tmp_path / 'server.sock')
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(evaluation_server.serve(unix_path=path, stats_interval=0))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        pending = asyncio.all_tasks(loop)
+        [pending_task.cancel() for pending_task in pending]
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    deadline = time.time() + 5
+    while not os.path.exists(path):
+        assert time.time() < deadline, 'server did not start'
+        time.sleep(0.01)
+    yield path
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(timeout=5)
+
+def boards(seed, count, grid_width=10, grid_height=20):
+    rng = Random(seed)
+    grids = []
+    for i in range(count):
+        grid = generators[list(generators)[i % len(generators)]](rng, grid_width, grid_height)
+        clear_full_rows(rng, grid)
+        grids.append(grid)
+    return grids
+
+def connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(10)
+    sock.connect(path)
+    return sock
+
+def read_responses(sock, count=None):
+    """Reads count responses, or every response until the server closes the connection."""
+
+    data = b''
+    while count is None or len(data) < count * server.response_format.size:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    size = server.response_format.size
+    assert len(data) % size == 0
+    return [server.decode_response(data[i:i + size]) for i in range(0, len(data), size)]
+
+def test_board_round_trip_on_a_non_square_grid():
+    grid_width, grid_height = 7, 13
+    grid = [[cell != 0 for cell in col] for col in boards(1, 1, grid_width, grid_height)[0]]
+    grid[6][0] = True
+    data = server.encode_request(42, grid, 3, 5, lookahead=True)
+    request = server.request_header.unpack_from(data)
+    assert request == (42, server.flag_lookahead, grid_width, grid_height, 3, 5)
+    board = data[server.request_header.size:]
+    assert len(board) == server.board_size(grid_width, grid_height)
+    assert server.decode_board(board, grid_width, grid_height) == grid
+
+def test_response_positions_beyond_a_byte_round_trip():
+    # grids may be up to 255 cells wide and tetrominos stick out past the edges
+    response = (9, server.status_ok, 3, 254, -3, 12.5)
+    assert server.decode_response(server.response_format.pack(*response)) == response
+
+@pytest.mark.parametrize('request_fields', [
+    (1, 0, 12, 20, 1, 0),
+    (2, 0, 10, 21, 1, 0),
+    (3, 0, 10, 20, 0, 0),
+    (4, 0, 10, 20, 8, 0),
+    (5, 0, 10, 20, 1, 8),
+])
+def test_bad_requests_are_answered_as_such(evaluation_server, request_fields):
+    board = bytes(server.board_size(request_fields[2], request_fields[3]))
+    response = server.decode_response(evaluation_server.evaluate(request_fields, board))
+    assert response[:2] == (request_fields[0], server.status_bad_request)
+
+def test_a_failing_request_does_not_fail_its_batch(evaluation_server, monkeypatch):
+    evaluate = evaluation_server.evaluate
+
+    def fail_second(request, board):
+        if request[0] == 2:
+            raise RuntimeError('evaluation failed')
+        return evaluate(request, board)
+
+    monkeypatch.setattr(evaluation_server, 'evaluate', fail_second)
+    batch = []
+    for request_id, grid in enumerate(boards(2, 3)):
+        data = server.encode_request(request_id + 1, grid, 1)
+        batch.append((server.request_header.unpack_from(data), data[server.request_header.size:], None, 0, None))
+    statuses = [server.decode_response(response)[:2] for response in evaluation_server.evaluate_batch(batch)]
+    assert statuses == [(1, server.status_ok), (2, server.status_bad_request), (3, server.status_ok)]
+
+def expected_responses(evaluation_server, requests):
+    return {request_id: server.decode_response(evaluation_server.evaluate(
+        server.request_header.unpack_from(data), data[server.request_header.size:]))
+        for request_id, data in requests}
+
+def pipelined_requests(count):
+    requests = []
+    for i, grid in enumerate(boards(3, count)):
+        requests.append((1000 + i, server.encode_request(1000 + i, grid, 1 + i % 7, 1 + (i + 3) % 7, i % 2 == 0)))
+    # a bad request in the middle of the stream is answered like the others
+    requests.insert(count // 2, (7, server.encode_request(7, [[False] * 20 for x in range(10)], 9)))
+    return requests
+
+def test_pipelined_requests_are_matched_by_id(evaluation_server, server_path):
+    requests = pipelined_requests(20)
+    expected = expected_responses(evaluation_server, requests)
+    with connect(server_path) as sock:
+        sock.sendall(b''.join([data for request_id, data in requests]))
+        responses = read_responses(sock, len(requests))
+    assert {response[0]: response for response in responses} == expected
+    assert expected[7][1] == server.status_bad_request
+
+def test_half_closed_connection_gets_every_response(evaluation_server, server_path):
+    requests = pipelined_requests(30)
+    expected = expected_responses(evaluation_server, requests)
+    with connect(server_path) as sock:
+        sock.sendall(b''.join([data for request_id, data in requests]))
+        sock.shutdown(socket.SHUT_WR)
+        responses = read_responses(sock)
+    assert len(responses) == len(requests)
+    assert {response[0]: response for response in responses} == expected
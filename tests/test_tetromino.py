@@ -0,0 +1,115 @@
+import os
+import shutil
+import pickle
+import hashlib
+import pytest
+from conftest import shapes_path
+import tetromino
+
+@pytest.fixture
+def shapes_file(tmp_path):
+    path = str(tmp_path / 'shapes.txt')
+    shutil.copy(shapes_path, path)
+    return path
+
+def cache_path(path, grid_width=10, grid_height=20):
+    return f'{path}.{grid_width}x{grid_height}.cache'
+
+def test_cache_loads_the_parsed_shapes(shapes_file):
+    parsed = tetromino.load(shapes_file, 10, 20, use_cache=False)
+    assert not os.path.exists(cache_path(shapes_file))
+    tetromino.load(shapes_file, 10, 20)
+    assert os.path.exists(cache_path(shapes_file))
+    assert tetromino.load(shapes_file, 10, 20).fields() == parsed.fields()
+
+def test_cache_is_rebuilt_when_the_shapes_change(shapes_file):
+    shapes = tetromino.load(shapes_file, 10, 20)
+    with open(shapes_file) as f:
+        source = f.read()
+    # drop the last tetromino from the file
+    with open(shapes_file, 'w') as f:
+        f.write(source[:source.rstrip().rindex('\n\n')] + '\n')
+    changed = tetromino.load(shapes_file, 10, 20)
+    assert changed.unique_types == shapes.unique_types - 1
+    assert tetromino.load(shapes_file, 10, 20).fields() == changed.fields()
+
+def test_each_grid_size_has_its_own_cache(shapes_file):
+    small = tetromino.load(shapes_file, 6, 12)
+    large = tetromino.load(shapes_file, 12, 24)
+    assert (small.grid_width, small.grid_height) == (6, 12)
+    assert (large.grid_width, large.grid_height) == (12, 24)
+    assert os.path.exists(cache_path(shapes_file, 6, 12))
+    assert os.path.exists(cache_path(shapes_file, 12, 24))
+    # a cache renamed to another grid size is not taken for it
+    os.replace(cache_path(shapes_file, 6, 12), cache_path(shapes_file, 12, 24))
+    assert tetromino.load(shapes_file, 12, 24).fields() == large.fields()
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'TTRC',
+    b'not a cache at all' * 10,
+])
+def test_unreadable_cache_is_rebuilt(shapes_file, data):
+    expected = tetromino.load(shapes_file, 10, 20, use_cache=False)
+    with open(cache_path(shapes_file), 'wb') as f:
+        f.write(data)
+    assert tetromino.load(shapes_file, 10, 20).fields() == expected.fields()
+    assert tetromino.load(shapes_file, 10, 20).fields() == expected.fields()
+
+def test_truncated_cache_is_rebuilt(shapes_file):
+    expected = tetromino.load(shapes_file, 10, 20)
+    with open(cache_path(shapes_file), 'rb') as f:
+        data = f.read()
+    with open(cache_path(shapes_file), 'wb') as f:
+        f.write(data[:len(data) // 2])
+    assert tetromino.load(shapes_file, 10, 20).fields() == expected.fields()
+
+def test_pickled_cache_is_never_unpickled(shapes_file, monkeypatch):
+    shapes = tetromino.load(shapes_file, 10, 20, use_cache=False)
+    with open(shapes_file, 'rb') as f:
+        digest = hashlib.sha256(f.read()).digest()
+    with open(cache_path(shapes_file), 'wb') as f:
+        f.write(tetromino.cache_header.pack(tetromino.cache_magic, tetromino.cache_version, digest, 10, 20))
+        f.write(pickle.dumps(shapes.fields()))
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the cache was unpickled')
+
+    monkeypatch.setattr(pickle, 'loads', fail)
+    monkeypatch.setattr(pickle, 'load', fail)
+    assert tetromino.load(shapes_file, 10, 20).fields() == shapes.fields()
+
+def test_cache_is_written_atomically(shapes_file, monkeypatch):
+    replace = os.replace
+    replaced = []
+
+    def check_replace(source, destination):
+        # the cache only appears once it is complete
+        assert not os.path.exists(destination)
+        assert tetromino.load_cache(source, digest, 10, 20) is not None
+        replaced.append(destination)
+        replace(source, destination)
+
+    with open(shapes_file, 'rb') as f:
+        digest = hashlib.sha256(f.read()).digest()
+    monkeypatch.setattr(os, 'replace', check_replace)
+    tetromino.load(shapes_file, 10, 20)
+    assert replaced == [cache_path(shapes_file)]
+    assert sorted(os.listdir(os.path.dirname(shapes_file))) == ['shapes.txt', 'shapes.txt.10x20.cache']
+
+def test_failed_cache_write_keeps_the_old_cache(shapes_file, monkeypatch):
+    tetromino.load(shapes_file, 10, 20)
+    with open(cache_path(shapes_file), 'rb') as f:
+        old_cache = f.read()
+    with open(shapes_file, 'a') as f:
+        f.write('\n')
+
+    def fail(source, destination):
+        raise OSError('read only')
+
+    monkeypatch.setattr(os, 'replace', fail)
+    assert tetromino.load(shapes_file, 10, 20) is not None
+    # the old cache is left whole and the half written one is removed
+    with open(cache_path(shapes_file), 'rb') as f:
+        assert f.read() == old_cache
+    assert sorted(os.listdir(os.path.dirname(shapes_file))) == ['shapes.txt', 'shapes.txt.10x20.cache']
@@ -1,35 +1,63 @@
 import math
-import pygame
-from random import randint
+from random import Random
 import tetromino
+import sequence
 
 # an instance of the Tetris game
 class Tetris:
-    def __init__(self, grid_width, grid_height, cell_width):
-        self.grid_width = grid_width
-        self.grid_height = grid_height
+    def __init__(self, shapes, cell_width, seed=None, distribution='bag', start_grid=None,
+        hold=False, preview_size=1):
+        # ShapeSet that this game is played with, it also decides the grid size
+        self.shapes = shapes
+        self.grid_width = shapes.grid_width
+        self.grid_height = shapes.grid_height
         self.cell_width = cell_width
         # whether or not the game has been lost yet
         self.lost = False
         self.lines_cleared = 0
-        self.font = pygame.font.Font(pygame.font.get_default_font(), 24)
+        # number of tetrominos placed so far
+        self.pieces_placed = 0
+        # the font is only needed for rendering, so it is created on first use
+        # this keeps headless games (e.g. on remote workers) free of pygame state
+        self.font = None
+
+        # each game owns its random number generator so that a game can be
+        # reproduced exactly from its seed
+        # a seed is always chosen so that any game can be replayed later
+        self.seed = seed if seed is not None else Random().getrandbits(32)
+        self.random = Random(self.seed)
+        # optional GameRecorder that logs every placement
+        self.recorder = None
 
         # the Tetris grid begins at the top-left corner
         # and can be indexed by grid[x][y]
+        # a game can also start from a copy of a given grid, see positions.py
         self.grid = []
         for x in range(self.grid_width):
-            col = [0] * self.grid_height
+            col = [0] * self.grid_height if start_grid is None else list(start_grid[x])
             self.grid.append(col)
 
-        # generate random sequence of tetrominos
-        # the sequence will contain all types of tetrominos (excluding rotation)
-        # when all the tetrominos in the sequence have been used, another
-        # sequence will be generated. this this is to ensure that the distribution is fair
-        self.tmino_seq = self.generate_tetromino_seq()
-        self.current_tmino = self.tmino_seq[-1]
-        self.tmino_seq.pop()
-        self.next_tmino = self.tmino_seq[-1]
-        self.tmino_seq.pop()
+        # stream of tetromino ids, see sequence.py for the available distributions
+        # by default every type of tetromino appears once in each group of
+        # unique_types tetrominos, this is to ensure that the distribution is fair
+        self.distribution = distribution
+        self.tmino_seq = sequence.distributions[distribution](self.random, self.shapes, self)
+        # only the current tetromino is an actual Tetromino object, it is reused
+        # for every tetromino of the game
+        self.current_tmino = None
+        # ids of the upcoming tetrominos, drawn preview_size ahead of the current one
+        # the sequence of a seed is the same whatever the preview size
+        self.preview = [next(self.tmino_seq) for i in range(max(preview_size, 1))]
+        # the tetromino set aside by hold, if holding is enabled
+        self.hold_enabled = hold
+        self.hold_id = None
+        # a tetromino can only be held once before it is placed
+        self.can_hold = hold
+        self.spawn_tetromino()
+        # a start grid may leave no room for the first tetromino
+        if is_colliding(self.grid, self.current_tmino):
+            self.current_tmino = None
+            self.lost = True
 
         # keep track of the next move, used by the AI
         self.next_move = None
@@ -40,7 +68,16 @@ class Tetris:
             return
 
         if self.next_move != None:
-            self.current_tmino = self.next_move
+            # a move of another type of tetromino than the current one is made
+            # by holding the current one first
+            if self.next_move.id != self.current_tmino.id and self.can_hold:
+                self.hold()
+                if self.lost:
+                    return
+        if self.next_move != None and self.next_move.id == self.current_tmino.id:
+            self.current_tmino.set_type(self.next_move.id, self.next_move.rotation)
+            self.current_tmino.x_pos = self.next_move.x_pos
+            self.current_tmino.y_pos = self.next_move.y_pos
 
         self.current_tmino.y_pos += 1
         # if tetromino is now colliding, then move it back and place it down
@@ -49,14 +86,18 @@ class Tetris:
             self.place_tetromino()
 
     def render(self, surface, next_move_outline):
+        # pygame is only imported when rendering, so that headless games and
+        # tools using the AI do not depend on it
+        import pygame
         # draw grid
         for x in range(self.grid_width):
             for y in range(self.grid_height):
                 # draw the cell if it is non empty
+                # cells of unknown type (see compact.py) are negative and drawn gray
                 if self.grid[x][y] != 0:
                     pygame.draw.rect(
                         surface,
-                        tetromino.get_tetromino_color(self.grid[x][y]),
+                        self.shapes.get_tetromino_color(self.grid[x][y]) if self.grid[x][y] > 0 else (128, 128, 128),
                         (x * self.cell_width, y * self.cell_width, self.cell_width - 1, self.cell_width - 1))
         # draw a divider line
         pygame.draw.rect(
@@ -80,6 +121,8 @@ class Tetris:
             # if specified, draw the next move outline
             if next_move_outline:
                 if self.next_move != None:
+                    # the next move may be of the held tetromino, which can differ in size
+                    block_data = self.next_move.block_data
                     pos_x = self.next_move.x_pos
                     pos_y = self.next_move.y_pos
                     for x in range(len(block_data)):
@@ -96,80 +139,80 @@ class Tetris:
             (self.grid_width + 1) * self.cell_width, self.cell_width * 1.5)
         surface.blit(text_next, rect_next)
 
-        # render next tetromino under next piece next
-        block_data = self.next_tmino.block_data
-        pos_x = self.grid_width + 1
-        pos_y = 3.5
-        for x in range(len(block_data)):
-            for y in range(len(block_data[0])):
-                if block_data[x][y]:
-                    pygame.draw.rect(
-                        surface,
-                        self.next_tmino.color,
-                        ((x + pos_x) * self.cell_width, (y + pos_y) * self.cell_width,
-                        self.cell_width - 1, self.cell_width - 1))
+        # render next tetromino under next piece next, unless a replay does not know it
+        if self.next_id is not None:
+            next_tmino = self.next_tmino
+            block_data = next_tmino.block_data
+            pos_x = self.grid_width + 1
+            pos_y = 3.5
+            for x in range(len(block_data)):
+                for y in range(len(block_data[0])):
+                    if block_data[x][y]:
+                        pygame.draw.rect(
+                            surface,
+                            next_tmino.color,
+                            ((x + pos_x) * self.cell_width, (y + pos_y) * self.cell_width,
+                            self.cell_width - 1, self.cell_width - 1))
 
         # draw lines cleared text
         text_cleared, rect_cleared = self.render_text('Lines cleared:',
-            (self.grid_width + 1) * self.cell_width, (tetromino.get_largest_tetromino_size() + 3) * self.cell_width)
+            (self.grid_width + 1) * self.cell_width, (self.shapes.get_largest_tetromino_size() + 3) * self.cell_width)
         surface.blit(text_cleared, rect_cleared)
 
         # draw lines cleared number
         text_lines, rect_lines = self.render_text(str(self.lines_cleared),
-            (self.grid_width + 1) * self.cell_width, (tetromino.get_largest_tetromino_size() + 4) * self.cell_width)
+            (self.grid_width + 1) * self.cell_width, (self.shapes.get_largest_tetromino_size() + 4) * self.cell_width)
         surface.blit(text_lines, rect_lines)
 
+        # the held tetromino and the rest of the preview go in a second column
+        if self.hold_enabled or len(self.preview) > 1:
+            largest_size = self.shapes.get_largest_tetromino_size()
+            column_x = self.grid_width + largest_size + 2
+            if self.hold_enabled:
+                text_hold, rect_hold = self.render_text('Hold:', column_x * self.cell_width, self.cell_width * 1.5)
+                surface.blit(text_hold, rect_hold)
+                if self.hold_id is not None:
+                    self.render_piece(surface, self.hold_id, column_x, 3.5, self.cell_width)
+            if len(self.preview) > 1:
+                text_preview, rect_preview = self.render_text('Preview:',
+                    column_x * self.cell_width, (largest_size + 3) * self.cell_width)
+                surface.blit(text_preview, rect_preview)
+                # later tetrominos are drawn at half size
+                for i, id in enumerate(self.preview[1:]):
+                    self.render_piece(surface, id, 2 * column_x, 2 * (largest_size + 4.5) + i * (largest_size + 1),
+                        self.cell_width // 2)
+
+    # draws a tetromino in its spawn rotation with its top left corner at a
+    # position given in cells of the given width
+    def render_piece(self, surface, id, pos_x, pos_y, cell_width):
+        import pygame
+        tmino = tetromino.Tetromino(self.shapes, id)
+        for x in range(tmino.size):
+            for y in range(tmino.size):
+                if tmino.block_data[x][y]:
+                    pygame.draw.rect(
+                        surface,
+                        tmino.color,
+                        ((x + pos_x) * cell_width, (y + pos_y) * cell_width, cell_width - 1, cell_width - 1))
+
 
     # places the current tetromino down and generates a new one
     def place_tetromino(self):
-        # transfer the tetromino data to the grid data
-        for x in range(self.current_tmino.size):
-            for y in range(self.current_tmino.size):
-                if self.current_tmino.block_data[x][y]:
-                    # skip if the cell is out of bounds
-                    grid_x = x + self.current_tmino.x_pos
-                    grid_y = y + self.current_tmino.y_pos
-                    if grid_x < 0 or grid_x >= self.grid_width or grid_y < 0 or grid_y >= self.grid_height:
-                        continue
-                    self.grid[grid_x][grid_y] = self.current_tmino.id
-        # check for cleared lines
-        # start from lowest possible line and go up
-        current_y = self.current_tmino.y_pos + self.current_tmino.size - 1
-        for i in range(self.current_tmino.size):
-            # check if this line is out of bounds
-            if current_y >= self.grid_height:
-                current_y -= 1
-                continue
-            # check for line clear
-            line_cleared = True
-            for x in range(self.grid_width):
-                if self.grid[x][current_y] == 0:
-                    line_cleared = False
-                    break
-            # move everything above line down one block if cleared
-            if line_cleared:
-                self.lines_cleared += 1
-                for y in range(current_y, 0, -1):
-                    for x in range(self.grid_width):
-                        self.grid[x][y] = self.grid[x][y - 1]
-                # clear upper most line
-                for x in range(self.grid_width):
-                    self.grid[x][0] = 0
-            else:
-                # otherwise go to next line
-                current_y -= 1
+        if self.recorder is not None:
+            self.recorder.record(self)
+        self.lines_cleared += lock_tetromino(self.grid, self.current_tmino)
+        self.pieces_placed += 1
 
         # generate a new tetromino
-        self.current_tmino = self.next_tmino
-        if len(self.tmino_seq) == 0:
-            self.tmino_seq = self.generate_tetromino_seq()
-        self.next_tmino = self.tmino_seq[-1]
-        self.tmino_seq.pop()
+        self.spawn_tetromino()
+        self.can_hold = self.hold_enabled
 
         # determine if it is colliding with anything
         if is_colliding(self.grid, self.current_tmino):
             self.current_tmino = None
             self.lost = True
+            if self.recorder is not None:
+                self.recorder.close()
 
     def move_left(self):
         self.current_tmino.x_pos -= 1
@@ -199,21 +242,58 @@ class Tetris:
         if is_colliding(self.grid, self.current_tmino):
             self.current_tmino.rotate(clockwise=False)
 
-    def generate_tetromino_seq(self):
-        seq = []
-        id_list = [i for i in range(1, tetromino.unique_types + 1)]
-        # randomly pull ids from the list and put it into the sequence
-        while len(id_list) != 0:
-            rand_idx = randint(0, len(id_list) - 1)
-            id = id_list[rand_idx]
-            id_list.pop(rand_idx)
-            tmino = tetromino.Tetromino(id)
-            tmino.x_pos = (tmino.max_x - tmino.min_x) // 2
-            tmino.y_pos = tmino.min_y
-            seq.append(tmino)
-        return seq
+    # sets the current tetromino aside and takes the held one in its place,
+    # or the next one if nothing is held yet
+    # returns whether the tetromino could be held
+    def hold(self):
+        if not self.can_hold:
+            return False
+        held_id = self.current_tmino.id
+        if self.hold_id is None:
+            self.spawn_tetromino()
+        else:
+            self.spawn_tetromino(self.hold_id)
+        self.hold_id = held_id
+        self.can_hold = False
+        if is_colliding(self.grid, self.current_tmino):
+            self.current_tmino = None
+            self.lost = True
+            if self.recorder is not None:
+                self.recorder.close()
+        return True
+
+    # makes the next tetromino in the sequence the current one, or the tetromino
+    # of the given id, placing it at the top middle of the grid
+    def spawn_tetromino(self, id=None):
+        if id is None:
+            id = self.preview.pop(0)
+            self.preview.append(next(self.tmino_seq))
+        if self.current_tmino is None:
+            self.current_tmino = tetromino.Tetromino(self.shapes, id)
+        else:
+            self.current_tmino.set_type(id, 0)
+        self.current_tmino.x_pos = (self.current_tmino.max_x - self.current_tmino.min_x) // 2
+        self.current_tmino.y_pos = self.current_tmino.min_y
+
+    # the id of the next tetromino, the first of the preview
+    @property
+    def next_id(self):
+        return self.preview[0]
+
+    @next_id.setter
+    def next_id(self, id):
+        self.preview[0] = id
+
+    # the next tetromino, created on demand since it is only needed for
+    # rendering and lookahead
+    @property
+    def next_tmino(self):
+        return tetromino.Tetromino(self.shapes, self.next_id)
 
     def render_text(self, text, top, left):
+        import pygame
+        if self.font is None:
+            self.font = pygame.font.Font(pygame.font.get_default_font(), 24)
         text_render = self.font.render(text, True, (255, 255, 255))
         text_rect = text_render.get_rect()
         text_rect.topleft = (top, left)
@@ -235,3 +315,47 @@ def is_colliding(grid, tetromino):
                     or grid[grid_x][grid_y] != 0):
                     return True
     return False
+
+# transfers a tetromino to the grid and clears any filled lines
+# returns the number of lines cleared
+def lock_tetromino(grid, tmino):
+    grid_width = len(grid)
+    grid_height = len(grid[0])
+    lines_cleared = 0
+    # transfer the tetromino data to the grid data
+    for x in range(tmino.size):
+        for y in range(tmino.size):
+            if tmino.block_data[x][y]:
+                # skip if the cell is out of bounds
+                grid_x = x + tmino.x_pos
+                grid_y = y + tmino.y_pos
+                if grid_x < 0 or grid_x >= grid_width or grid_y < 0 or grid_y >= grid_height:
+                    continue
+                grid[grid_x][grid_y] = tmino.id
+    # check for cleared lines
+    # start from lowest possible line and go up
+    current_y = tmino.y_pos + tmino.size - 1
+    for i in range(tmino.size):
+        # check if this line is out of bounds
+        if current_y >= grid_height:
+            current_y -= 1
+            continue
+        # check for line clear
+        line_cleared = True
+        for x in range(grid_width):
+            if grid[x][current_y] == 0:
+                line_cleared = False
+                break
+        # move everything above line down one block if cleared
+        if line_cleared:
+            lines_cleared += 1
+            for y in range(current_y, 0, -1):
+                for x in range(grid_width):
+                    grid[x][y] = grid[x][y - 1]
+            # clear upper most line
+            for x in range(grid_width):
+                grid[x][0] = 0
+        else:
+            # otherwise go to next line
+            current_y -= 1
+    return lines_cleared
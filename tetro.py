@@ -1,13 +1,18 @@
 import sys
-import math
+import json
 import pygame
 from time import time_ns
 from datetime import datetime
-from copy import deepcopy
-from random import random, randint
 from tetris import Tetris
+from compact import CompactGame
 from ai import TetrisAI
+from features import FeatureSet, default_features
 import tetromino
+import properties
+import evolution
+import evaluation
+import stats
+import surrogate
 
 class Tetro:
     """Entry point for Tetro.
@@ -23,6 +28,19 @@ class Tetro:
         self.population_size = 0
         self.selection_size = 0
         self.mutate_rate = 0
+        self.piece_distribution = 'bag'
+        self.features = default_features
+        self.surrogate_candidates = 1
+        self.surrogate_probe_pieces = 100
+        # whether games are kept as CompactGame instead of Tetris
+        self.compact_games = False
+        # generational, or steady_state to replace each game as soon as it is lost
+        self.evolution_mode = 'generational'
+        # hold slot, preview and the budget of the search over them, see
+        # evaluation.game_options
+        self.game_options = evaluation.game_options({})
+        self.hold = False
+        self.preview_size = 1
         self.generation = 0
 
         # size of cell in pixels (for rendering)
@@ -34,9 +52,29 @@ class Tetro:
 
         # index of the tetris game that is currently being rendered to screen
         self.current_spectating_idx = 0
+        # the game that was rendered last
+        self.rendered_instance = None
 
         self.load_properties()
-        tetromino.load('data/shapes.txt', self.grid_width, self.grid_height)
+        self.shapes = tetromino.load('data/shapes.txt', self.grid_width, self.grid_height)
+        self.feature_set = FeatureSet.get(self.features, self.grid_width, self.grid_height)
+        # screens bred children before they play, if enabled
+        self.screen = None
+        if self.surrogate_candidates > 1:
+            self.screen = surrogate.SurrogateScreen(self.feature_set.num_weights, self.surrogate_candidates,
+                self.surrogate_probe_pieces, distribution=self.piece_distribution, game_options=self.game_options)
+        # in steady-state mode, the fittest AIs seen so far and the aggregates of
+        # the games finished since the last report
+        self.archive = None
+        self.round_stats = None
+        if self.evolution_mode == 'steady_state':
+            self.archive = evolution.Archive(self.population_size, self.shapes, self.feature_set)
+        elif self.evolution_mode != 'generational':
+            raise ValueError(f'Unknown evolution mode: {self.evolution_mode}')
+        if self.compact_games and (self.hold or self.preview_size > 1):
+            raise ValueError('Compact games support neither hold nor a preview of more than one tetromino')
+        # searches over hold and the preview, if a budget is set
+        self.search = evaluation.game_arguments(self.game_options)['search']
         self.init_pygame()
 
         # list of ai delays that can be toggled through
@@ -46,6 +84,14 @@ class Tetro:
 
         # path to save the highest scoring AI weights to
         self.output_weight_path = 'data/weights.txt'
+        # path to save the weights of the highest scoring AI of the latest
+        # generation to, in the format read by server.py
+        self.output_json_path = 'data/best_weights.json'
+        # prefix of the files generation statistics are exported to
+        self.output_stats_prefix = 'data/stats'
+        self.stats_exporter = None
+        # when the current generation started, in nanoseconds
+        self.generation_start_time = 0
         self.highest_score = 0
         self.next_move_outline = True
 
@@ -70,7 +116,10 @@ class Tetro:
         tetris_height = self.grid_height * self.cell_width
         # additional gui space is determined by the largest tetromino that can fit
         # this is since the gui will show the next tetromino piece
-        extra_width = (tetromino.get_largest_tetromino_size() + 2) * self.cell_width
+        extra_width = (self.shapes.get_largest_tetromino_size() + 2) * self.cell_width
+        # a second column for the held tetromino and the rest of the preview
+        if self.hold or self.preview_size > 1:
+            extra_width *= 2
         self.pygame_surface = pygame.display.set_mode((tetris_width + extra_width, tetris_height))
 
     def handle_start_button_press(self):
@@ -83,30 +132,24 @@ class Tetro:
 
     # loads game options from the properties file
     def load_properties(self):
-        with open('data/properties.txt', 'r') as f:
-            for line in f:
-                line = line.strip()
-                # ignore blank lines and comments
-                if len(line) == 0 or line[0] == '#':
-                    continue
-                # parse key=value
-                idx_equals = line.find('=')
-                if idx_equals == -1:
-                    print(f'Line corrupt: {line}')
-                key = line[:idx_equals]
-                value = line[idx_equals + 1:]
-                if key == 'grid_width':
-                    self.grid_width = int(value)
-                elif key == 'grid_height':
-                    self.grid_height = int(value)
-                elif key == 'population_size':
-                    self.population_size = int(value)
-                elif key == 'selection_size':
-                    self.selection_size = int(value)
-                elif key == 'mutate_rate':
-                    self.mutate_rate = float(value)
+        props = properties.load('data/properties.txt')
+        self.grid_width = props['grid_width']
+        self.grid_height = props['grid_height']
+        self.population_size = props['population_size']
+        self.selection_size = props['selection_size']
+        self.mutate_rate = props['mutate_rate']
+        self.piece_distribution = props.get('piece_distribution', 'bag')
+        self.features = props.get('features', default_features)
+        self.surrogate_candidates = props.get('surrogate_candidates', 1)
+        self.surrogate_probe_pieces = props.get('surrogate_probe_pieces', 100)
+        self.compact_games = props.get('compact_games', False)
+        self.evolution_mode = props.get('evolution_mode', 'generational')
+        self.game_options = evaluation.game_options(props)
+        self.hold = self.game_options['hold']
+        self.preview_size = self.game_options['preview_size']
 
     def game_loop(self):
+        self.stats_exporter = stats.StatsExporter(self.output_stats_prefix)
         self.generate_random_games(self.population_size)
         self.print_starting_generation()
         game_clock = pygame.time.Clock()
@@ -142,20 +185,29 @@ class Tetro:
     def update(self):
         # update all Tetris instances that have not lost yet
         all_lost = True
-        for inst, ai in zip(self.tetris_instances, self.tetris_ais):
+        for i, (inst, ai) in enumerate(zip(self.tetris_instances, self.tetris_ais)):
             inst.update()
             if inst.lost:
+                # in steady-state mode a lost game is replaced right away
+                if self.archive is not None:
+                    self.replace_game(i)
+                    all_lost = False
                 continue
             all_lost = False
-            inst.next_move = ai.compute_move(inst)
+            inst.next_move = ai.compute_move(inst, self.search)
 
         # start next generation if all Tetris instances have lost
         if all_lost:
             self.next_generation()
 
     def render(self):
+        inst = self.tetris_instances[self.current_spectating_idx]
+        # compact games only keep what is needed for drawing while they are watched
+        if isinstance(self.rendered_instance, CompactGame) and self.rendered_instance is not inst:
+            self.rendered_instance.view = None
+        self.rendered_instance = inst
         self.pygame_surface.fill((0, 0, 0))
-        self.tetris_instances[self.current_spectating_idx].render(self.pygame_surface, self.next_move_outline)
+        inst.render(self.pygame_surface, self.next_move_outline)
         pygame.display.flip()
 
     # handles keyboard and window input
@@ -258,8 +310,48 @@ class Tetro:
         self.tetris_instances.clear()
         self.tetris_ais.clear()
         for i in range(num):
-            self.tetris_instances.append(Tetris(self.grid_width, self.grid_height, self.cell_width))
-            self.tetris_ais.append(TetrisAI(self.grid_width, self.grid_height, [], [], []))
+            self.tetris_instances.append(self.new_game())
+            self.tetris_ais.append(TetrisAI(self.shapes, feature_set=self.feature_set))
+
+    def replace_game(self, idx):
+        """Adds the AI of a lost game to the archive and starts a new game in
+        its place with a child bred from the archive."""
+
+        inst, ai = self.tetris_instances[idx], self.tetris_ais[idx]
+        self.archive.add(ai, inst.lines_cleared)
+        if self.round_stats is None:
+            self.round_stats = stats.GenerationStats(self.generation, self.feature_set.num_weights)
+        self.round_stats.add(inst.lines_cleared, ai.weights, inst.pieces_placed)
+
+        if self.screen is not None:
+            self.screen.record(ai.weights, inst.lines_cleared)
+            candidates = [self.archive.breed(self.selection_size, self.mutate_rate)
+                for i in range(self.screen.num_candidates(1))]
+            child = self.screen.select(candidates, 1)[0]
+        else:
+            child = self.archive.breed(self.selection_size, self.mutate_rate)
+        if self.rendered_instance is inst and isinstance(inst, CompactGame):
+            inst.view = None
+        self.tetris_instances[idx] = self.new_game()
+        self.tetris_ais[idx] = child
+
+        # report once for every population_size finished games, like a generation
+        if self.round_stats.games == self.population_size:
+            summary = self.round_stats.summary((time_ns() - self.generation_start_time) / 1e9)
+            print(stats.format_summary(summary))
+            self.stats_exporter.write(summary)
+            self.generation += 1
+            best_score, best_ai = self.archive.best()
+            print(f'Archive best: {best_score} lines cleared')
+            self.save_weights(best_ai, best_score)
+            self.round_stats = None
+            self.print_starting_generation()
+
+    def new_game(self):
+        if self.compact_games:
+            return CompactGame(self.shapes, self.cell_width, distribution=self.piece_distribution)
+        return Tetris(self.shapes, self.cell_width, distribution=self.piece_distribution,
+            hold=self.hold, preview_size=self.preview_size)
 
     def next_generation(self):
         """Ends the current generation and produces the next generation of AIs."""
@@ -270,56 +362,53 @@ class Tetro:
         list.sort(fitness_scores, key=lambda elem: elem[0])
         fitness_scores.reverse()
 
-        avg_all = sum([elem[0] for elem in fitness_scores]) / len(fitness_scores)
-        print('Lines cleared: ', self.format_float_list([elem[0] for elem in fitness_scores], num_decimals=0, delimiter=' '))
-        print('Lines cleared average: ', self.format_float_list([avg_all]))
+        summary = self.generation_stats(self.generation - 1).summary((time_ns() - self.generation_start_time) / 1e9)
+        print(stats.format_summary(summary))
+        self.stats_exporter.write(summary)
 
         highest_scores = fitness_scores[:self.selection_size]
         avg_most = sum([elem[0] for elem in highest_scores]) / len(highest_scores)
-        print('Most lines cleared: ', self.format_float_list([elem[0] for elem in highest_scores], num_decimals=0, delimiter=' '))
         print('Most lines cleared average: ', self.format_float_list([avg_most]))
 
-        print('Most cleared row filled weights: ', self.format_float_list(self.tetris_ais[highest_scores[0][1]].row_filled_weights, brackets=True))
-        print('Most cleared hole height weights: ', self.format_float_list(self.tetris_ais[highest_scores[0][1]].hole_height_weights, brackets=True))
-        print('Most cleared column diff weights: ', self.format_float_list(self.tetris_ais[highest_scores[0][1]].column_diff_weights, brackets=True))
-
-        # save the weights of the highest scoring AI
-        with open('data/weights.txt', 'a') as f:
-            f.write('\n')
-            f.write(str(datetime.now()) + '\n')
-            f.write(f'Generation: {self.generation - 1} | Instance: {self.current_spectating_idx + 1}/{self.population_size}\n')
-            f.write(f'Lines cleared: {fitness_scores[0][0]}\n')
-            f.write(self.format_float_list(self.tetris_ais[highest_scores[0][1]].row_filled_weights, brackets=True) + '\n')
-            f.write(self.format_float_list(self.tetris_ais[highest_scores[0][1]].hole_height_weights, brackets=True) + '\n')
-            f.write(self.format_float_list(self.tetris_ais[highest_scores[0][1]].column_diff_weights, brackets=True) + '\n')
+        self.save_weights(self.tetris_ais[highest_scores[0][1]], fitness_scores[0][0])
 
         # prepare next generation
-        new_ais = []
-        # create completely new AIs if the average was too low
-        if avg_most <= 0.1:
-            [new_ais.append(TetrisAI(self.grid_width, self.grid_height, [], [], [])) for i in range(self.population_size)]
-        else:
-            # produce new generation
-            # let the upper third of the most fit of this generation continue on as is
-            for i in range(self.population_size // 2):
-                new_ais.append(self.tetris_ais[fitness_scores[i][1]].clone())
-            # then crossover until the population size is reached
-            while len(new_ais) != self.population_size:
-                # randomly select two different parents
-                idx1 = randint(0, len(highest_scores) - 1)
-                idx2 = idx1
-                while idx2 == idx1:
-                    idx2 = randint(0, len(highest_scores) - 1)
-                new_ais.append(self.tetris_ais[highest_scores[idx1][1]].crossover(
-                    self.tetris_ais[highest_scores[idx2][1]]))
-                new_ais[-1].mutate(self.mutate_rate)
+        if self.screen is not None:
+            # survivors were recorded in the generation they were bred, recording
+            # them again would weigh the model towards the same few weights
+            for inst, ai in zip(self.tetris_instances, self.tetris_ais):
+                if not ai.survivor:
+                    self.screen.record(ai.weights, inst.lines_cleared)
+        new_ais = evolution.breed(self.tetris_ais, fitness_scores,
+            self.population_size, self.selection_size, self.mutate_rate, self.screen)
+        if self.screen is not None and self.screen.num_screened:
+            print(f'Surrogate screening rejected {self.screen.num_rejected}/{self.screen.num_screened} candidate children so far')
 
         self.tetris_instances.clear()
-        [self.tetris_instances.append(Tetris(self.grid_width, self.grid_height, self.cell_width)) for i in range(self.population_size)]
+        [self.tetris_instances.append(self.new_game()) for i in range(self.population_size)]
         self.tetris_ais.clear()
         self.tetris_ais = new_ais
         self.print_starting_generation()
 
+    def save_weights(self, ai, lines_cleared):
+        """Prints and saves the weights of the highest scoring AI."""
+
+        for name, weights in ai.weights_by_feature():
+            print(f'Most cleared {name} weights: ', self.format_float_list(weights, brackets=True))
+
+        with open(self.output_weight_path, 'a') as f:
+            f.write('\n')
+            f.write(str(datetime.now()) + '\n')
+            f.write(f'Generation: {self.generation - 1} | Instance: {self.current_spectating_idx + 1}/{self.population_size}\n')
+            f.write(f'Lines cleared: {lines_cleared}\n')
+            f.write(f'Features: {",".join(self.feature_set.spec)}\n')
+            for name, weights in ai.weights_by_feature():
+                f.write(self.format_float_list(weights, brackets=True) + '\n')
+
+        # also save them on their own, so they can be loaded by other tools
+        with open(self.output_json_path, 'w') as f:
+            json.dump(ai.to_dict(), f)
+
     def update_gui_title(self):
         """Updates the Pygame's window title."""
 
@@ -333,27 +422,30 @@ class Tetro:
         """Prints a header for the new generation."""
 
         print(f'\n----- Starting Generation {self.generation} -----')
+        self.generation_start_time = time_ns()
 
-    # returns a list of tuples containing the Tetris instance index and its score in sorted order
-    def print_current_generation_stats(self):
-        """Gets information about the current generation of Tetris AIs.
+    def generation_stats(self, generation):
+        """Aggregates the games of the current generation so far."""
 
-        Returns:
-            A list of tuples containing the Tetris instance index and its score
-            in sorted order, example: [(3, 40), (2, 30), ... (9, 10)].
-        """
+        generation_stats = stats.GenerationStats(generation, self.feature_set.num_weights)
+        for inst, ai in zip(self.tetris_instances, self.tetris_ais):
+            generation_stats.add(inst.lines_cleared, ai.weights, inst.pieces_placed)
+        return generation_stats
 
-        # get fitness scores and sort
-        fitness_scores = [(inst.lines_cleared, '' if inst.lost else ' (Alive)') for i, inst in enumerate(self.tetris_instances)]
-        print('\nLines cleared: ', (', ').join([f'{elem[0]}{elem[1]}' for elem in fitness_scores]))
+    def print_current_generation_stats(self):
+        """Prints aggregates of the current generation of Tetris AIs so far."""
+
+        num_alive = len([inst for inst in self.tetris_instances if not inst.lost])
+        summary = self.generation_stats(self.generation).summary((time_ns() - self.generation_start_time) / 1e9)
+        print(f'\nAlive: {num_alive}/{self.population_size}')
+        print(stats.format_summary(summary))
 
     def print_current_game_stats(self):
         """Prints to console the status of the currently spectated game."""
 
         print(f'\nYou are currently viewing game: {self.current_spectating_idx + 1}')
-        print('Row filled weights: ', self.format_float_list(self.tetris_ais[self.current_spectating_idx].row_filled_weights, brackets=True))
-        print('Hole height weights: ', self.format_float_list(self.tetris_ais[self.current_spectating_idx].hole_height_weights, brackets=True))
-        print('Column diff weights: ', self.format_float_list(self.tetris_ais[self.current_spectating_idx].column_diff_weights, brackets=True))
+        for name, weights in self.tetris_ais[self.current_spectating_idx].weights_by_feature():
+            print(f'{name} weights: ', self.format_float_list(weights, brackets=True))
 
     def format_float_list(self, float_list, num_decimals=2, delimiter=', ', brackets=False):
         """Returns a nicely formatted list of floats."""
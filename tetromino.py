@@ -1,68 +1,145 @@
+import os
 import re as regexp
-from copy import deepcopy
-from random import randint
-
-# list of TetrominoType objects that describes all the possible tetrominos
-# and all possible rotations
-tmino_list = []
-
-# list of lists pointing to the indices of all rotationally unique tetrominos
-unique_tmino_list = []
-
-# number of unique types of tetrominos by shape
-unique_types = 0
-
-def load(file_path, grid_width, grid_height):
+import struct
+import marshal
+import hashlib
+import random
+
+# processed tetromino data is cached next to the shapes file, one cache file
+# per grid size; the header identifies the shapes file the cache was built from
+# bump cache_version whenever the layout of TetrominoType changes; the data
+# is stored with marshal, which unlike pickle never calls anything while
+# loading, so a cache left in a shared data folder cannot run code
+cache_header = struct.Struct('>4sH32sHH')
+cache_magic = b'TTRC'
+cache_version = 3
+
+def load(file_path, grid_width, grid_height, use_cache=True):
     """Loads tetromino data from the provided configuration file.
 
+    Parsing and processing the shapes is only done when the shapes file, grid
+    size or cache version has changed since the last time; otherwise the
+    processed data is read back from a cache file in a single read.
+
     Args:
         file_path: Location to shapes.txt file.
         grid_width: Number of columns in Tetris grid.
         grid_height: Number of rows in Tetris grid.
+        use_cache: Whether to read from and write to the cache file.
+
+    Returns:
+        A ShapeSet containing every tetromino in the file.
+    """
+
+    with open(file_path, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha256(source).digest()
+    cache_path = f'{file_path}.{grid_width}x{grid_height}.cache'
+    if use_cache:
+        shapes = load_cache(cache_path, digest, grid_width, grid_height)
+        if shapes is not None:
+            return shapes
+
+    shapes = parse(source.decode('utf-8').splitlines(), grid_width, grid_height)
+    if use_cache:
+        save_cache(cache_path, digest, shapes)
+    return shapes
+
+def load_cache(cache_path, digest, grid_width, grid_height):
+    """Loads processed tetromino data from a cache file.
+
+    Returns:
+        The cached ShapeSet, or None if there is no valid cache.
+    """
+
+    try:
+        with open(cache_path, 'rb') as f:
+            data = f.read()
+        magic, version, cache_digest, width, height = cache_header.unpack_from(data, 0)
+        if (magic != cache_magic or version != cache_version or cache_digest != digest
+            or width != grid_width or height != grid_height):
+            return None
+        return ShapeSet(*marshal.loads(data[cache_header.size:]))
+    # a truncated cache or one written by an older layout of the classes fails
+    # to load or construct, it is rebuilt like a missing one
+    except (OSError, struct.error, EOFError, ValueError, TypeError, IndexError):
+        return None
+
+def save_cache(cache_path, digest, shapes):
+    """Writes processed tetromino data to a cache file.
+
+    The data is written to a temporary file next to the cache and swapped in,
+    so processes starting at the same time never read a half written cache.
+    """
+
+    data = cache_header.pack(cache_magic, cache_version, digest, shapes.grid_width, shapes.grid_height)
+    data += marshal.dumps(shapes.fields())
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # the cache is only an optimization, e.g. the data folder may be read only
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+def parse(lines, grid_width, grid_height):
+    """Parses the lines of a shapes file and processes each tetromino.
+
+    Returns:
+        A ShapeSet containing every tetromino in the file.
     """
 
-    global unique_types
-
-    with open(file_path, 'r') as f:
-        color = ''
-        block_data = []
-        for line in f:
-            line = line.strip()
-            # ignore blank lines and comments
-            if len(line) == 0 or line[0] == '#':
-                continue
-            # start of new tetromino, reset all variables
-            if line == 'start':
-                unique_types += 1
-                block_data = []
-            elif line == 'end':
-                # after finishing reading data about tetromino; process it
-                # use unique_types as an id (acts like a counter)
-                process_tetromino(block_data, grid_width, grid_height, unique_types, color)
-            elif line.startswith('row'):
-                # read row of tetromino block data
-                row_data = regexp.split('(\s+)', line)[2]
-                for i in range(len(row_data)):
-                    # initialize block_data if this is the first row specified
-                    if len(block_data) == 0:
-                        for j in range(len(row_data)):
-                            block_data.append([])
-                    block_data[i].append(row_data[i] == 'O')
-            else:
-                # parse key=value
-                idx_equals = line.find('=')
-                if idx_equals == -1:
-                    print(f'Line corrupt: {line}')
-                key = line[:idx_equals]
-                value = line[idx_equals + 1:]
-                if key == 'color':
-                    color = tuple([int(token) for token in value.split(',')])
+    types = []
+    unique_rotations = []
+    color = ''
+    name = ''
+    block_data = []
+    for line in lines:
+        line = line.strip()
+        # ignore blank lines and comments
+        if len(line) == 0 or line[0] == '#':
+            continue
+        # start of new tetromino, reset all variables
+        if line == 'start':
+            block_data = []
+            name = ''
+        elif line == 'end':
+            # after finishing reading data about tetromino; process it
+            # ids start at 1 and count up in the order of the file
+            rotation_types, rotations = process_tetromino(block_data, grid_width, grid_height,
+                len(unique_rotations) + 1, color, name)
+            types.extend(rotation_types)
+            unique_rotations.append(rotations)
+        elif line.startswith('row'):
+            # read row of tetromino block data
+            row_data = regexp.split(r'(\s+)', line)[2]
+            for i in range(len(row_data)):
+                # initialize block_data if this is the first row specified
+                if len(block_data) == 0:
+                    for j in range(len(row_data)):
+                        block_data.append([])
+                block_data[i].append(row_data[i] == 'O')
+        else:
+            # parse key=value
+            idx_equals = line.find('=')
+            if idx_equals == -1:
+                print(f'Line corrupt: {line}')
+            key = line[:idx_equals]
+            value = line[idx_equals + 1:]
+            if key == 'color':
+                color = tuple([int(token) for token in value.split(',')])
+            elif key == 'name':
+                name = value
+    return ShapeSet([tmino_type.fields() for tmino_type in types], unique_rotations, grid_width, grid_height)
 
 # given tetromino block data; compute information
-# about rotation and position and add to tetromino_types
-def process_tetromino(block_data, grid_width, grid_height, id, color):
-    """Processes data about a Tetromino and stores it into tmino_list and
-    unique_tmino_list.
+# about rotation and position
+def process_tetromino(block_data, grid_width, grid_height, id, color, name=''):
+    """Processes data about a Tetromino.
 
     This precomputed data is used to allow the Tetris instance and AI to become
     much faster.
@@ -71,29 +148,30 @@ def process_tetromino(block_data, grid_width, grid_height, id, color):
         block_data: A square 2d array describing a Tetromino.
         grid_width: Number of columns in Tetris grid.
         grid_height: Number of rows in Tetris grid.
-    """
+        id: Id of the tetromino.
+        color: Color of the tetromino as an (r, g, b) tuple.
+        name: Optional name of the tetromino, e.g. 'S'.
 
-    global tmino_list;
-    global unique_tmino_list;
+    Returns:
+        A tuple of the TetrominoType objects of all four rotations, and a list
+        of the rotationally unique rotations.
+    """
 
     # go through each of the four possible rotations and find minimum and maximum
-    # x and y coordinates, add these to the tmino_list
-    tmino_width = len(block_data)
-    tmino_height = len(block_data)
+    # x and y coordinates
+    types = []
     for i in range(4):
         if i != 0:
             block_data = rotate(block_data)
-        # find min/max x/y
-        min_x, min_y, max_x, max_y = 0, 0, 0, 0
-        while not out_of_bounds(block_data, min_x - 1, 0, grid_width, grid_height):
-            min_x -= 1
-        while not out_of_bounds(block_data, 0, min_y - 1, grid_width, grid_height):
-            min_y -= 1
-        while not out_of_bounds(block_data, max_x + 1, 0, grid_width, grid_height):
-            max_x += 1
-        while not out_of_bounds(block_data, 0, max_y + 1, grid_width, grid_height):
-            max_y += 1
-        tmino_list.append(TetrominoType(id, block_data, len(block_data), min_x, min_y, max_x, max_y, i, color))
+        # find min/max x/y, i.e. the range of positions that keep every filled
+        # cell of the tetromino inside the grid
+        cells = [(x, y) for x in range(len(block_data)) for y in range(len(block_data)) if block_data[x][y]]
+        min_x = -min([cell[0] for cell in cells])
+        min_y = -min([cell[1] for cell in cells])
+        max_x = grid_width - 1 - max([cell[0] for cell in cells])
+        max_y = grid_height - 1 - max([cell[1] for cell in cells])
+        types.append(TetrominoType(id, block_data, len(block_data), min_x, min_y, max_x, max_y, i, color,
+            *compute_profiles(block_data), name))
 
     # determine the rotationally symmetrical tetrominoes
     # use the block_data given as the first rotational variant
@@ -104,14 +182,33 @@ def process_tetromino(block_data, grid_width, grid_height, id, color):
         # compare the current rotation with all of existing rotationally unique
         # tetrominos, if it does not already exist, then it must be unique
         for j in range(len(rotations)):
-            if not rotationally_unique(
-                get_tetromino_type(id, i).block_data,
-                get_tetromino_type(id, rotations[j]).block_data):
+            if not rotationally_unique(types[i].block_data, types[rotations[j]].block_data):
                 unique = False
                 break
         if unique:
             rotations.append(i)
-    unique_tmino_list.append(rotations)
+    return types, rotations
+
+def compute_profiles(block_data):
+    """Computes derived data about a tetromino that speeds up placing it.
+
+    Returns:
+        A tuple of the filled cells as (x, y) pairs, the top and bottom most
+        filled y of each column (-1 for empty columns), and a bitmask of the
+        filled columns of each row where bit x is column x.
+    """
+
+    size = len(block_data)
+    cells = tuple([(x, y) for x in range(size) for y in range(size) if block_data[x][y]])
+    column_tops = [-1] * size
+    column_bottoms = [-1] * size
+    row_masks = [0] * size
+    for x, y in cells:
+        if column_tops[x] == -1:
+            column_tops[x] = y
+        column_bottoms[x] = y
+        row_masks[y] |= 1 << x
+    return cells, tuple(column_tops), tuple(column_bottoms), tuple(row_masks)
 
 def rotationally_unique(block_data1, block_data2):
     """Determines if two tetrominos are rotationally unique."""
@@ -178,36 +275,6 @@ def rotate(block_data):
         new_block_data.append([block_data[y][len(block_data) - x - 1] for y in range(len(block_data))])
     return new_block_data
 
-def get_tetromino_type(id, rotation=0):
-    """Gets the TetrominoType object that corresponds to a given tetromino id
-    and rotation."""
-
-    return tmino_list[((id - 1) * 4) + (rotation % 4)]
-
-def random_tetromino():
-    """Generates a random tetromino in its first rotation state."""
-
-    # randomly choose a tetromino
-    idx = randint(0, unique_types - 1)
-    tmino_type = tmino_list[idx * 4]
-    # place it in the top middle of the grid
-    return Tetromino(idx + 1, 0,
-        (tmino_type.max_x - tmino_type.min_x) // 2 + tmino_type.min_x, tmino_type.min_y)
-
-def get_tetromino_color(id):
-    """Returns the color of the tetromino associated with a given id."""
-
-    return tmino_list[(id - 1) * 4].color
-
-def get_largest_tetromino_size():
-    """Returns the size of the largest tetromino."""
-
-    largest_idx = 0
-    for i in range(1, unique_types):
-        if tmino_list[i * 4].size > tmino_list[largest_idx * 4].size:
-            largest_idx = i
-    return tmino_list[largest_idx * 4].size
-
 def print_block_data(block_data):
     """Draws tetromino block data to the console."""
     for y in range(len(block_data)):
@@ -216,9 +283,11 @@ def print_block_data(block_data):
 class TetrominoType:
     """Preprocessed information about a tetromino."""
 
-    def __init__(self, id, block_data, size, min_x, min_y, max_x, max_y, rotation, color):
+    def __init__(self, id, block_data, size, min_x, min_y, max_x, max_y, rotation, color,
+        cells, column_tops, column_bottoms, row_masks, name=''):
         self.id = id
-        self.block_data = deepcopy(block_data)
+        # stored as tuples so that it can be shared safely
+        self.block_data = tuple([tuple(col) for col in block_data])
         self.size = size
         self.min_x = min_x
         self.min_y = min_y
@@ -226,18 +295,114 @@ class TetrominoType:
         self.max_y = max_y
         self.rotation = rotation
         self.color = color
+        # see compute_profiles
+        self.cells = cells
+        self.column_tops = column_tops
+        self.column_bottoms = column_bottoms
+        self.row_masks = row_masks
+        self.name = name
+
+    def fields(self):
+        """Returns the arguments needed to reconstruct this object."""
+
+        return (self.id, self.block_data, self.size, self.min_x, self.min_y, self.max_x, self.max_y,
+            self.rotation, self.color, self.cells, self.column_tops, self.column_bottoms, self.row_masks,
+            self.name)
+
+class ShapeSet:
+    """An immutable set of processed tetrominos for a given grid size.
+
+    Every Tetris game and AI takes the ShapeSet it plays with, so any number of
+    shape sets and grid sizes can be used side by side in one process. A
+    ShapeSet pickles to its processed data only, which makes it cheap to send
+    to other processes.
+    """
+
+    def __init__(self, types, unique_rotations, grid_width, grid_height):
+        """Creates a ShapeSet from processed tetromino data.
+
+        Args:
+            types: Fields of the TetrominoType of every rotation of every
+                tetromino, see TetrominoType.fields. Rotations of the same
+                tetromino are adjacent and ids start at 1.
+            unique_rotations: List of the rotationally unique rotations of
+                each tetromino.
+            grid_width: Number of columns in Tetris grid.
+            grid_height: Number of rows in Tetris grid.
+        """
+
+        set_attr = super().__setattr__
+        # list of TetrominoType objects that describes all the possible tetrominos
+        # and all possible rotations
+        set_attr('tmino_list', tuple([TetrominoType(*fields) for fields in types]))
+        # tuple of tuples pointing to the indices of all rotationally unique tetrominos
+        set_attr('unique_tmino_list', tuple([tuple(rotations) for rotations in unique_rotations]))
+        # number of unique types of tetrominos by shape
+        set_attr('unique_types', len(unique_rotations))
+        set_attr('grid_width', grid_width)
+        set_attr('grid_height', grid_height)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ShapeSet is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ShapeSet is immutable')
+
+    def __reduce__(self):
+        return (ShapeSet, self.fields())
+
+    def fields(self):
+        """Returns the arguments needed to reconstruct this object."""
+
+        return ([tmino_type.fields() for tmino_type in self.tmino_list],
+            self.unique_tmino_list, self.grid_width, self.grid_height)
+
+    def get_tetromino_type(self, id, rotation=0):
+        """Gets the TetrominoType object that corresponds to a given tetromino id
+        and rotation."""
+
+        return self.tmino_list[((id - 1) * 4) + (rotation % 4)]
+
+    def random_tetromino(self, rng=random):
+        """Generates a random tetromino in its first rotation state."""
+
+        # randomly choose a tetromino
+        idx = rng.randint(0, self.unique_types - 1)
+        tmino_type = self.tmino_list[idx * 4]
+        # place it in the top middle of the grid
+        return Tetromino(self, idx + 1, 0,
+            (tmino_type.max_x - tmino_type.min_x) // 2 + tmino_type.min_x, tmino_type.min_y)
+
+    def get_tetromino_id(self, name):
+        """Returns the id of the tetromino with the given name, or None."""
+
+        for i in range(self.unique_types):
+            if self.tmino_list[i * 4].name == name:
+                return i + 1
+        return None
+
+    def get_tetromino_color(self, id):
+        """Returns the color of the tetromino associated with a given id."""
+
+        return self.tmino_list[(id - 1) * 4].color
+
+    def get_largest_tetromino_size(self):
+        """Returns the size of the largest tetromino."""
+
+        return max([self.tmino_list[i * 4].size for i in range(self.unique_types)])
 
 class Tetromino:
     """An instance of a tetromino."""
 
-    def __init__(self, id, rotation=0, x_pos=0, y_pos=0):
+    def __init__(self, shapes, id, rotation=0, x_pos=0, y_pos=0):
+        self.shapes = shapes
         self.set_type(id, rotation)
         self.x_pos = x_pos
         self.y_pos = y_pos
 
     def set_type(self, id, rotation):
-        type = get_tetromino_type(id, rotation)
-        self.unique_rotations_list = unique_tmino_list[id - 1]
+        type = self.shapes.get_tetromino_type(id, rotation)
+        self.unique_rotations_list = self.shapes.unique_tmino_list[id - 1]
         self.block_data = type.block_data
         self.size = type.size
         self.min_x = type.min_x